@@ -1,163 +1,428 @@
 """
-文件监控脚本 - 自动检测Excel文件变化并运行创建文件夹脚本
-当社团报销.xlsx被修改保存后,自动执行create_folders.py
+文件监控脚本 - 自动检测Excel文件变化并运行同步引擎
+当社团报销.xlsx被修改保存后,在当前进程中调用create_folders.SyncEngine完成同步
+
+watchdog回调只负责把事件放入队列,由后台的SyncScheduler线程统一处理:
+- 连续多次保存会被合并,在安静期(debounce)过后只同步一次
+- 同一时间最多只运行一个同步
+- 同步过程中又有新的保存时,保证同步结束后再运行一次
+- 每次同步都会报告从保存到同步完成的延迟
+
+同时递归监控✅已完成和📋待处理(在base_dir上只建立一个递归监控,同步在两个状态文件夹之间移动行文件夹后,
+watchdog仍能按新路径报告其中的文件变化): 放入/删除票据文件时只重新统计对应的行文件夹,
+只写回该行的"文件数量"和"材料准备"单元格,不需要完整同步。
+因为文件夹的变化由监控负责,启动后的第一次同步是完整同步,之后的同步都是增量同步
+
+多个社团的台账可以在ledgers.json中配置(见ledger_config.py),由同一个监控进程负责:
+每个台账有自己的调度线程(同一个台账的同步总是串行),不同台账的同步共享 --workers 个工作槽并行执行
+
+--daemon: 同时在127.0.0.1上提供HTTP/JSON接口(见sync_api.py),可以触发同步、查询某一行的状态和文件数量、
+按付款人列出待处理的行、订阅同步事件;查询直接由常驻内存的状态回答,不读取Excel也不扫描文件夹
 """
 
+import argparse
+import contextlib
 import time
 import os
-import subprocess
+import queue
+import sys
+import threading
 from pathlib import Path
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
-class ExcelFileHandler(FileSystemEventHandler):
-    """监控Excel文件变化的处理器"""
-    
-    def __init__(self, excel_file, script_file):
+from create_folders import file_signature, setup_logging
+from ledger_config import load_ledgers
+from sync_api import DEFAULT_HOST, DEFAULT_PORT, SyncDaemon
+
+
+def is_file_locked(filepath):
+    """检查文件是否被占用(被Excel打开)"""
+    try:
+        # 尝试以独占模式打开文件
+        with open(filepath, 'r+b') as f:
+            pass
+        return False  # 文件未被占用
+    except (IOError, PermissionError):
+        return True  # 文件被占用
+
+
+class SyncScheduler:
+    """
+    防抖、合并事件的同步调度器
+
+    trigger() 可以在任意线程中调用(通常是watchdog的观察者线程),只是把事件放入队列,
+    不会阻塞;真正的等待和同步都在调度器自己的工作线程中完成
+    """
+
+    def __init__(self, excel_file, engine, debounce=2.0, max_lock_wait=60, folder_debounce=1.0, name=None, slots=None,
+                 on_event=None, initial_full_sync=True):
         self.excel_file = Path(excel_file).resolve()
-        self.script_file = Path(script_file).resolve()
-        self.last_modified = 0
-        self.cooldown = 2  # 冷却时间(秒),避免重复触发
-        self.pending_execution = False  # 是否有待执行的任务
-        
-    def is_file_locked(self, filepath):
-        """检查文件是否被占用(被Excel打开)"""
-        try:
-            # 尝试以独占模式打开文件
-            with open(filepath, 'r+b') as f:
-                pass
-            return False  # 文件未被占用
-        except (IOError, PermissionError):
-            return True  # 文件被占用
-            
-    def wait_for_file_close(self, filepath, max_wait=30):
-        """等待文件被关闭,最多等待max_wait秒"""
+        self.name = name or self.excel_file.name
+        self.slots = slots  # 多个台账共享的工作槽(Semaphore),限制同时运行的同步数
+        self.engine = engine  # 常驻内存的同步引擎,避免每次保存都重新启动解释器
+        self.debounce = debounce  # 安静期(秒): 最后一次保存之后等待这么久才开始同步
+        self.max_lock_wait = max_lock_wait  # 等待Excel关闭文件的最长时间(秒)
+        self.folder_debounce = folder_debounce  # 只有票据文件变化时使用的较短安静期(秒)
+        # 同步事件的回调 on_event(scheduler, 事件类型, 信息字典),在调度线程中调用(守护进程用它更新状态和推送事件)
+        self.on_event = on_event
+
+        self._events = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'SyncScheduler-{self.name}', daemon=True)
+        # 引擎自己最近一次写回Excel: (开始写入的时间, 写入后的文件签名),用于忽略自己触发的事件;
+        # 没有写回Excel的同步不会记录,同步期间用户的保存一定会再同步一次
+        self._own_write = None
+
+        # 以下状态只在调度线程中读写
+        # 启动后的第一次同步使用完整模式;initial_full_sync=False时(调用方刚刚用同一个引擎完整同步过)直接增量同步
+        self._full_sync_done = not initial_full_sync
+        self._full_requested = False  # 请求了完整同步但没能执行(Excel被占用或同步出错),下一轮执行
+        self._pending_folders = set()  # 因Excel被占用而没能更新的票据文件夹,下一轮重试
+
+        self.sync_count = 0
+        self.last_latency = None
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._events.put(None)
+        self._thread.join()
+
+    def trigger(self, reason='modified'):
+        """记录一次Excel保存事件(立即返回)"""
+        self._events.put((time.time(), reason, None))
+
+    def request_sync(self, full=False):
+        """
+        请求同步一次(例如来自HTTP API),即使Excel没有变化也会同步;full=True时执行完整同步
+
+        同步模式随事件一起放入队列,由调度线程在合并这一批事件时读取(不在请求线程中修改调度状态)
+        """
+        self._events.put((time.time(), 'request_full' if full else 'request', None))
+
+    def _emit(self, kind, **data):
+        if self.on_event is not None:
+            try:
+                self.on_event(self, kind, data)
+            except Exception as e:
+                print(f"⚠️  处理同步事件失败: {e}")
+
+    def trigger_folder(self, path):
+        """记录一次票据文件变化事件(立即返回)"""
+        self._events.put((time.time(), 'folder', path))
+
+    def _slot(self):
+        """占用一个工作槽(没有共享工作槽时不限制)"""
+        return self.slots if self.slots is not None else contextlib.nullcontext()
+
+    def _collect_batch(self):
+        """
+        阻塞等待第一个事件,然后持续合并后续事件直到安静期结束
+
+        返回 (第一个事件的时间, 合并的事件数, Excel是否变化, 变化的票据路径集合, 是否为主动请求的同步,
+        是否请求了完整同步),停止时返回None
+        """
+        first_time = None
+        count = 0
+        excel_changed = False
+        requested = False
+        full = False
+        folders = set()
+        while True:
+            if first_time is None:
+                event = self._events.get()
+            else:
+                # 只有票据文件变化时用较短的安静期,尽快更新状态
+                timeout = self.debounce if excel_changed else self.folder_debounce
+                try:
+                    event = self._events.get(timeout=timeout)
+                except queue.Empty:
+                    return first_time, count, excel_changed, folders, requested, full
+            if event is None:
+                return None
+            event_time, reason, path = event
+            if first_time is None:
+                first_time = event_time
+            count += 1
+            if path is None:
+                excel_changed = True
+                requested = requested or reason in ('request', 'request_full')
+                full = full or reason == 'request_full'
+            else:
+                folders.add(path)
+
+    def _wait_for_file_close(self):
+        """等待Excel关闭文件,等待期间到达的新事件会被合并到本次同步"""
         print(f"⏳ 检测到Excel文件正在使用中,等待文件关闭...")
         print(f"💡 提示: 请在Excel中关闭文件后,脚本会自动执行")
-        
+
         wait_time = 0
         check_interval = 1  # 每秒检查一次
-        
-        while wait_time < max_wait:
-            time.sleep(check_interval)
+
+        while wait_time < self.max_lock_wait:
+            if self._stop.wait(check_interval):
+                return False
             wait_time += check_interval
-            
-            if not self.is_file_locked(filepath):
+
+            if not is_file_locked(self.excel_file):
                 print(f"✅ 文件已关闭 (等待了 {wait_time} 秒)")
                 return True
-            
+
             # 每5秒显示一次等待提示
             if wait_time % 5 == 0:
-                print(f"⏳ 仍在等待... ({wait_time}/{max_wait}秒)")
-        
-        print(f"⚠️ 等待超时 ({max_wait}秒),文件仍被占用")
+                print(f"⏳ 仍在等待... ({wait_time}/{self.max_lock_wait}秒)")
+
+        print(f"⚠️ 等待超时 ({self.max_lock_wait}秒),文件仍被占用")
         print(f"💡 请手动关闭Excel文件后,再次保存以触发脚本")
         return False
-        
-    def on_modified(self, event):
-        """文件被修改时触发"""
-        if event.is_directory:
-            return
-            
-        file_path = Path(event.src_path).resolve()
-        
-        # 检查是否是目标Excel文件
-        if file_path == self.excel_file:
-            current_time = time.time()
-            
-            # 防止短时间内重复触发
-            if current_time - self.last_modified < self.cooldown:
-                return
-                
-            self.last_modified = current_time
-            
+
+    def _run(self):
+        """工作线程: 一次只运行一个同步,同步期间到达的事件会在下一轮处理"""
+        while not self._stop.is_set():
+            batch = self._collect_batch()
+            if batch is None:
+                break
+            first_time, count, excel_changed, folders, requested, full = batch
+            folders |= self._pending_folders
+            self._pending_folders = set()
+            full = full or self._full_requested
+            self._full_requested = False
+
+            # 同步自己写回Excel产生的事件,不需要再同步一次(主动请求的同步除外)
+            if excel_changed and not requested and self._is_own_write(first_time):
+                excel_changed = False
+            if not excel_changed:
+                if folders:
+                    self._refresh_folders(first_time, folders)
+                continue
+
             print(f"\n{'='*60}")
-            print(f"📝 检测到Excel文件变化: {file_path.name}")
-            print(f"⏰ 时间: {time.strftime('%Y-%m-%d %H:%M:%S')}")
+            print(f"📝 检测到Excel文件变化: {self.name} ({self.excel_file.name})")
+            print(f"⏰ 时间: {time.strftime('%Y-%m-%d %H:%M:%S')} (合并了 {count} 次保存事件)")
             print(f"{'='*60}\n")
-            
-            # 等待一小段时间,确保文件已保存完成
-            time.sleep(0.5)
-            
+
             # 检查文件是否被占用(Excel是否已关闭)
-            if self.is_file_locked(file_path):
-                # 文件被占用,等待关闭
-                if not self.wait_for_file_close(file_path, max_wait=60):
+            if is_file_locked(self.excel_file):
+                if not self._wait_for_file_close():
+                    self._pending_folders |= folders
+                    self._full_requested = full
                     print("⏭️  跳过本次执行,等待下次文件保存\n")
                     print(f"{'='*60}")
                     print("👀 继续监控文件变化...\n")
-                    return
-            
-            # 文件已关闭或从未被打开,可以安全执行脚本
+                    continue
+
+            # 文件已关闭或从未被打开,可以安全执行同步
+            self.engine.last_excel_write = None
             try:
-                print("🚀 正在执行文件夹创建脚本...\n")
-                result = subprocess.run(
-                    ['python', str(self.script_file)],
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8',
-                    errors='ignore'
-                )
-                
-                # 显示输出
-                if result.stdout:
-                    print(result.stdout)
-                    
-                if result.stderr:
-                    print("⚠️ 错误信息:")
-                    print(result.stderr)
-                    
-                if result.returncode == 0:
-                    print("\n✅ 执行完成!\n")
-                else:
-                    print(f"\n❌ 执行失败,退出码: {result.returncode}\n")
-                    
+                with self._slot():
+                    print(f"🚀 正在同步文件夹: {self.name}\n")
+                    self._emit('sync_started', events=count, requested=requested)
+                    start_time = time.time()
+                    stats = self._sync(full)
+                    # 同步期间的增量模式不会重新统计未变化的行,变化的票据文件夹单独刷新
+                    if folders:
+                        self.engine.refresh_folders(folders)
+                finish_time = time.time()
+                self.sync_count += 1
+                self.last_latency = finish_time - first_time
+                print(f"\n✅ 执行完成! (同步耗时 {finish_time - start_time:.2f} 秒,"
+                      f"从保存到同步完成 {self.last_latency:.2f} 秒)\n")
+                self._emit('sync_finished', stats=stats, seconds=round(finish_time - start_time, 3),
+                           latency=round(self.last_latency, 3))
             except Exception as e:
-                print(f"❌ 执行脚本时出错: {e}\n")
-            
+                print(f"❌ {self.name} 同步时出错: {e}\n")
+                self._emit('sync_failed', error=str(e))
+                self._full_requested = full
+            finally:
+                self._own_write = self.engine.last_excel_write
+
             print(f"{'='*60}")
             print("👀 继续监控文件变化...\n")
 
+    def _is_own_write(self, first_time):
+        """
+        这一批事件是否只是引擎自己写回Excel产生的: 最早的事件发生在写入开始之后,并且文件仍是写入后的状态
+
+        用户在同步期间(写回之前)的保存,事件时间早于写入开始,即使文件签名相同也不会被忽略
+        """
+        if self._own_write is None:
+            return False
+        write_started, signature = self._own_write
+        return first_time >= write_started and file_signature(self.excel_file) == signature
+
+    def _sync(self, full=False):
+        """运行同步: 启动后第一次和请求了完整同步时为完整同步,之后为增量同步,返回同步的统计信息"""
+        stats = self.engine.sync(incremental=self._full_sync_done and not full)
+        self._full_sync_done = True
+        return stats
+
+    def _refresh_folders(self, first_time, folders):
+        """只有票据文件变化时: 只重新统计受影响的行文件夹并写回对应的单元格"""
+        if is_file_locked(self.excel_file) and not self._wait_for_file_close():
+            self._pending_folders |= folders
+            print("⏭️  Excel文件被占用,文件数量将在下次保存或文件变化时更新\n")
+            return
+        self.engine.last_excel_write = None
+        try:
+            with self._slot():
+                changed, needs_sync = self.engine.refresh_folders(folders)
+                if needs_sync:
+                    print(f"🔄 {self.name}: 文件夹状态变化需要移动文件夹,执行同步...\n")
+                    self._sync()
+            finish_time = time.time()
+            if changed or needs_sync:
+                self.last_latency = finish_time - first_time
+                print(f"✅ {self.name}: 已更新 {changed} 个单元格 (从文件变化到更新完成 {self.last_latency:.2f} 秒)\n")
+                self._emit('folders_refreshed', cells=changed, synced=needs_sync,
+                           latency=round(self.last_latency, 3))
+        except Exception as e:
+            print(f"❌ {self.name} 更新文件数量时出错: {e}\n")
+            self._emit('sync_failed', error=str(e))
+        finally:
+            self._own_write = self.engine.last_excel_write
+
+
+class ReceiptFolderHandler(FileSystemEventHandler):
+    """监控状态文件夹中票据文件变化的处理器,roots不为None时只处理这些目录下的事件"""
+
+    def __init__(self, scheduler, roots=None):
+        self.scheduler = scheduler
+        self.roots = None if roots is None else tuple(
+            os.path.normcase(str(Path(root).resolve())) + os.sep for root in roots)
+
+    def _relevant(self, path):
+        return self.roots is None or os.path.normcase(os.path.abspath(path)).startswith(self.roots)
+
+    def on_any_event(self, event):
+        # 文件夹本身的事件(包括同步自己移动文件夹)不影响文件数量,只关心文件
+        if event.is_directory or event.event_type not in ('created', 'deleted', 'moved'):
+            return
+        if self._relevant(event.src_path):
+            self.scheduler.trigger_folder(event.src_path)
+        if event.event_type == 'moved' and self._relevant(event.dest_path):
+            self.scheduler.trigger_folder(event.dest_path)
+
+
+def watch_receipt_folders(observer, scheduler, engine):
+    """
+    监控台账的两个状态文件夹中的票据文件
+
+    两个状态文件夹各自建立监控时,同步把行文件夹从一个移动到另一个之后,原来的监控仍按移动前的路径报告
+    其中的文件变化(refresh_folders找不到对应的行);在base_dir上建立一个递归监控,移动发生在同一个监控之内,
+    watchdog会跟随移动更新路径,再只保留两个状态文件夹下的事件
+    """
+    status_dirs = [engine.completed_dir, engine.pending_dir]
+    for status_dir in status_dirs:
+        status_dir.mkdir(parents=True, exist_ok=True)
+    handler = ReceiptFolderHandler(scheduler, roots=status_dirs)
+    return observer.schedule(handler, str(engine.base_dir.resolve()), recursive=True)
+
+
+class ExcelFileHandler(FileSystemEventHandler):
+    """监控Excel文件变化的处理器,只负责把事件交给调度器"""
+
+    def __init__(self, excel_file, scheduler):
+        self.excel_file = Path(excel_file).resolve()
+        self.scheduler = scheduler
+
+    def _handle(self, path, reason):
+        if Path(path).resolve() == self.excel_file:
+            self.scheduler.trigger(reason)
+
+    def on_modified(self, event):
+        """文件被修改时触发"""
+        if not event.is_directory:
+            self._handle(event.src_path, 'modified')
+
+    def on_created(self, event):
+        """Excel有时通过新建文件的方式保存"""
+        if not event.is_directory:
+            self._handle(event.src_path, 'created')
+
+    def on_moved(self, event):
+        """Excel保存时会先写临时文件再重命名为目标文件"""
+        if not event.is_directory:
+            self._handle(event.dest_path, 'moved')
+
 def main():
-    # 配置
-    excel_file = '社团报销.xlsx'
-    script_file = 'create_folders.py'
-    watch_dir = Path('.').resolve()
-    
+    # 设置标准输出编码为UTF-8,解决Windows命令行emoji显示问题
+    if sys.platform == 'win32':
+        import io
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+    parser = argparse.ArgumentParser(description='监控报销台账和票据文件夹,自动同步')
+    parser.add_argument('--config', help='多台账配置文件(默认: 当前目录下有ledgers.json时使用它,否则只监控当前目录)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='同时运行的同步数上限(不同台账并行,同一个台账总是串行,默认4)')
+    parser.add_argument('--daemon', action='store_true', help='同时提供本地HTTP/JSON接口(查询状态、触发同步、订阅事件)')
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f'HTTP接口监听的地址(默认{DEFAULT_HOST})')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'HTTP接口监听的端口(默认{DEFAULT_PORT})')
+    args = parser.parse_args()
+
+    # 只输出变化(移动/新建/状态更新),每一行的详细信息使用DEBUG级别,不再逐行输出
+    setup_logging(os.environ.get('SYNC_LOG_LEVEL', 'INFO'))
+
     # 检查文件是否存在
-    if not Path(excel_file).exists():
-        print(f"❌ 错误: 找不到Excel文件 '{excel_file}'")
+    ledgers = []
+    for ledger in load_ledgers(args.config):
+        if ledger.excel_file.exists():
+            ledgers.append(ledger)
+        else:
+            print(f"❌ 错误: 找不到Excel文件 '{ledger.excel_file}' ({ledger.name}),跳过")
+    if not ledgers:
         return
-        
-    if not Path(script_file).exists():
-        print(f"❌ 错误: 找不到脚本文件 '{script_file}'")
-        return
-    
+
     print("="*60)
     print("📂 社团报销自动化监控系统")
     print("="*60)
-    print(f"📁 监控目录: {watch_dir}")
-    print(f"📊 监控文件: {excel_file}")
-    print(f"🔧 执行脚本: {script_file}")
+    for ledger in ledgers:
+        print(f"📊 {ledger.name}: {ledger.excel_file} → {ledger.base_dir.resolve()}")
+    print(f"🔧 同步引擎: create_folders.SyncEngine (常驻内存, 最多 {args.workers} 个台账同时同步)")
     print("="*60)
     print("\n✅ 监控已启动!")
     print("💡 提示: 每次保存Excel文件后会自动执行脚本")
+    print("💡 提示: 往✅已完成/📋待处理中放入票据文件后,文件数量会自动更新")
     print("⚠️  按 Ctrl+C 可以停止监控\n")
-    
-    # 创建事件处理器和观察者
-    event_handler = ExcelFileHandler(excel_file, script_file)
+
+    # 为每个台账创建同步引擎、调度器和事件处理器,共用一个观察者和一组工作槽
+    slots = threading.BoundedSemaphore(max(1, args.workers))
     observer = Observer()
-    observer.schedule(event_handler, str(watch_dir), recursive=False)
+    schedulers = []
+    for ledger in ledgers:
+        engine = ledger.create_engine()
+        scheduler = SyncScheduler(ledger.excel_file, engine, name=ledger.name, slots=slots)
+        schedulers.append(scheduler)
+        event_handler = ExcelFileHandler(ledger.excel_file, scheduler)
+        observer.schedule(event_handler, str(ledger.excel_file.resolve().parent), recursive=False)
+        watch_receipt_folders(observer, scheduler, engine)
+
+    # 守护进程要在调度线程启动前读取元数据,第一次同步之前的查询也能得到结果
+    daemon = None
+    if args.daemon:
+        daemon = SyncDaemon(schedulers, host=args.host, port=args.port).start()
+        print(f"🌐 HTTP接口: http://{daemon.host}:{daemon.port}/ "
+              f"(GET /status, GET /rows/<唯一ID>, GET /pending, POST /sync, GET /events)\n")
+    for scheduler in schedulers:
+        scheduler.start()
     observer.start()
-    
+
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
         print("\n\n⏹️  停止监控...")
         observer.stop()
-        
+
     observer.join()
+    for scheduler in schedulers:
+        scheduler.stop()
+        scheduler.engine.close()
+    if daemon is not None:
+        daemon.stop()
     print("✅ 监控已停止\n")
 
 if __name__ == "__main__":
@@ -0,0 +1,390 @@
+"""
+性能基准测试 - 用合成的台账和票据文件夹测量同步的耗时
+
+在本地临时目录中生成指定规模的 社团报销.xlsx、folder_metadata.json 和票据文件夹树,
+然后分别测量:
+- 完整同步、重复的完整同步、无变化/少量变化的增量同步的总耗时
+- 每个阶段的耗时和计数器(SyncEngine.last_metrics): Excel读取、ID匹配、处理行、已删除记录清理、
+  未追踪/空文件夹清理、元数据保存、Excel写回,以及scandir/mkdir/move等调用次数
+- 监控模式下从保存Excel到同步完成的延迟,以及放入票据文件到文件数量更新的延迟;
+  并检查同步把行文件夹移动到另一个状态文件夹之后,监控仍能发现其中的文件变化
+结果保存为JSON,可以用 --compare 与之前版本的结果对比
+
+用法:
+    python benchmark.py --rows 100 1000 10000 --payers 20 --files 3
+    python benchmark.py --rows 1000 --compare benchmark_results_old.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import openpyxl
+
+import create_folders
+from create_folders import SyncEngine, row_fingerprint
+from metadata_store import atomic_write_json
+
+
+# 默认配置
+RESULTS_FILE = 'benchmark_results.json'
+HEADER = ['付款人', '类目', '备注', '开票内容', '材料准备', '唯一ID', '文件数量']
+
+# ---------- 合成数据 ----------
+
+def generate_dataset(root, rows, payers=20, files_per_folder=3, blank_id_ratio=0.05, deleted_ratio=0.02):
+    """
+    在root下生成台账、元数据和票据文件夹,状态与上一次完整同步之后一致
+
+    blank_id_ratio: 唯一ID列为空、需要通过付款人+开票内容匹配元数据的行的比例
+    deleted_ratio: 元数据中存在但台账中已删除的记录的比例(文件夹为空,会被清理)
+    """
+    root = Path(root)
+    completed_dir = root / '✅已完成'
+    pending_dir = root / '📋待处理'
+    metadata = {}
+    timestamp = create_folders.now_iso()
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('Sheet1')
+    ws.append(HEADER)
+
+    blank_every = int(1 / blank_id_ratio) if blank_id_ratio else 0
+    for index in range(rows):
+        excel_row = index + 2
+        payer = f"付款人{index % payers:03d}"
+        content = f"报销项目{index:06d}"
+        unique_id = f"bench_{index:06d}"
+        # 大约三分之一已完成,其余文件数不足的为no,足够的为check
+        if index % 3 == 0 and files_per_folder >= create_folders.MIN_FILE_COUNT:
+            status = 'yes'
+        else:
+            status = create_folders.decide_status(files_per_folder, None)
+        status_dir = completed_dir if status == 'yes' else pending_dir
+        content_with_prefix = f"{excel_row}.{content}"
+        folder_path = status_dir / payer / content_with_prefix
+
+        folder_path.mkdir(parents=True, exist_ok=True)
+        for n in range(files_per_folder):
+            (folder_path / f"票据{n + 1}.pdf").write_bytes(f"{unique_id}-{n}".encode())
+
+        metadata[unique_id] = {
+            'unique_id': unique_id,
+            'original_payer': payer,
+            'original_content': content,
+            'original_content_with_prefix': content_with_prefix,
+            'folder_path': str(folder_path.relative_to(root)),
+            'created_at': timestamp,
+            'excel_row': excel_row,
+            'current_payer': payer,
+            'current_content': content,
+            'current_content_with_prefix': content_with_prefix,
+            'last_updated': timestamp,
+            'file_count': files_per_folder,
+            'status': status,
+            'fingerprint': row_fingerprint(unique_id, payer, content, status, excel_row),
+        }
+        cell_id = None if blank_every and index % blank_every == blank_every - 1 else unique_id
+        ws.append([payer, '其他', None, content, status, cell_id, files_per_folder])
+
+    # 已从台账中删除的记录: 元数据还在,文件夹为空
+    for index in range(int(rows * deleted_ratio)):
+        unique_id = f"bench_deleted_{index:06d}"
+        payer = f"付款人{index % payers:03d}"
+        content = f"已删除项目{index:06d}"
+        folder_path = pending_dir / payer / f"0.{content}"
+        folder_path.mkdir(parents=True, exist_ok=True)
+        metadata[unique_id] = {
+            'unique_id': unique_id,
+            'original_payer': payer,
+            'original_content': content,
+            'original_content_with_prefix': folder_path.name,
+            'folder_path': str(folder_path.relative_to(root)),
+            'created_at': timestamp,
+            'excel_row': 0,
+        }
+
+    excel_file = root / create_folders.EXCEL_FILE
+    metadata_file = root / create_folders.METADATA_FILE
+    wb.save(excel_file)
+    atomic_write_json(metadata_file, metadata, indent=2)
+    return excel_file, metadata_file
+
+
+def edit_ledger(excel_file, fraction):
+    """修改台账中一部分行的开票内容和材料准备状态,模拟一次普通的编辑"""
+    wb = openpyxl.load_workbook(excel_file)
+    ws = wb.worksheets[0]
+    step = max(1, int(1 / fraction)) if fraction else 0
+    edited = 0
+    if step:
+        for row in range(2, ws.max_row + 1, step):
+            ws.cell(row=row, column=4).value = f"{ws.cell(row=row, column=4).value}改"
+            status = ws.cell(row=row, column=5)
+            status.value = 'no' if status.value == 'yes' else 'yes'
+            edited += 1
+    wb.save(excel_file)
+    return edited
+
+
+# ---------- 计时 ----------
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """丢弃同步过程的输出(10万行的逐行输出本身就会占用大量内存和时间)"""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def timed_sync(engine, incremental, verbose=False):
+    """运行一次同步,返回总耗时、各阶段耗时、计数器和统计信息(来自SyncEngine.last_metrics)"""
+    with quiet(not verbose):
+        stats = engine.sync(incremental=incremental)
+    metrics = engine.last_metrics.to_dict()
+    phases = metrics['phases']
+    phases['other'] = round(metrics['total_seconds'] - sum(phases.values()), 6)
+    return {
+        'total': metrics['total_seconds'],
+        'phases': phases,
+        'counters': metrics['counters'],
+        'stats': stats,
+    }
+
+
+def measure_watcher(engine, excel_file, rounds=3, timeout=120):
+    """
+    测量监控模式的延迟: 保存Excel到同步完成,以及放入票据文件到文件数量更新
+
+    使用真实的watchdog观察者和SyncScheduler,与auto_watch.py的运行方式相同
+    """
+    from watchdog.observers import Observer
+    from auto_watch import ExcelFileHandler, SyncScheduler, watch_receipt_folders
+
+    # 引擎已经完整同步过,基准测试只关心之后的增量同步
+    scheduler = SyncScheduler(excel_file, engine, debounce=0.5, folder_debounce=0.2, initial_full_sync=False)
+    observer = Observer()
+    observer.schedule(ExcelFileHandler(excel_file, scheduler), str(Path(excel_file).parent), recursive=False)
+    watch_receipt_folders(observer, scheduler, engine)
+
+    save_latencies = []
+    receipt_latencies = []
+    moved_latency = None
+    with quiet():
+        scheduler.start()
+        observer.start()
+        try:
+            for n in range(rounds):
+                # Excel保存 -> 同步完成
+                count = scheduler.sync_count
+                wb = openpyxl.load_workbook(excel_file)
+                cell = wb.worksheets[0].cell(row=2, column=3)
+                cell.value = f"基准测试{n}"
+                wb.save(excel_file)
+                saved_at = time.time()
+                deadline = saved_at + timeout
+                while scheduler.sync_count == count and time.time() < deadline:
+                    time.sleep(0.01)
+                if scheduler.sync_count > count:
+                    save_latencies.append(round(time.time() - saved_at, 4))
+
+                # 放入票据文件 -> 元数据中的文件数量更新
+                uid, meta = next((uid, meta) for uid, meta in engine.metadata.items()
+                                 if not meta.get('deleted') and meta.get('status') != 'yes')
+                expected = meta.get('file_count', 0) + 1
+                dropped_at = time.time()
+                (engine.folder_of(meta) / f"基准测试票据{n}.pdf").write_bytes(b'receipt')
+                deadline = dropped_at + timeout
+                while engine.metadata[uid].get('file_count') != expected and time.time() < deadline:
+                    time.sleep(0.01)
+                if engine.metadata[uid].get('file_count') == expected:
+                    receipt_latencies.append(round(time.time() - dropped_at, 4))
+
+            # 回归检查: 行改为yes后文件夹被移动到✅已完成,之后在新位置删除票据,文件数量仍然要更新
+            moved_latency = check_moved_folder(engine, scheduler, excel_file, timeout)
+        finally:
+            observer.stop()
+            observer.join()
+            scheduler.stop()
+
+    return {
+        'debounce': scheduler.debounce,
+        'folder_debounce': scheduler.folder_debounce,
+        'save_to_sync': save_latencies,
+        'receipt_to_update': receipt_latencies,
+        'moved_receipt_to_update': moved_latency,
+    }
+
+
+def check_moved_folder(engine, scheduler, excel_file, timeout):
+    """
+    把一个文件足够的待处理行改为yes并换一个新的付款人(✅已完成下还没有这个付款人文件夹),
+    等同步把文件夹移动过去后删除其中一个票据,返回从删除到文件数量更新的延迟;
+    监控没有跟随文件夹的移动(文件数量没有更新,或者仍按移动前的路径报告事件)时返回None
+    """
+    found = next(((uid, meta) for uid, meta in engine.metadata.items()
+                  if not meta.get('deleted') and meta.get('status') == 'check'
+                  and (meta.get('file_count') or 0) >= create_folders.MIN_FILE_COUNT), None)
+    if found is None:
+        return None
+    uid, meta = found
+    old_folder = engine.folder_of(meta)
+    wb = openpyxl.load_workbook(excel_file)
+    ws = wb.worksheets[0]
+    ws.cell(row=meta['excel_row'], column=1).value = f"{meta['current_payer']}_移动检查"
+    ws.cell(row=meta['excel_row'], column=5).value = 'yes'
+    wb.save(excel_file)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        meta = engine.metadata[uid]
+        if meta.get('status') == 'yes' and engine.completed_dir in engine.folder_of(meta).parents:
+            break
+        time.sleep(0.01)
+    else:
+        return None
+
+    # 等移动产生的事件处理完,否则删除会被随后的刷新一并统计,检查不出监控是否跟随了移动
+    time.sleep(scheduler.debounce + scheduler.folder_debounce * 3)
+    folder = engine.folder_of(meta)
+    expected = engine.metadata[uid]['file_count'] - 1
+    reported = []
+    trigger_folder = scheduler.trigger_folder
+    scheduler.trigger_folder = lambda path: (reported.append(Path(path)), trigger_folder(path))
+    try:
+        deleted_at = time.time()
+        next(p for p in folder.iterdir() if p.is_file()).unlink()
+        deadline = deleted_at + timeout
+        while engine.metadata[uid].get('file_count') != expected and time.time() < deadline:
+            time.sleep(0.01)
+        latency = round(time.time() - deleted_at, 4)
+    finally:
+        scheduler.trigger_folder = trigger_folder
+    if engine.metadata[uid].get('file_count') != expected:
+        return None
+    if any(path == old_folder or old_folder in path.parents for path in reported):
+        return None
+    return latency
+
+
+# ---------- 运行 ----------
+
+def run_size(rows, payers, files_per_folder, edit_fraction=0.01, watch=True, keep=False, verbose=False):
+    """在一个临时目录中生成指定规模的数据并运行所有场景"""
+    root = Path(tempfile.mkdtemp(prefix=f'sync_bench_{rows}_'))
+    result = {'rows': rows, 'payers': payers, 'files_per_folder': files_per_folder, 'root': str(root)}
+    try:
+        start = time.perf_counter()
+        excel_file, metadata_file = generate_dataset(root, rows, payers, files_per_folder)
+        result['generate_seconds'] = round(time.perf_counter() - start, 4)
+
+        scenarios = {}
+        # 冷启动: 新建引擎,第一次完整同步(包括ID匹配和已删除记录清理)
+        engine = SyncEngine(excel_file=excel_file, metadata_file=metadata_file, base_dir=root)
+        scenarios['full_cold'] = timed_sync(engine, incremental=False, verbose=verbose)
+        # 常驻内存的引擎再次完整同步(没有任何变化)
+        scenarios['full_warm'] = timed_sync(engine, incremental=False, verbose=verbose)
+        # 增量同步,台账没有变化
+        scenarios['incremental_unchanged'] = timed_sync(engine, incremental=True, verbose=verbose)
+        # 增量同步,少量行的内容和状态被修改(文件夹需要重命名/移动)
+        edited = edit_ledger(excel_file, edit_fraction)
+        scenarios['incremental_edited'] = timed_sync(engine, incremental=True, verbose=verbose)
+        scenarios['incremental_edited']['edited_rows'] = edited
+        result['scenarios'] = scenarios
+
+        if watch:
+            result['watcher'] = measure_watcher(engine, excel_file)
+    finally:
+        if not keep:
+            shutil.rmtree(root, ignore_errors=True)
+    return result
+
+
+def git_version():
+    """当前代码的git版本,不在git仓库中时返回None"""
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def print_result(result, baseline=None):
+    """打印一个规模的结果;有对比基准时显示耗时变化"""
+    print(f"\n📊 {result['rows']} 行 / {result['payers']} 个付款人 / 每个文件夹 {result['files_per_folder']} 个文件"
+          f" (生成数据 {result['generate_seconds']:.2f} 秒)")
+    for name, scenario in result['scenarios'].items():
+        line = f"   {name:<24} {scenario['total']:>9.3f} 秒"
+        old = (baseline or {}).get('scenarios', {}).get(name)
+        if old and old['total']:
+            line += f"  ({scenario['total'] / old['total']:.2f}x 对比基准 {old['total']:.3f} 秒)"
+        print(line)
+        phases = ', '.join(f"{phase} {seconds:.3f}" for phase, seconds in scenario['phases'].items())
+        print(f"      {phases}")
+    watcher = result.get('watcher')
+    if watcher:
+        print(f"   监控延迟: 保存→同步 {watcher['save_to_sync']} 秒, 放入票据→更新 {watcher['receipt_to_update']} 秒")
+        if watcher.get('moved_receipt_to_update') is None:
+            print("   ❌ 行文件夹移动到✅已完成之后,其中的票据变化没有被监控到")
+        else:
+            print(f"   移动后的文件夹中删除票据→更新 {watcher['moved_receipt_to_update']} 秒")
+
+
+def main():
+    # 设置标准输出编码为UTF-8,解决Windows命令行emoji显示问题
+    if sys.platform == 'win32':
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+    parser = argparse.ArgumentParser(description='同步性能基准测试(使用合成数据,在临时目录中运行)')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='台账行数,可以指定多个规模(默认 100 1000 10000,最大建议100000)')
+    parser.add_argument('--payers', type=int, default=20, help='付款人数量(默认20)')
+    parser.add_argument('--files', type=int, default=3, help='每个行文件夹中的票据文件数(默认3)')
+    parser.add_argument('--edit-fraction', type=float, default=0.01,
+                        help='增量同步场景中被修改的行的比例(默认0.01)')
+    parser.add_argument('--no-watch', action='store_true', help='不测量监控模式的延迟')
+    parser.add_argument('--keep', action='store_true', help='保留生成的临时目录')
+    parser.add_argument('--verbose', action='store_true', help='显示同步过程的输出')
+    parser.add_argument('--output', default=RESULTS_FILE, help=f'结果文件(默认{RESULTS_FILE})')
+    parser.add_argument('--compare', help='与之前保存的结果文件对比')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            for old in json.load(f).get('results', []):
+                baseline[(old['rows'], old['payers'], old['files_per_folder'])] = old
+
+    results = []
+    for rows in args.rows:
+        print(f"⏱️  正在测试 {rows} 行...")
+        result = run_size(rows, args.payers, args.files, edit_fraction=args.edit_fraction,
+                          watch=not args.no_watch, keep=args.keep, verbose=args.verbose)
+        results.append(result)
+        print_result(result, baseline.get((rows, args.payers, args.files)))
+
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'version': git_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    atomic_write_json(args.output, report, indent=2)
+    print(f"\n✅ 结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,39 @@
-import pandas as pd
 import os
 import json
+import copy
 from pathlib import Path
 import hashlib
+import re
 import sys
+import logging
+import time
+import unicodedata
+from datetime import datetime
 
-# 设置标准输出编码为UTF-8,解决Windows命令行emoji显示问题
-if sys.platform == 'win32':
-    import io
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
-    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+from dir_snapshot import DirectorySnapshot
+from file_hash_index import FileHashIndex, HASH_INDEX_FILE, report_duplicates
+from metadata_store import MetadataStore, METADATA_FILE
+from status_index import update_index
+from retention import ARCHIVE_DIR, ColdStore, expired_ids
+from excel_reader import AMOUNT_COLUMN, LedgerReader, SheetParser, sheet_names
+from excel_writer import update_cells, write_sheet_cells
+from sync_plan import SyncPlan, PlanExecutor, MKDIR_PARENT, MKDIR
+from sync_metrics import SyncMetrics
+from sync_journal import SyncJournal, resume_moves, rollback
+from receipt_amounts import (AmountCache, AMOUNT_CACHE_FILE, RECEIPT_TOTAL_COLUMN, AMOUNT_CHECK_COLUMN,
+                             amount_key, check_text, reconcile_folders)
 
-# 读取 Excel 文件
-excel_file = '社团报销.xlsx'
-df = pd.read_excel(excel_file)
 
-# 元数据文件路径
-metadata_file = 'folder_metadata.json'
+# 默认配置
+EXCEL_FILE = '社团报销.xlsx'
+MIN_FILE_COUNT = 3  # 材料至少需要的文件数
 
-# 确保DataFrame有唯一ID列
-if '唯一ID' not in df.columns:
-    # 如果没有唯一ID列,添加一个
-    df['唯一ID'] = None
-    print("✨ 添加'唯一ID'列到Excel")
+# 逐行的处理过程通过日志输出: INFO显示移动/新建等变化,DEBUG显示每一行的详细信息
+log = logging.getLogger('create_folders')
+
+# 每个元数据文件对应一个存储后端,记录上次保存的内容以便只写入变化的记录
+_metadata_stores = {}
 
-# 确保DataFrame有文件数量列
-if '文件数量' not in df.columns:
-    # 如果没有文件数量列,添加一个
-    df['文件数量'] = None
-    print("✨ 添加'文件数量'列到Excel")
 
 # 生成唯一ID的函数
 def generate_unique_id():
@@ -39,389 +44,1348 @@ def generate_unique_id():
     random_num = str(random.randint(1000, 9999))
     return f"{timestamp}_{random_num}"
 
+def now_iso():
+    """当前时间的ISO格式字符串,用于元数据中的时间戳"""
+    return datetime.now().isoformat()
+
+def file_signature(filepath):
+    """文件的(大小, 修改时间),文件不存在时返回None"""
+    try:
+        st = os.stat(filepath)
+        return (st.st_size, st.st_mtime_ns)
+    except OSError:
+        return None
+
+def is_blank(value):
+    """单元格是否为空(None或只有空白字符)"""
+    return value is None or str(value).strip() == ''
+
+def decide_status(file_count, current_status):
+    """
+    根据文件数量决定"材料准备"列的值
+
+    文件数量小于3 → no; 文件数量>=3且状态不为yes → check; 文件数量>=3且状态为yes → 保持yes
+    """
+    if file_count < MIN_FILE_COUNT:
+        return 'no'
+    if current_status != 'yes':
+        return 'check'
+    return 'yes'
+
+def set_status(meta, status):
+    """在元数据中记录材料准备状态,状态变化时更新status_since(last_updated每次同步都会更新)"""
+    if meta.get('status') != status:
+        meta['status'] = status
+        meta['status_since'] = now_iso()
+
+def count_files(folder_path):
+    """统计文件夹中直接包含的文件数(不包括子文件夹)"""
+    with os.scandir(folder_path) as it:
+        return sum(1 for entry in it if entry.is_file())
+
+def row_fingerprint(unique_id, payer, content, status, excel_row, sheet=None):
+    """计算一行的指纹(唯一ID+付款人+开票内容+材料准备+行号[+工作表]),用于增量同步时判断行是否变化"""
+    fields = [str(unique_id), payer, content, str(status), int(excel_row)]
+    if sheet is not None:
+        fields.append(sheet)
+    raw = json.dumps(fields, ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+def sheet_folder_name(sheet_name):
+    """工作表名作为文件夹名(Excel允许而Windows文件名不允许的字符替换为_)"""
+    return re.sub(r'[<>:"/\\|?*]', '_', str(sheet_name)).strip().rstrip('.') or '_'
+
+def normalize_text(text):
+    """模糊匹配用的文本归一化: 全角转半角、去掉所有空白、忽略大小写"""
+    if text is None:
+        return ''
+    text = unicodedata.normalize('NFKC', str(text))
+    return re.sub(r'\s+', '', text).casefold()
+
+class MetadataIndex:
+    """
+    元数据索引 - 按(付款人, 开票内容)快速查找唯一ID
+
+    同时索引 (original_payer, original_content) 和 (original_payer, current_content),
+    先按原文精确匹配,再按归一化后的文本模糊匹配。
+    每次同步构建一次,新增/更新条目时调用 add() 保持索引最新
+    """
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self._exact = {}
+        self._fuzzy = {}
+        for uid, meta in metadata.items():
+            self.add(uid, meta)
+
+    def add(self, uid, meta):
+        """把一条元数据加入索引(重复添加同一个键不会产生重复)"""
+        payer = meta.get('original_payer')
+        if payer is None:
+            return
+        for content in (meta.get('original_content'), meta.get('current_content')):
+            if content is None:
+                continue
+            for table, key in ((self._exact, (payer, content)),
+                               (self._fuzzy, (normalize_text(payer), normalize_text(content)))):
+                uids = table.setdefault(key, [])
+                if uid not in uids:
+                    uids.append(uid)
+
+    def _matches(self, meta, payer, content, normalize):
+        """校验条目当前是否仍然匹配(索引中可能残留内容修改前的旧键)"""
+        fold = normalize_text if normalize else (lambda x: x)
+        if meta is None or fold(meta.get('original_payer')) != fold(payer):
+            return False
+        return content in (fold(meta.get('original_content')), fold(meta.get('current_content')))
+
+    def find(self, payer, content, exclude=()):
+        """查找匹配的唯一ID,exclude中的ID(例如本次同步已被其他行使用)会被跳过"""
+        for table, normalize in ((self._exact, False), (self._fuzzy, True)):
+            key_payer, key_content = (normalize_text(payer), normalize_text(content)) if normalize else (payer, content)
+            for uid in table.get((key_payer, key_content), ()):
+                if uid in exclude:
+                    continue
+                if self._matches(self.metadata.get(uid), key_payer, key_content, normalize):
+                    return uid
+        return None
+
 def find_matching_metadata(payer, content, metadata):
-    """通过付款人和开票内容查找匹配的元数据"""
-    for uid, meta in metadata.items():
-        # 检查付款人是否匹配
-        if meta.get('original_payer') == payer:
-            # 检查开票内容是否相似(支持模糊匹配)
-            if meta.get('original_content') == content or meta.get('current_content') == content:
-                return uid
-    return None
+    """通过付款人和开票内容查找匹配的元数据(支持模糊匹配)"""
+    return MetadataIndex(metadata).find(payer, content)
+
+def get_metadata_store(metadata_file=METADATA_FILE):
+    """获取元数据文件对应的存储后端"""
+    key = os.path.abspath(str(metadata_file))
+    if key not in _metadata_stores:
+        _metadata_stores[key] = MetadataStore(metadata_file)
+    return _metadata_stores[key]
 
 # 加载元数据
-def load_metadata():
-    """加载现有的元数据文件"""
-    if os.path.exists(metadata_file):
-        try:
-            with open(metadata_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"⚠️  加载元数据失败: {e}")
-            return {}
-    return {}
+def load_metadata(metadata_file=METADATA_FILE):
+    """加载现有的元数据文件(快照 + 变更日志)"""
+    try:
+        return get_metadata_store(metadata_file).load()
+    except Exception as e:
+        print(f"⚠️  加载元数据失败: {e}")
+        return {}
 
 # 保存元数据
-def save_metadata(metadata):
-    """保存元数据到文件"""
+def save_metadata(metadata, metadata_file=METADATA_FILE):
+    """保存元数据,只写入发生变化的记录,返回写入的记录数(失败时返回None)"""
     try:
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, indent=2, ensure_ascii=False, fp=f)
-        print(f"✅ 元数据已保存到: {metadata_file}")
+        written = get_metadata_store(metadata_file).save(metadata)
+        print(f"✅ 元数据已保存到: {metadata_file} (写入 {written} 条变更)")
+        return written
     except Exception as e:
         print(f"❌ 保存元数据失败: {e}")
+        return None
+
+
+class SyncEngine:
+    """
+    同步引擎 - 根据Excel内容同步文件夹结构
+
+    引擎可以被导入后重复调用 sync(),元数据在两次同步之间保留在内存中,
+    只有当元数据文件被外部修改时才重新读取,避免每次都重新启动解释器和加载pandas
+
+    增量模式(incremental=True)下,每一行的指纹会记录在元数据中,
+    指纹未变化的行不会再访问文件系统,也不会更新last_updated;
+    全局的未追踪文件夹/空文件夹清理只在完整模式下执行。
+    注意: 增量模式不会发现直接在磁盘上放入的文件,需要定期执行一次完整同步
+
+    check_duplicates=True 时,同步结束后用内容哈希索引检查不同行/付款人之间的重复票据
+
+    check_amounts=True 时,从票据文件名和PDF发票中提取金额(receipt_amounts),把每行的票据合计写入"票据金额"列,
+    与台账金额列(amount_column,默认"金额")不一致时写入"金额核对"列;增量模式下只核对处理过的行和台账金额变化的行。
+    工作表中没有金额列时只写入票据金额,"金额核对"列保持为空
+
+    文件夹操作先汇总为同步计划(sync_plan.SyncPlan),再由max_workers个线程并行执行;
+    dry_run=True 时只打印计划和将要修改的单元格,不修改文件夹、元数据和Excel
+
+    每次保存元数据后,把写入/删除的记录增量更新到按付款人、状态、进入当前状态的时间(status_since)和文件数量建立的二级索引
+    (status_index, folder_metadata.index.json),查询命令直接读取该索引
+
+    retention_days不为None时,删除超过保留期且文件夹已经不存在的记录会被归档到冷存储(retention.ColdStore);
+    带着已归档的唯一ID重新出现的行会从冷存储恢复。文件夹中还有文件的删除记录和未追踪的文件夹由retention.py处理
+
+    文件夹操作在执行前写入预写日志(sync_journal),同步中断后下一次同步开始时自动继续:
+    把已经完成但没有写入元数据的移动补记到元数据中;rollback_interrupted()则把文件夹树恢复到中断的同步开始之前
+
+    sheets指定要同步的工作表(['*']为全部)时,各工作表在多个进程中同时解析(进程池在多次同步之间复用,
+    不再使用引擎时调用close()关闭),每个工作表同步到 ✅已完成/工作表名/ 和 📋待处理/工作表名/ 下,
+    没有变化的工作表不会被改动
+    """
+
+    def __init__(self, excel_file=EXCEL_FILE, metadata_file=METADATA_FILE, base_dir='.', incremental=False,
+                 check_duplicates=False, max_workers=8, dry_run=False, metrics_file=None, profile=None,
+                 sheets=None, check_amounts=False, retention_days=None, amount_column=AMOUNT_COLUMN):
+        self.excel_file = str(excel_file)
+        self.metadata_file = str(metadata_file)
+        self.base_dir = Path(base_dir)
+        self.incremental = incremental
+        self.check_duplicates = check_duplicates
+        self.check_amounts = check_amounts
+        self.amount_column = amount_column  # 与票据合计核对的台账金额列
+        self._missing_amount_warned = set()  # 已经提示过没有金额列的工作表(监控模式下不重复提示)
+        self.retention_days = retention_days  # 删除记录在元数据中保留的天数,None表示一直保留
+        self.max_workers = max_workers  # 并行执行文件夹操作的线程数
+        self.dry_run = dry_run
+        self.metrics_file = metrics_file  # 每次同步的指标追加到这个JSON Lines文件
+        self.profile = profile            # 用cProfile分析同步并把结果保存到这个文件
+        # 同步的工作表: None只同步第一个工作表(文件夹结构与以前相同);
+        # 工作表名列表或['*']时每个工作表同步到 状态文件夹/工作表名/ 下的独立子目录
+        self.sheets = list(sheets) if sheets else None
+        self._active_sheets = None  # 本次同步实际处理的工作表
+        self.sheet_parser = SheetParser()  # 多个工作表的解析进程池(第一次需要时创建)
+
+        # 当前/上一次同步的阶段耗时和计数器
+        self.metrics = SyncMetrics()
+        self.last_metrics = None
+
+        # 定义状态文件夹
+        self.completed_dir = self.base_dir / '✅已完成'
+        self.pending_dir = self.base_dir / '📋待处理'
+
+        # 常驻内存的元数据,以及上次读取/保存时元数据文件的签名(大小和修改时间)
+        self.metadata = None
+        self._metadata_signature = None
+        # 旧格式(数字键)的记录只可能来自磁盘上的元数据文件,每次重新读取后检查一次
+        self._old_format_checked = False
+
+        # 归档的元数据记录(冷存储,只在遇到元数据中没有的唯一ID时读取)
+        self.cold_store = ColdStore(self.metadata_file)
+
+        # 引擎最近一次写回Excel: (开始写入的时间, 写入后的文件签名),监控用它识别自己写回产生的事件
+        self.last_excel_write = None
+
+        # 本次同步使用的目录快照
+        self.snapshot = None
+
+        # 文件夹操作的预写日志,同步中断后用于继续或回滚
+        self.journal = SyncJournal(self.metadata_file)
+
+        # 按付款人/状态/最后更新时间/文件数量的二级索引(第一次保存元数据时加载,之后常驻内存并增量更新)
+        self.status_index = None
+
+        # 文件内容哈希索引(第一次检查重复或核对金额时加载,之后常驻内存)
+        self.hash_index = None
+        # PDF票据金额的解析缓存(第一次核对金额时加载)
+        self.amount_cache = None
+
+    def close(self):
+        """释放引擎持有的资源(解析工作表的进程池),之后仍然可以继续同步"""
+        self.sheet_parser.close()
+
+    def load_metadata(self):
+        """加载元数据,如果内存中的元数据仍然有效则直接复用"""
+        signature = get_metadata_store(self.metadata_file).signature()
+        if self.metadata is None or signature != self._metadata_signature:
+            self.metadata = load_metadata(self.metadata_file)
+            self._metadata_signature = signature
+            self._old_format_checked = False
+        return self.metadata
+
+    def selected_sheets(self):
+        """要同步的工作表名称列表(sheets为['*']时为所有工作表,配置中不存在的工作表会被忽略并提示)"""
+        names = sheet_names(self.excel_file)
+        if self.sheets is None:
+            return names[:1]
+        if '*' in self.sheets:
+            return names
+        missing = [name for name in self.sheets if name not in names]
+        if missing:
+            log.warning("⚠️  Excel中没有工作表: %s", ', '.join(missing))
+        return [name for name in self.sheets if name in names]
+
+    def payer_root(self, status_dir, sheet=None):
+        """付款人文件夹所在的目录: 状态文件夹,多工作表时为 状态文件夹/工作表名"""
+        return status_dir if sheet is None else status_dir / sheet_folder_name(sheet)
+
+    def payer_roots(self):
+        """所有同步的工作表对应的付款人文件夹所在目录"""
+        status_dirs = [self.completed_dir, self.pending_dir]
+        if self.sheets is None:
+            return status_dirs
+        sheets = self._active_sheets if self._active_sheets is not None else self.selected_sheets()
+        return [self.payer_root(status_dir, sheet) for status_dir in status_dirs for sheet in sheets]
 
-# 加载现有元数据
-metadata = load_metadata()
-
-# 获取当前工作目录
-base_dir = Path('.')
-
-# 定义状态文件夹
-completed_dir = base_dir / '✅已完成'
-pending_dir = base_dir / '📋待处理'
-
-# 确保状态文件夹存在
-completed_dir.mkdir(exist_ok=True)
-pending_dir.mkdir(exist_ok=True)
-
-print("📂 文件夹分类说明:")
-print(f"   ✅已完成: 材料准备状态为'yes'的文件夹")
-print(f"   📋待处理: 材料准备状态不为'yes'的文件夹")
-print()
-
-# 记录Excel中使用的唯一ID
-active_unique_ids = set()
-
-# 统计计数器
-stats = {
-    'completed': 0,
-    'pending': 0,
-    'moved': 0,
-    'created': 0
-}
-
-# 遍历每一行(跳过第一行标题)
-for index, row in df.iterrows():
-    # 获取付款人和开票内容
-    # 假设列名为"付款人"和"开票内容",如果列名不同需要调整
-    payer = row.get('付款人')
-    content = row.get('开票内容')
-    unique_id = row.get('唯一ID')
-    
-    # 如果付款人或开票内容为空,跳过这一行
-    if pd.isna(payer) or pd.isna(content) or str(payer).strip() == '' or str(content).strip() == '':
-        print(f"跳过第 {index + 2} 行: 付款人或开票内容为空")
-        continue
-    
-    # 清理字符串,去除前后空格
-    payer = str(payer).strip()
-    content = str(content).strip()
-    
-    # 计算Excel中的行号(从2开始,因为第1行是标题)
-    excel_row_number = index + 2
-    
-    # 为开票内容添加行号前缀
-    content_with_prefix = f"{excel_row_number}.{content}"
-    
-    # 处理唯一ID
-    if pd.isna(unique_id) or str(unique_id).strip() == '':
-        # 尝试通过付款人和内容查找现有的元数据
-        matched_uid = find_matching_metadata(payer, content, metadata)
-        
-        if matched_uid:
-            # 找到匹配的元数据,重用这个ID
-            unique_id = matched_uid
-            df.at[index, '唯一ID'] = unique_id
-            print(f"🔗 第 {index + 2} 行找到匹配的记录,使用ID: {unique_id}")
+    def _iter_rows(self, sources):
+        """依次遍历各个工作表的行,返回 (工作表名, 行);只同步第一个工作表时工作表名为None"""
+        for source in sources:
+            sheet = source.sheet_name if self.sheets is not None else None
+            for row in source:
+                yield sheet, row
+
+    def folder_of(self, meta):
+        """元数据记录对应的行文件夹(folder_path相对于base_dir保存,base_dir为'.'时与以前的格式相同)"""
+        return self.base_dir / meta['folder_path']
+
+    def stored_path(self, folder_path):
+        """行文件夹在元数据中保存的路径: 相对于base_dir,这样整个社团目录可以移动或放到共享盘的其他位置"""
+        try:
+            return str(Path(folder_path).relative_to(self.base_dir))
+        except ValueError:
+            return str(folder_path)
+
+    def save_metadata(self):
+        """保存元数据,并记录保存后的文件签名以便下次复用,返回写入的记录数"""
+        store = get_metadata_store(self.metadata_file)
+        previous_signature = store.signature()
+        written = save_metadata(self.metadata, self.metadata_file)
+        self._metadata_signature = store.signature()
+        if written is not None:
+            try:
+                self.status_index = update_index(self.metadata_file, self.metadata, store.last_changes,
+                                                 previous_signature, self._metadata_signature, self.status_index)
+            except Exception as e:
+                # 索引只用于查询,更新失败时下次查询会从元数据重建
+                log.warning("⚠️  更新状态索引失败: %s", e)
+                self.status_index = None
+        return written
+
+    def compact_metadata(self):
+        """保存元数据,然后把快照重写为一个紧凑的文件并清空变更日志(内容不变,二级索引只更新签名)"""
+        written = self.save_metadata()
+        store = get_metadata_store(self.metadata_file)
+        previous_signature = store.signature()
+        store.compact(self.metadata)
+        self._metadata_signature = store.signature()
+        self.status_index = update_index(self.metadata_file, self.metadata, ([], []),
+                                         previous_signature, self._metadata_signature, self.status_index)
+        return written
+
+    def sync(self, incremental=None, dry_run=None):
+        """
+        执行一次同步,返回统计信息
+
+        incremental为None时使用引擎的默认模式,True只处理变化的行,False处理所有行
+        dry_run为True时只打印将要执行的文件夹操作和单元格修改,不修改磁盘、元数据和Excel
+        本次同步的阶段耗时和计数器保存在self.last_metrics中
+        """
+        if incremental is None:
+            incremental = self.incremental
+        if dry_run is not None:
+            previous_dry_run, self.dry_run = self.dry_run, dry_run
+            try:
+                return self.sync(incremental=incremental)
+            finally:
+                self.dry_run = previous_dry_run
+
+        self.metrics = SyncMetrics('incremental' if incremental else 'full',
+                                   excel_file=self.excel_file, dry_run=self.dry_run)
+        profiler = None
+        if self.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            stats = self._run_sync(incremental)
+        except BaseException:
+            # 内存中的元数据可能只更新了一半,下次同步从磁盘重新读取(日志保留,下次同步时继续)
+            self.metadata = None
+            raise
+        finally:
+            self.journal.close()
+            if self.snapshot is not None:
+                self.metrics.incr('scandir', self.snapshot.scans)
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(self.profile)
+                print(f"📈 性能分析结果已保存到: {self.profile}")
+        self._finish_metrics(self.metrics)
+        return stats
+
+    def _finish_metrics(self, metrics):
+        """记录总耗时,打印摘要,需要时追加到指标文件"""
+        metrics.finish()
+        self.last_metrics = metrics
+        log.info(metrics.summary())
+        if self.metrics_file:
+            try:
+                metrics.write_jsonl(self.metrics_file)
+            except OSError as e:
+                log.warning("⚠️  写入指标文件失败: %s", e)
+
+    def _run_sync(self, incremental):
+        metrics = self.metrics
+
+        # 加载现有元数据(dry-run时在副本上操作,常驻内存的元数据保持不变)
+        with metrics.phase('load_metadata'):
+            metadata = self.load_metadata()
+            if self.dry_run:
+                metadata = copy.deepcopy(metadata)
+            elif self.journal.exists():
+                # 上一次同步被中断: 先把已完成的移动补记到元数据,再开始本次同步
+                self._resume_interrupted(metadata)
+        if not self.dry_run:
+            self.journal.begin(excel_file=self.excel_file)
+
+        with metrics.phase('scan'):
+            # 目录快照: 完整同步时一次性扫描状态文件夹,增量同步时只按需扫描用到的目录
+            self.snapshot = DirectorySnapshot(self.base_dir)
+
+            # 确保状态文件夹存在
+            if not self.dry_run:
+                self.completed_dir.mkdir(exist_ok=True)
+                self.pending_dir.mkdir(exist_ok=True)
+
+            if not incremental:
+                self.snapshot.build(self.completed_dir, self.pending_dir)
+            if self.dry_run:
+                self.snapshot.record_mkdir(self.completed_dir)
+                self.snapshot.record_mkdir(self.pending_dir)
+
+        if self.dry_run:
+            print("🔍 dry-run: 只显示计划,不修改文件夹、元数据和Excel\n")
+
+        print("📂 文件夹分类说明:")
+        print(f"   ✅已完成: 材料准备状态为'yes'的文件夹")
+        print(f"   📋待处理: 材料准备状态不为'yes'的文件夹")
+        print()
+
+        # 不核对金额时不读取金额列(金额列在右侧时可以少解析几列)
+        amount_column = self.amount_column if self.check_amounts else None
+        if self.sheets is None:
+            # 只同步第一个工作表: 流式读取(只读取同步需要的列)
+            sources = [LedgerReader(self.excel_file, amount_column=amount_column)]
         else:
-            # 生成新的唯一ID
-            unique_id = generate_unique_id()
-            df.at[index, '唯一ID'] = unique_id
-            print(f"✨ 第 {index + 2} 行生成新ID: {unique_id}")
-    else:
-        unique_id = str(unique_id).strip()
-        print(f"📌 第 {index + 2} 行使用现有ID: {unique_id}")
-    
-    # 记录活跃的ID
-    active_unique_ids.add(unique_id)
-    
-    # 使用唯一ID作为key
-    row_key = unique_id
-    
-    # 获取当前"材料准备"列的值,决定放在哪个顶级目录
-    current_status = row.get('材料准备')
-    if current_status == 'yes':
-        status_dir = completed_dir
-        stats['completed'] += 1
-    else:
-        status_dir = pending_dir
-        stats['pending'] += 1
-    
-    if row_key in metadata:
-        # 已存在元数据,检查是否需要重命名/移动文件夹
-        old_folder_path = Path(metadata[row_key]['folder_path'])
-        new_folder_path = status_dir / payer / content_with_prefix
-        
-        if old_folder_path != new_folder_path:
-            # 需要重命名/移动文件夹
-            if old_folder_path.exists():
-                try:
-                    # 确保新路径的父目录存在
-                    new_folder_path.parent.mkdir(parents=True, exist_ok=True)
-                    # 移动文件夹(保留所有文件)
-                    import shutil
-                    shutil.move(str(old_folder_path), str(new_folder_path))
-                    print(f"📦 移动文件夹:")
-                    print(f"   从: {old_folder_path}")
-                    print(f"   到: {new_folder_path}")
-                    folder_path = new_folder_path
-                    stats['moved'] += 1
-                    
-                    # 清理可能为空的旧父文件夹
-                    try:
+            # 多个工作表: 在多个进程中同时解析
+            with metrics.phase('excel_read'):
+                self._active_sheets = self.selected_sheets()
+                sources = self.sheet_parser.read(self.excel_file, self._active_sheets, amount_column=amount_column)
+            metrics.incr('sheets', len(sources))
+
+        with metrics.phase('rows'):
+            active_unique_ids, stats, row_updates, amount_rows = self._process_rows(sources, metadata, incremental)
+        # 流式读取Excel和ID匹配发生在处理行的过程中,单独统计
+        read_seconds = sum(source.read_seconds for source in sources)
+        metrics.add_time('excel_read', read_seconds)
+        metrics.add_time('rows', -read_seconds - metrics.phases.get('id_matching', 0.0))
+        metrics.incr('rows_read', sum(source.rows_read for source in sources))
+        metrics.incr('rows_touched', stats['touched'])
+        metrics.incr('rows_skipped', stats['skipped'])
+
+        added_columns = {}
+        # 确保Excel(每个同步的工作表)有唯一ID列和文件数量列,没有的话在表头末尾添加
+        for source in sources:
+            sheet = source.sheet_name if self.sheets is not None else None
+            if '付款人' not in source.columns or '开票内容' not in source.columns:
+                # 不是报销台账格式的工作表(例如说明页),不添加任何列
+                continue
+            columns = ['唯一ID', '文件数量']
+            if self.check_amounts:
+                columns += [RECEIPT_TOTAL_COLUMN, AMOUNT_CHECK_COLUMN]
+                if self.amount_column not in source.columns and sheet not in self._missing_amount_warned:
+                    self._missing_amount_warned.add(sheet)
+                    log.warning("⚠️  Excel中没有'%s'列%s,只写入票据金额,不做金额核对(可以在ledgers.json中用amount_column指定金额列)",
+                                self.amount_column, f" (工作表: {sheet})" if sheet else "")
+            for column in columns:
+                if column not in source.columns:
+                    added_columns.setdefault(sheet, []).append(column)
+                    print(f"✨ 添加'{column}'列到Excel" + (f" (工作表: {sheet})" if sheet else ""))
+
+        print("\n✅ 所有文件夹处理完成!")
+        print(f"\n📊 统计信息:")
+        print(f"   ✅已完成: {stats['completed']} 个文件夹")
+        print(f"   📋待处理: {stats['pending']} 个文件夹")
+        print(f"   📦移动: {stats['moved']} 个文件夹")
+        print(f"   ✨新建: {stats['created']} 个文件夹")
+        if incremental:
+            print(f"   ⏭️ 未变化(跳过): {stats['skipped']} 行")
+
+        with metrics.phase('orphan_cleanup'):
+            old_format_keys = self._cleanup_old_format(metadata)
+            orphaned_ids = self._cleanup_orphaned_ids(metadata, active_unique_ids, incremental)
+            archived_ids = self._archive_expired(metadata) if self.retention_days is not None else []
+        if not incremental:
+            with metrics.phase('untracked_cleanup'):
+                self._cleanup_untracked_folders(metadata, active_unique_ids)
+            with metrics.phase('empty_cleanup'):
+                self._cleanup_empty_folders()
+
+        if self.dry_run:
+            cells = sum(len(values) for rows in row_updates.values() for values in rows.values())
+            columns = sum(len(names) for names in added_columns.values())
+            print(f"\n🔍 dry-run 完成: 将修改 {cells} 个单元格(另外新增 {columns} 列),未写入任何内容")
+            return stats
+
+        if self.check_duplicates:
+            with metrics.phase('duplicate_check'):
+                self._check_duplicates(metadata, active_unique_ids)
+
+        amounts_changed = 0
+        if self.check_amounts:
+            with metrics.phase('amount_check'):
+                amounts_changed = self._check_amounts(metadata, amount_rows, row_updates, added_columns)
+
+        # 保存元数据(增量模式下没有任何变化时跳过)
+        if not incremental or stats['touched'] or old_format_keys or orphaned_ids or archived_ids or amounts_changed:
+            with metrics.phase('metadata_save'):
+                metrics.incr('metadata_records_written', self.save_metadata() or 0)
+        self.journal.record_metadata_saved()
+
+        # 只把变化的单元格写回 Excel 文件
+        with metrics.phase('excel_write'):
+            metrics.incr('cells_written', self._save_excel(row_updates, added_columns))
+
+        self.journal.finish()
+        return stats
+
+    def _process_rows(self, sources, metadata, incremental=False):
+        """
+        遍历Excel每一行,创建/移动文件夹并更新元数据
+
+        分两步进行: 先为每个需要处理的行决定文件夹操作并生成同步计划,
+        再由PlanExecutor并行执行计划,最后根据执行结果更新元数据和单元格
+
+        sources是工作表读取器的列表(LedgerReader或ParsedSheet),所有工作表的文件夹操作合并为一个计划并行执行
+        返回 (活跃的唯一ID集合, 统计信息, 需要写回的单元格 {工作表名: {Excel行号: {列名: 新值}}},
+              需要核对金额的行 [(工作表名, 行, 唯一ID)],没有开启check_amounts时为空)
+        """
+        completed_dir = self.completed_dir
+        pending_dir = self.pending_dir
+        base_dir = self.base_dir
+        # 删除移动后的空旧父文件夹时,这些目录本身不能被删除
+        protected_dirs = {base_dir, completed_dir, pending_dir} | set(self.payer_roots())
+        snapshot = self.snapshot
+
+        # 记录Excel中使用的唯一ID
+        active_unique_ids = set()
+
+        # 统计计数器
+        stats = {
+            'completed': 0,
+            'pending': 0,
+            'moved': 0,
+            'created': 0,
+            'touched': 0,
+            'skipped': 0
+        }
+
+        # 需要写回Excel的单元格
+        row_updates = {}
+        amount_rows = []
+
+        # 付款人/开票内容索引,只在遇到没有唯一ID的行时才构建
+        metadata_index = None
+
+        # 第一步: 决定每一行的文件夹操作
+        plan = SyncPlan()
+        planned_rows = []
+
+        # 遍历每个工作表的每一行(跳过第一行标题)
+        for sheet, row in self._iter_rows(sources):
+            # 获取付款人和开票内容
+            # 列名为"付款人"和"开票内容",如果列名不同需要调整excel_reader.SYNC_READ_COLUMNS
+            payer = row.payer
+            content = row.content
+            unique_id = row.unique_id
+
+            # Excel中的行号(从2开始,因为第1行是标题)
+            excel_row_number = row.excel_row
+
+            # 如果付款人或开票内容为空,跳过这一行
+            if is_blank(payer) or is_blank(content):
+                log.debug("跳过第 %s 行: 付款人或开票内容为空", excel_row_number)
+                continue
+
+            # 清理字符串,去除前后空格
+            payer = str(payer).strip()
+            content = str(content).strip()
+
+            # 处理唯一ID
+            if is_blank(unique_id):
+                # 尝试通过付款人和内容查找现有的元数据(跳过已被其他行使用的ID)
+                with self.metrics.phase('id_matching'):
+                    if metadata_index is None:
+                        metadata_index = MetadataIndex(metadata)
+                        self.metrics.incr('metadata_scanned', len(metadata))
+                    matched_uid = metadata_index.find(payer, content, exclude=active_unique_ids)
+
+                if matched_uid:
+                    # 找到匹配的元数据,重用这个ID
+                    unique_id = matched_uid
+                    row.unique_id = unique_id
+                    log.info("🔗 第 %s 行找到匹配的记录,使用ID: %s", excel_row_number, unique_id)
+                else:
+                    # 生成新的唯一ID
+                    unique_id = generate_unique_id()
+                    row.unique_id = unique_id
+                    log.info("✨ 第 %s 行生成新ID: %s", excel_row_number, unique_id)
+            else:
+                unique_id = str(unique_id).strip()
+
+                # 增量模式: 指纹与上次同步一致的行不需要任何文件系统操作
+                if incremental:
+                    meta = metadata.get(unique_id)
+                    fingerprint = row_fingerprint(unique_id, payer, content, row.status, excel_row_number, sheet)
+                    if meta and not meta.get('deleted') and meta.get('fingerprint') == fingerprint:
+                        active_unique_ids.add(unique_id)
+                        # 行没有变化,但台账金额被修改时仍然需要重新核对
+                        if self.check_amounts and meta.get('ledger_amount') != amount_key(row.amount):
+                            amount_rows.append((sheet, row, unique_id))
+                        if row.status == 'yes':
+                            stats['completed'] += 1
+                        else:
+                            stats['pending'] += 1
+                        stats['skipped'] += 1
+                        continue
+
+                if unique_id not in metadata:
+                    self._restore_archived(metadata, unique_id)
+                log.debug("📌 第 %s 行使用现有ID: %s", excel_row_number, unique_id)
+
+            # 记录活跃的ID
+            active_unique_ids.add(unique_id)
+            stats['touched'] += 1
+
+            # 获取当前"材料准备"列的值,决定放在哪个顶级目录
+            # (yes但现有文件夹中文件数量不足时,第三步会写回no,按写回后的状态放在📋待处理中)
+            placement_status = row.status
+            if placement_status == 'yes':
+                meta = metadata.get(unique_id)
+                file_count = snapshot.file_count(self.folder_of(meta)) if meta and meta.get('folder_path') else 0
+                placement_status = decide_status(file_count, row.status)
+            if placement_status == 'yes':
+                status_dir = completed_dir
+                stats['completed'] += 1
+            else:
+                status_dir = pending_dir
+                stats['pending'] += 1
+
+            # 为开票内容添加行号前缀
+            new_folder_path = self.payer_root(status_dir, sheet) / payer / f"{excel_row_number}.{content}"
+            old_folder_path = None
+            op = None
+
+            if unique_id in metadata:
+                # 已存在元数据,检查是否需要重命名/移动文件夹
+                old_folder_path = self.folder_of(metadata[unique_id])
+                if old_folder_path != new_folder_path:
+                    if snapshot.exists(old_folder_path):
+                        # 移动文件夹(保留所有文件),之后清理可能为空的旧父文件夹
+                        action = 'move'
+                        op = plan.move(old_folder_path, new_folder_path)
                         old_parent = old_folder_path.parent
-                        if old_parent.exists() and old_parent != base_dir and old_parent not in [completed_dir, pending_dir]:
-                            if not any(old_parent.iterdir()):
-                                old_parent.rmdir()
-                                print(f"   🧹 清理空文件夹: {old_parent}")
-                    except:
-                        pass
-                except Exception as e:
-                    print(f"❌ 移动文件夹失败: {e}")
-                    print(f"   将创建新文件夹: {new_folder_path}")
-                    folder_path = new_folder_path
-                    folder_path.mkdir(parents=True, exist_ok=True)
+                        if old_parent not in protected_dirs:
+                            plan.rmdir(old_parent, only_if_empty=True)
+                    else:
+                        # 旧文件夹不存在,创建新文件夹
+                        action = 'missing'
+                        op = plan.mkdir(new_folder_path)
+                elif not snapshot.exists(new_folder_path):
+                    action = 'recreate'
+                    op = plan.mkdir(new_folder_path)
+                else:
+                    # 路径没有变化,使用现有文件夹
+                    action = 'keep'
             else:
-                # 旧文件夹不存在,创建新文件夹
-                print(f"⚠️  旧文件夹不存在: {old_folder_path}")
-                print(f"   创建新文件夹: {new_folder_path}")
-                folder_path = new_folder_path
-                folder_path.mkdir(parents=True, exist_ok=True)
-        else:
-            # 路径没有变化,使用现有文件夹
-            folder_path = new_folder_path
-            if not folder_path.exists():
-                folder_path.mkdir(parents=True, exist_ok=True)
-                print(f"创建文件夹: {folder_path}")
+                # 新行,创建文件夹和元数据
+                action = 'new'
+                op = plan.mkdir(new_folder_path)
+
+            planned_rows.append((sheet, row, unique_id, payer, content, action, op, old_folder_path, new_folder_path))
+
+        # 第二步: 并行执行文件夹操作(移动由relocate.Relocator执行,同一文件系统内直接改名)
+        self._apply_plan(plan, '行文件夹')
+
+        # 第三步: 根据执行结果更新元数据、统计文件数量、决定材料准备状态
+        for sheet, row, unique_id, payer, content, action, op, old_folder_path, folder_path in planned_rows:
+            excel_row_number = row.excel_row
+            current_status = row.status
+            move_failed = False
+
+            if action == 'move':
+                if op.done:
+                    log.info("📦 移动文件夹:\n   从: %s\n   到: %s", old_folder_path, folder_path)
+                    stats['moved'] += 1
+                    parent_op = plan.removal(old_folder_path.parent)
+                    if parent_op is not None and parent_op.done:
+                        log.info("   🧹 清理空文件夹: %s", old_folder_path.parent)
+                else:
+                    # 不在新位置创建空文件夹(否则文件会留在旧文件夹中): 这一行继续使用旧文件夹,下次同步重试
+                    log.warning("❌ 移动文件夹失败: %s\n   继续使用原文件夹: %s (下次同步时重试)", op.error, old_folder_path)
+                    folder_path = old_folder_path
+                    move_failed = True
+            elif action == 'missing':
+                log.warning("⚠️  旧文件夹不存在: %s\n   创建新文件夹: %s", old_folder_path, folder_path)
+            elif action == 'recreate':
+                log.info("创建文件夹: %s", folder_path)
+            elif action == 'keep':
+                log.debug("使用现有文件夹: %s", folder_path)
+            elif op.done:
+                log.info("✨ 创建新文件夹: %s", folder_path)
+                stats['created'] += 1
             else:
-                print(f"使用现有文件夹: {folder_path}")
-    else:
-        # 新行,创建文件夹和元数据
-        folder_path = status_dir / payer / content_with_prefix
-        
-        # 创建文件夹(如果不存在)
-        try:
-            folder_path.mkdir(parents=True, exist_ok=True)
-            print(f"✨ 创建新文件夹: {folder_path}")
-            stats['created'] += 1
-        except Exception as e:
-            print(f"❌ 创建文件夹失败 {folder_path}: {e}")
-            continue
-        
-        # 创建新的元数据条目
-        metadata[row_key] = {
-            'unique_id': unique_id,
-            'original_payer': payer,
-            'original_content': content,
-            'original_content_with_prefix': content_with_prefix,
-            'folder_path': str(folder_path),
-            'created_at': pd.Timestamp.now().isoformat(),
-            'excel_row': excel_row_number
-        }
-    
-    # 更新元数据中的当前信息
-    metadata[row_key]['current_payer'] = payer
-    metadata[row_key]['current_content'] = content
-    metadata[row_key]['current_content_with_prefix'] = content_with_prefix
-    metadata[row_key]['folder_path'] = str(folder_path)
-    metadata[row_key]['last_updated'] = pd.Timestamp.now().isoformat()
-    metadata[row_key]['excel_row'] = excel_row_number
-    
-    # 检测文件夹中的文件数量
-    try:
-        # 获取文件夹中的所有文件(不包括子文件夹)
-        files = [f for f in folder_path.iterdir() if f.is_file()]
-        file_count = len(files)
-        
-        # 将文件数量写入"文件数量"列
-        df.at[index, '文件数量'] = file_count
-        
-        print(f"  - 文件夹 {folder_path} 中有 {file_count} 个文件 (当前状态: {current_status})")
-        
-        # 如果文件数量小于3,将"材料准备"列设置为"no"
-        if file_count < 3:
-            df.at[index, '材料准备'] = 'no'
-            print(f"  - 文件数量不足3个,将材料准备列设置为 no")
-        # 如果文件数量>=3,且材料准备列不为yes,将其设置为"check"
-        elif file_count >= 3 and current_status != 'yes':
-            df.at[index, '材料准备'] = 'check'
-            print(f"  - 文件数量>=3且状态不为yes,将材料准备列设置为 check")
-        # 如果文件数量>=3且状态为yes,保持不变
-        elif file_count >= 3 and current_status == 'yes':
-            print(f"  - 文件数量>=3且状态为yes,保持不变")
-    except Exception as e:
-        print(f"  - 检查文件夹失败 {folder_path}: {e}")
-        # 如果检查失败,将文件数量设置为0
-        df.at[index, '文件数量'] = 0
-
-print("\n✅ 所有文件夹处理完成!")
-print(f"\n📊 统计信息:")
-print(f"   ✅已完成: {stats['completed']} 个文件夹")
-print(f"   📋待处理: {stats['pending']} 个文件夹")
-print(f"   📦移动: {stats['moved']} 个文件夹")
-print(f"   ✨新建: {stats['created']} 个文件夹")
-
-# 清理旧格式的元数据(使用数字索引作为key的旧记录)
-old_format_keys = [k for k in metadata.keys() if k.isdigit()]
-if old_format_keys:
-    print(f"\n🔄 检测到 {len(old_format_keys)} 个旧格式的元数据记录,正在清理...")
-    for old_key in old_format_keys:
-        # 移除旧格式的记录
-        del metadata[old_key]
-    print(f"✅ 已清理旧格式记录")
-
-# 检查是否有被删除的行(元数据中存在但Excel中不存在的ID)
-orphaned_ids = set(metadata.keys()) - active_unique_ids
-if orphaned_ids:
-    print(f"\n🗑️  检测到 {len(orphaned_ids)} 个已删除的记录:")
-    for orphaned_id in orphaned_ids:
-        orphaned_meta = metadata[orphaned_id]
-        orphaned_folder = Path(orphaned_meta['folder_path'])
-        
-        # 兼容旧格式(payer)和新格式(original_payer)
-        payer_name = orphaned_meta.get('original_payer') or orphaned_meta.get('payer') or orphaned_meta.get('current_payer')
-        content_name = orphaned_meta.get('original_content') or orphaned_meta.get('current_content')
-        
-        print(f"\n   ID: {orphaned_id}")
-        print(f"   付款人: {payer_name}")
-        print(f"   开票内容: {content_name}")
-        print(f"   文件夹: {orphaned_folder}")
-        
-        if orphaned_folder.exists():
-            # 检查文件夹中是否有文件
-            files = [f for f in orphaned_folder.iterdir() if f.is_file()]
-            if files:
-                print(f"   ⚠️  文件夹中还有 {len(files)} 个文件,已保留")
+                log.error("❌ 创建文件夹失败 %s: %s", folder_path, op.error)
+                continue
+
+            content_with_prefix = folder_path.name
+            if action == 'new':
+                # 创建新的元数据条目
+                metadata[unique_id] = {
+                    'unique_id': unique_id,
+                    'original_payer': payer,
+                    'original_content': content,
+                    'original_content_with_prefix': content_with_prefix,
+                    'folder_path': self.stored_path(folder_path),
+                    'created_at': now_iso(),
+                    'excel_row': excel_row_number
+                }
+
+            # 更新元数据中的当前信息
+            metadata[unique_id]['current_payer'] = payer
+            metadata[unique_id]['current_content'] = content
+            metadata[unique_id]['current_content_with_prefix'] = content_with_prefix
+            metadata[unique_id]['folder_path'] = self.stored_path(folder_path)
+            metadata[unique_id]['last_updated'] = now_iso()
+            metadata[unique_id]['excel_row'] = excel_row_number
+            # 行重新出现在Excel中(例如撤销删除)时清除删除标记
+            metadata[unique_id].pop('deleted', None)
+            metadata[unique_id].pop('deleted_at', None)
+            if sheet is not None:
+                metadata[unique_id]['sheet'] = sheet
             else:
-                # 文件夹为空,删除它
-                try:
-                    orphaned_folder.rmdir()
-                    print(f"   ✅ 文件夹为空,已删除")
-                    
-                    # 检查父文件夹(付款人文件夹)是否也为空
-                    parent_folder = orphaned_folder.parent
-                    if parent_folder != base_dir and parent_folder.exists() and parent_folder not in [completed_dir, pending_dir]:
-                        # 检查父文件夹是否为空
-                        try:
-                            if not any(parent_folder.iterdir()):
-                                parent_folder.rmdir()
-                                print(f"   ✅ 父文件夹 {parent_folder.name} 也为空,已删除")
-                                
-                                # 检查祖父文件夹(状态文件夹下的空付款人文件夹)
-                                grandparent_folder = parent_folder.parent
-                                if grandparent_folder in [completed_dir, pending_dir] and grandparent_folder.exists():
-                                    try:
-                                        if not any(grandparent_folder.iterdir()):
-                                            pass  # 不删除✅已完成和📋待处理文件夹本身
-                                    except:
-                                        pass
-                        except Exception as e:
-                            pass  # 父文件夹不为空或删除失败,忽略
-                except Exception as e:
-                    print(f"   ❌ 删除空文件夹失败: {e}")
+                metadata[unique_id].pop('sheet', None)
+            if metadata_index is not None:
+                metadata_index.add(unique_id, metadata[unique_id])
+
+            # 检测文件夹中的文件数量
+            try:
+                # 获取文件夹中的所有文件(不包括子文件夹)
+                file_count = snapshot.file_count(folder_path)
+
+                # 将文件数量写入"文件数量"列
+                row.file_count = file_count
+
+                log.debug("  - 文件夹 %s 中有 %s 个文件 (当前状态: %s)", folder_path, file_count, current_status)
+
+                new_status = decide_status(file_count, current_status)
+                row.status = new_status
+                if new_status == 'no':
+                    log.debug("  - 文件数量不足3个,将材料准备列设置为 no")
+                elif new_status == 'check':
+                    log.debug("  - 文件数量>=3且状态不为yes,将材料准备列设置为 check")
+                else:
+                    log.debug("  - 文件数量>=3且状态为yes,保持不变")
+                metadata[unique_id]['file_count'] = file_count
+            except Exception as e:
+                log.warning("  - 检查文件夹失败 %s: %s", folder_path, e)
+                # 如果检查失败,将文件数量设置为0
+                row.file_count = 0
+                metadata[unique_id]['file_count'] = 0
+
+            # 记录处理后的状态和指纹(使用写回Excel的材料准备值,下次读取时才能匹配)
+            final_status = row.status
+            set_status(metadata[unique_id], None if final_status is None else str(final_status))
+            if move_failed:
+                # 没有指纹的行在增量同步中也会被重新处理
+                metadata[unique_id].pop('fingerprint', None)
+            else:
+                metadata[unique_id]['fingerprint'] = row_fingerprint(
+                    unique_id, payer, content, final_status, excel_row_number, sheet)
+
+            changes = row.changes()
+            if changes:
+                row_updates.setdefault(sheet, {})[excel_row_number] = changes
+            if self.check_amounts:
+                amount_rows.append((sheet, row, unique_id))
+
+        return active_unique_ids, stats, row_updates, amount_rows
+
+    def _apply_plan(self, plan, title):
+        """执行一个同步计划;dry-run时只打印计划并在目录快照上模拟执行"""
+        if not plan:
+            return []
+        if self.dry_run:
+            print(f"\n📝 计划({title}, {len(plan)} 个操作):")
+            plan.print_plan()
+            journal = None
         else:
-            print(f"   ℹ️  文件夹不存在")
-        
-        # 标记为已删除(保留元数据以便恢复)
-        metadata[orphaned_id]['deleted'] = True
-        metadata[orphaned_id]['deleted_at'] = pd.Timestamp.now().isoformat()
-
-# 收集所有活跃的文件夹路径
-active_folder_paths = set()
-for uid in active_unique_ids:
-    if uid in metadata:
-        active_folder_paths.add(Path(metadata[uid]['folder_path']))
-
-# 清理不在活跃列表中的所有文件夹
-orphaned_folders_cleaned = []
-for status_folder in [completed_dir, pending_dir]:
-    if status_folder.exists():
-        for payer_folder in status_folder.iterdir():
-            if payer_folder.is_dir():
+            # 先把计划写入预写日志,再执行
+            journal = self.journal
+            journal.record_plan(plan.operations)
+        executor = PlanExecutor(self.snapshot, max_workers=self.max_workers, dry_run=self.dry_run, journal=journal)
+        failed = executor.run(plan)
+        if not self.dry_run:
+            # 统计实际发出的文件系统调用(条件不满足而跳过的不算)
+            for op in plan.operations:
+                if not op.skipped:
+                    self.metrics.incr('mkdir' if op.kind in (MKDIR_PARENT, MKDIR) else op.kind.split('_')[0])
+            # 需要跨文件系统复制的移动单独统计
+            if executor.relocator.copied:
+                self.metrics.incr('move_copied', executor.relocator.copied)
+                self.metrics.incr('bytes_copied', executor.relocator.bytes_copied)
+        return failed
+
+    def _resume_interrupted(self, metadata):
+        """继续上一次中断的同步: 已经完成的移动补记到元数据并立即保存,然后删除日志"""
+        state = self.journal.load()
+        if state is None:
+            return
+        if state.metadata_saved:
+            log.warning("⚠️  上一次同步 (%s) 在写回Excel之前中断,本次同步会重新写回", state.started_at)
+            self.journal.finish()
+            return
+
+        folder_index = {os.path.normcase(os.path.abspath(self.folder_of(meta))): uid
+                        for uid, meta in metadata.items() if meta.get('folder_path')}
+        relocated, unclear = resume_moves(state, folder_index)
+        log.warning("⚠️  上一次同步 (%s) 没有完成,继续: %s 个已完成的移动补记到元数据",
+                    state.started_at, len(relocated))
+        for uid, target in relocated:
+            metadata[uid]['folder_path'] = self.stored_path(target)
+            # 清除指纹,保证本次同步(即使是增量同步)重新处理这一行
+            metadata[uid].pop('fingerprint', None)
+            log.info("   📦 %s → %s", uid, target)
+        for op in unclear:
+            log.warning("   ⚠️  无法判断是否已移动(源和目标都存在),请手动检查:\n      %s\n      %s",
+                        op['path'], op['target'])
+        if relocated:
+            self.save_metadata()
+        self.journal.finish()
+
+    def rollback_interrupted(self):
+        """
+        回滚上一次中断的同步: 把已完成的移动移回原位置,删除新建的空文件夹
+
+        返回是否执行了回滚;元数据已经保存(只差写回Excel)时不能回滚,返回False
+        """
+        state = self.journal.load()
+        if state is None:
+            print("✅ 没有中断的同步,不需要回滚")
+            return False
+        if state.metadata_saved:
+            print(f"⚠️  上一次同步 ({state.started_at}) 已经保存了元数据,只差写回Excel,无法回滚,请重新同步")
+            return False
+        moved_back, removed, problems = rollback(state)
+        print(f"↩️  已回滚上一次同步 ({state.started_at}): 移回 {moved_back} 个文件夹,删除 {removed} 个新建的空文件夹")
+        for op, reason in problems:
+            target = f" → {op['target']}" if op.get('target') else ''
+            print(f"   ⚠️  无法回滚 {op['path']}{target}: {reason}")
+        self.journal.finish()
+        self.metadata = None
+        return True
+
+    def refresh_folders(self, paths):
+        """
+        文件夹内容变化后只重新统计受影响的行,并只写回这些行的单元格
+
+        paths是发生变化的文件路径(或文件夹路径),通过元数据中的folder_path映射到唯一ID。
+        返回 (修改的单元格数, 是否需要完整同步);
+        当状态从yes变为其他值时文件夹需要移动到📋待处理,这种情况交给sync()处理,
+        这些行的指纹会被清除,保证随后的增量同步一定会重新处理它们
+        """
+        metrics = SyncMetrics('refresh', excel_file=self.excel_file, dry_run=False)
+        try:
+            return self._refresh_folders(paths, metrics)
+        finally:
+            self._finish_metrics(metrics)
+
+    def _refresh_folders(self, paths, metrics):
+        metadata = self.load_metadata()
+        metrics.incr('metadata_scanned', len(metadata))
+        folder_index = {os.path.normcase(os.path.abspath(self.folder_of(meta))): uid
+                        for uid, meta in metadata.items()
+                        if not meta.get('deleted') and meta.get('folder_path')}
+
+        # 找到每个变化路径所属的行文件夹
+        affected = {}
+        for path in paths:
+            current = os.path.normcase(os.path.abspath(path))
+            while current not in folder_index:
+                parent = os.path.dirname(current)
+                if parent == current:
+                    break
+                current = parent
+            uid = folder_index.get(current)
+            if uid is not None:
+                affected[uid] = self.folder_of(metadata[uid])
+
+        updates = {}
+        needs_sync = False
+        for uid, folder_path in affected.items():
+            meta = metadata[uid]
+            if 'status' not in meta:
+                # 旧版本同步产生的元数据没有记录状态,无法判断,交给完整同步
+                needs_sync = True
+                meta.pop('fingerprint', None)
+                continue
+            try:
+                metrics.incr('scandir')
+                with metrics.phase('count_files'):
+                    file_count = count_files(folder_path)
+            except OSError:
+                # 文件夹本身被移动或删除,需要完整同步
+                needs_sync = True
+                meta.pop('fingerprint', None)
+                continue
+            old_status = meta.get('status')
+            new_status = decide_status(file_count, old_status)
+            if old_status == 'yes' and new_status != 'yes':
+                needs_sync = True
+                meta.pop('fingerprint', None)
+                continue
+            if file_count != meta.get('file_count') or new_status != old_status:
+                updates[uid] = {'文件数量': file_count, '材料准备': new_status}
+
+        amounts_changed = False
+        if self.check_amounts:
+            with metrics.phase('amount_check'):
+                amounts_changed = self._refresh_amounts(metadata, affected, updates)
+
+        if not updates:
+            if amounts_changed:
+                with metrics.phase('metadata_save'):
+                    metrics.incr('metadata_records_written', self.save_metadata() or 0)
+            return 0, needs_sync
+
+        with metrics.phase('excel_write'):
+            write_started = time.time()
+            changed = update_cells(self.excel_file, updates,
+                                   row_hints={uid: metadata[uid].get('excel_row') for uid in updates},
+                                   sheet_of={uid: metadata[uid].get('sheet') for uid in updates})
+            if changed:
+                self.last_excel_write = (write_started, file_signature(self.excel_file))
+        metrics.incr('cells_written', changed)
+        for uid, values in updates.items():
+            if '文件数量' not in values:
+                continue
+            meta = metadata[uid]
+            meta['file_count'] = values['文件数量']
+            set_status(meta, values['材料准备'])
+            meta['last_updated'] = now_iso()
+            meta['fingerprint'] = row_fingerprint(uid, meta.get('current_payer'), meta.get('current_content'),
+                                                  values['材料准备'], meta.get('excel_row'), meta.get('sheet'))
+            log.info("📁 %s: %s 个文件, 材料准备 → %s", self.folder_of(meta), values['文件数量'], values['材料准备'])
+        with metrics.phase('metadata_save'):
+            metrics.incr('metadata_records_written', self.save_metadata() or 0)
+        return changed, needs_sync
+
+    def _refresh_amounts(self, metadata, affected, updates):
+        """票据文件变化后重新核对受影响行的金额(台账金额使用元数据中记录的值),变化的单元格合并到updates"""
+        folders = {}
+        for uid, folder_path in affected.items():
+            meta = metadata[uid]
+            if 'receipt_total' not in meta or 'fingerprint' not in meta:
+                # 还没有核对过,或者需要完整同步的行,交给下一次同步
+                continue
+            try:
+                with os.scandir(folder_path) as it:
+                    folders[uid] = [Path(entry.path) for entry in it if entry.is_file()]
+            except OSError:
+                continue
+        if not folders:
+            return False
+
+        hash_index, cache = self._load_amount_sources()
+        totals = reconcile_folders(folders, hash_index, cache)
+        hash_index.save()
+        cache.save()
+
+        changed = False
+        for uid, total in totals.items():
+            meta = metadata[uid]
+            before = (meta.get('receipt_total'), meta.get('amount_check'))
+            cells = self._amount_cells(meta, meta.get('ledger_amount'), amount_key(total))
+            if cells:
+                updates.setdefault(uid, {}).update(cells)
+            changed = changed or (meta['receipt_total'], meta['amount_check']) != before
+        return changed
+
+    def _cleanup_old_format(self, metadata):
+        """清理旧格式的元数据(使用数字索引作为key的旧记录),元数据读取后只检查一次"""
+        if self._old_format_checked:
+            return []
+        if not self.dry_run:
+            self._old_format_checked = True
+        old_format_keys = [k for k in metadata.keys() if k.isdigit()]
+        if old_format_keys:
+            print(f"\n🔄 检测到 {len(old_format_keys)} 个旧格式的元数据记录,正在清理...")
+            for old_key in old_format_keys:
+                # 移除旧格式的记录
+                del metadata[old_key]
+            print(f"✅ 已清理旧格式记录")
+        return old_format_keys
+
+    def _cleanup_orphaned_ids(self, metadata, active_unique_ids, incremental=False):
+        """
+        检查是否有被删除的行(元数据中存在但Excel中不存在的ID)
+
+        增量模式下只处理新删除的行,已经标记为deleted的记录不再重复检查;
+        只同步部分工作表时,只检查本次读取了的工作表中的记录(其他工作表的行没有被读取,不能当作已删除)
+        """
+        completed_dir = self.completed_dir
+        pending_dir = self.pending_dir
+        base_dir = self.base_dir
+        snapshot = self.snapshot
+
+        orphaned_ids = set(metadata.keys()) - active_unique_ids
+        self.metrics.incr('metadata_scanned', len(metadata))
+        if self.sheets is not None and '*' not in self.sheets:
+            parsed = set(self._active_sheets or ())
+            orphaned_ids = {uid for uid in orphaned_ids if metadata[uid].get('sheet') in parsed}
+        if incremental:
+            orphaned_ids = {uid for uid in orphaned_ids if not metadata[uid].get('deleted')}
+        if not orphaned_ids:
+            return orphaned_ids
+
+        print(f"\n🗑️  检测到 {len(orphaned_ids)} 个已删除的记录:")
+        plan = SyncPlan()
+        removals = []
+        for orphaned_id in orphaned_ids:
+            orphaned_meta = metadata[orphaned_id]
+            orphaned_folder = self.folder_of(orphaned_meta)
+
+            # 兼容旧格式(payer)和新格式(original_payer)
+            payer_name = orphaned_meta.get('original_payer') or orphaned_meta.get('payer') or orphaned_meta.get('current_payer')
+            content_name = orphaned_meta.get('original_content') or orphaned_meta.get('current_content')
+
+            log.info("\n   ID: %s\n   付款人: %s\n   开票内容: %s\n   文件夹: %s",
+                     orphaned_id, payer_name, content_name, orphaned_folder)
+
+            if snapshot.exists(orphaned_folder):
+                # 检查文件夹中是否有文件
+                file_count = snapshot.file_count(orphaned_folder)
+                if file_count:
+                    log.info("   ⚠️  文件夹中还有 %s 个文件,已保留", file_count)
+                else:
+                    # 文件夹为空,删除它,再检查父文件夹(付款人文件夹)是否也为空
+                    op = plan.rmdir(orphaned_folder)
+                    parent_op = None
+                    parent_folder = orphaned_folder.parent
+                    if parent_folder != base_dir and parent_folder not in [completed_dir, pending_dir]:
+                        parent_op = plan.rmdir(parent_folder, only_if_empty=True)
+                    removals.append((orphaned_folder, op, parent_op))
+            else:
+                log.info("   ℹ️  文件夹不存在")
+
+            # 标记为已删除(保留元数据以便恢复);完整同步会再次检查已删除的记录,保留第一次的删除时间
+            if not orphaned_meta.get('deleted') or 'deleted_at' not in orphaned_meta:
+                orphaned_meta['deleted_at'] = now_iso()
+            orphaned_meta['deleted'] = True
+
+        self._apply_plan(plan, '已删除记录的空文件夹')
+        reported_parents = set()
+        for orphaned_folder, op, parent_op in removals:
+            if not op.done:
+                log.error("   ❌ 删除空文件夹失败 %s: %s", orphaned_folder, op.error)
+                continue
+            log.info("   ✅ 文件夹为空,已删除: %s", orphaned_folder)
+            if parent_op is not None and parent_op.done and id(parent_op) not in reported_parents:
+                reported_parents.add(id(parent_op))
+                log.info("   ✅ 父文件夹 %s 也为空,已删除", parent_op.path.name)
+        return orphaned_ids
+
+    def _archive_expired(self, metadata):
+        """把超过保留期、文件夹已经不存在的删除记录移到冷存储,返回归档的唯一ID列表"""
+        expired = [uid for uid in expired_ids(metadata, self.retention_days)
+                   if not metadata[uid].get('folder_path') or not self.snapshot.exists(self.folder_of(metadata[uid]))]
+        if not expired:
+            return []
+        if self.dry_run:
+            print(f"\n🗄️  将归档 {len(expired)} 条超过{self.retention_days:g}天的删除记录")
+            return expired
+        self.cold_store.append([(uid, metadata[uid]) for uid in expired])
+        for uid in expired:
+            del metadata[uid]
+        print(f"\n🗄️  已归档 {len(expired)} 条超过{self.retention_days:g}天的删除记录")
+        return expired
+
+    def _restore_archived(self, metadata, unique_id):
+        """带着已归档的唯一ID重新出现的行: 从冷存储恢复记录(文件夹在归档区时随后会被移回状态文件夹)"""
+        record = self.cold_store.find(unique_id)
+        if record is None:
+            return False
+        metadata[unique_id] = dict(record)
+        metadata[unique_id].pop('archived_folder', None)
+        log.info("♻️  唯一ID %s 从归档中恢复", unique_id)
+        return True
+
+    def _cleanup_untracked_folders(self, metadata, active_unique_ids):
+        """清理不在活跃列表中的所有文件夹"""
+        # 收集所有活跃的文件夹路径
+        active_folder_paths = set()
+        for uid in active_unique_ids:
+            if uid in metadata:
+                active_folder_paths.add(self.folder_of(metadata[uid]))
+
+        snapshot = self.snapshot
+        plan = SyncPlan()
+        for payer_root in self.payer_roots():
+            for payer_folder in snapshot.subdirs(payer_root):
                 # 遍历付款人文件夹下的所有文件夹
-                for content_folder in payer_folder.iterdir():
-                    if content_folder.is_dir():
-                        # 检查这个文件夹是否在活跃列表中
-                        if content_folder not in active_folder_paths:
-                            # 不在活跃列表中,检查是否有文件
-                            files = [f for f in content_folder.rglob('*') if f.is_file()]
-                            if files:
-                                print(f"\n⚠️  发现未追踪的文件夹(有文件,已保留):")
-                                print(f"   路径: {content_folder}")
-                                print(f"   文件数: {len(files)} 个")
-                            else:
-                                # 空文件夹,删除它
-                                try:
-                                    import shutil
-                                    shutil.rmtree(content_folder)
-                                    orphaned_folders_cleaned.append(str(content_folder))
-                                    print(f"\n🧹 清理未追踪的空文件夹: {content_folder}")
-                                except Exception as e:
-                                    print(f"\n❌ 清理文件夹失败 {content_folder}: {e}")
-
-# 清理空的付款人文件夹(在✅已完成和📋待处理文件夹中)
-empty_folders_deleted = []
-for status_folder in [completed_dir, pending_dir]:
-    if status_folder.exists():
-        for item in status_folder.iterdir():
-            if item.is_dir():
+                for content_folder in snapshot.subdirs(payer_folder):
+                    # 检查这个文件夹是否在活跃列表中
+                    if content_folder not in active_folder_paths:
+                        # 不在活跃列表中,检查是否有文件
+                        file_count = snapshot.total_file_count(content_folder)
+                        if file_count:
+                            log.warning("\n⚠️  发现未追踪的文件夹(有文件,已保留,可以用retention.py移到归档区):"
+                                        "\n   路径: %s\n   文件数: %s 个", content_folder, file_count)
+                        else:
+                            # 空文件夹,删除它
+                            plan.rmtree(content_folder)
+
+        self._apply_plan(plan, '未追踪的空文件夹')
+        orphaned_folders_cleaned = []
+        for op in plan.operations:
+            if op.done:
+                orphaned_folders_cleaned.append(str(op.path))
+                log.info("🧹 清理未追踪的空文件夹: %s", op.path)
+            else:
+                log.error("❌ 清理文件夹失败 %s: %s", op.path, op.error)
+        return orphaned_folders_cleaned
+
+    def _cleanup_empty_folders(self):
+        """清理空的付款人文件夹和根目录下的旧空文件夹"""
+        # 清理空的付款人文件夹(在✅已完成和📋待处理文件夹中)
+        snapshot = self.snapshot
+        plan = SyncPlan()
+        labels = {}
+        for status_folder in [self.completed_dir, self.pending_dir]:
+            for item in snapshot.subdirs(status_folder):
+                # 检查是否为空文件夹(多工作表时是工作表文件夹,其中的空付款人文件夹删除后它也会变为空)
+                if snapshot.is_empty(item) or (self.sheets is not None and not snapshot.files(item)
+                                               and all(snapshot.is_empty(sub) for sub in snapshot.subdirs(item))):
+                    labels[id(plan.rmdir(item, only_if_empty=True))] = f"{status_folder.name}/{item.name}"
+                if self.sheets is not None:
+                    for payer_folder in snapshot.subdirs(item):
+                        if snapshot.is_empty(payer_folder):
+                            labels[id(plan.rmdir(payer_folder, only_if_empty=True))] = \
+                                f"{status_folder.name}/{item.name}/{payer_folder.name}"
+
+        # 同时清理根目录下的旧文件夹(不在状态文件夹中的)
+        for item in snapshot.subdirs(self.base_dir):
+            if item.name not in ['.git', '.azure', '✅已完成', '📋待处理', ARCHIVE_DIR, '.venv', '__pycache__']:
                 # 检查是否为空文件夹
-                try:
-                    if not any(item.iterdir()):
-                        item.rmdir()
-                        empty_folders_deleted.append(f"{status_folder.name}/{item.name}")
-                except Exception as e:
-                    pass  # 忽略错误
-
-# 同时清理根目录下的旧文件夹(不在状态文件夹中的)
-for item in base_dir.iterdir():
-    if item.is_dir() and item.name not in ['.git', '.azure', '✅已完成', '📋待处理', '.venv', '__pycache__']:
-        # 检查是否为空文件夹
+                if snapshot.is_empty(item):
+                    labels[id(plan.rmdir(item, only_if_empty=True))] = item.name
+
+        # 删除失败的文件夹忽略
+        self._apply_plan(plan, '空的付款人文件夹')
+        empty_folders_deleted = [labels[id(op)] for op in plan.operations if op.done]
+
+        if empty_folders_deleted:
+            print(f"\n🧹 清理空的付款人文件夹:")
+            for folder_name in empty_folders_deleted:
+                print(f"   ✅ 已删除: {folder_name}")
+        return empty_folders_deleted
+
+    def _check_duplicates(self, metadata, active_unique_ids):
+        """增量更新文件内容哈希索引,报告不同行/付款人之间内容相同的票据"""
+        if self.hash_index is None:
+            self.hash_index = FileHashIndex(self.base_dir / HASH_INDEX_FILE).load()
+
+        paths = [p for folder in [self.completed_dir, self.pending_dir]
+                 for p in self.snapshot.walk_files(folder)]
+        hashed = self.hash_index.update(paths)
+        self.hash_index.save()
+        print(f"\n🔍 票据哈希: 共 {len(paths)} 个文件,本次计算 {hashed} 个")
+
+        # 文件夹 -> (付款人, 行号),用于在报告中定位重复文件属于哪一行
+        folder_owners = {}
+        for uid in active_unique_ids:
+            meta = metadata.get(uid)
+            if meta:
+                folder_owners[str(self.folder_of(meta))] = (meta.get('current_payer'), meta.get('excel_row'))
+
+        duplicates = self.hash_index.cross_folder_duplicates()
+        report_duplicates(duplicates, folder_owners)
+        return duplicates
+
+    def _load_amount_sources(self):
+        """加载(或复用常驻内存的)哈希索引和票据金额缓存"""
+        if self.hash_index is None:
+            self.hash_index = FileHashIndex(self.base_dir / HASH_INDEX_FILE).load()
+        if self.amount_cache is None:
+            self.amount_cache = AmountCache(self.base_dir / AMOUNT_CACHE_FILE).load()
+        return self.hash_index, self.amount_cache
+
+    def _amount_cells(self, meta, ledger_amount, total, force=False):
+        """
+        根据台账金额和票据合计更新元数据,返回需要写回的单元格(与上次写回的值相同时为空)
+
+        ledger_amount/total是amount_key()的结果;force=True时(例如刚添加了列)无论是否变化都写回
+        """
+        check = check_text(ledger_amount, total)
+        cells = {}
+        if force or 'receipt_total' not in meta or meta['receipt_total'] != total:
+            cells[RECEIPT_TOTAL_COLUMN] = None if total is None else float(total)
+        if force or 'amount_check' not in meta or meta['amount_check'] != check:
+            cells[AMOUNT_CHECK_COLUMN] = check
+        if check is not None and meta.get('amount_check') != check:
+            log.warning("💰 %s: %s", self.folder_of(meta), check)
+        meta['ledger_amount'] = ledger_amount
+        meta['receipt_total'] = total
+        meta['amount_check'] = check
+        return cells
+
+    def _check_amounts(self, metadata, amount_rows, row_updates, added_columns=None):
+        """
+        计算每行的票据合计并与台账金额核对,变化的单元格合并到row_updates
+
+        只有文件名中没有金额的PDF需要解析,解析结果按内容哈希缓存;返回元数据发生变化的行数
+        """
+        added_columns = added_columns or {}
+        folders = {}
+        for sheet, row, uid in amount_rows:
+            meta = metadata.get(uid)
+            if meta is not None and meta.get('folder_path'):
+                folders[uid] = self.snapshot.files(self.folder_of(meta))
+        if not folders:
+            return 0
+
+        hash_index, cache = self._load_amount_sources()
+        parsed_before = cache.parsed
+        totals = reconcile_folders(folders, hash_index, cache)
+        hash_index.save()
+        cache.save()
+        self.metrics.incr('pdfs_parsed', cache.parsed - parsed_before)
+
+        changed = 0
+        mismatched = 0
+        for sheet, row, uid in amount_rows:
+            if uid not in totals:
+                continue
+            meta = metadata[uid]
+            before = (meta.get('ledger_amount'), meta.get('receipt_total'), meta.get('amount_check'))
+            force = RECEIPT_TOTAL_COLUMN in added_columns.get(sheet, ())
+            cells = self._amount_cells(meta, amount_key(row.amount), amount_key(totals[uid]), force)
+            if cells:
+                row_updates.setdefault(sheet, {}).setdefault(row.excel_row, {}).update(cells)
+            if (meta['ledger_amount'], meta['receipt_total'], meta['amount_check']) != before:
+                changed += 1
+            if meta['amount_check'] is not None:
+                mismatched += 1
+        print(f"\n💰 金额核对: {len(totals)} 行,金额不一致 {mismatched} 行 (本次解析PDF {cache.parsed - parsed_before} 个)")
+        return changed
+
+    def _save_excel(self, row_updates, added_columns=None):
+        """
+        只把变化的单元格写回 Excel 文件(新增的列同时写表头),没有变化时不打开也不保存,返回修改的单元格数
+
+        row_updates: {工作表名: {Excel行号: {列名: 新值}}}, added_columns: {工作表名: [列名]}
+        工作表名为None表示第一个工作表;没有变化的工作表保持原样
+        """
+        excel_file = self.excel_file
+        required_columns = added_columns or {}
+        if not any(row_updates.values()) and not any(required_columns.values()):
+            print(f"\nExcel 文件没有变化,跳过保存")
+            return 0
         try:
-            if not any(item.iterdir()):
-                item.rmdir()
-                empty_folders_deleted.append(item.name)
+            write_started = time.time()
+            changed = write_sheet_cells(excel_file, row_updates, required_columns)
+            if changed:
+                self.last_excel_write = (write_started, file_signature(excel_file))
+                print(f"\nExcel 文件已更新: {excel_file} (修改 {changed} 个单元格)")
+            else:
+                print(f"\nExcel 文件没有变化,跳过保存")
+            return changed
+        except PermissionError:
+            print(f"\n⚠️  无法保存 Excel 文件: {excel_file}")
+            print("可能的原因:")
+            print("1. Excel 文件正在被 Microsoft Excel 或其他程序打开")
+            print("2. 文件被设置为只读")
+            print("\n解决方法:")
+            print("1. 关闭 Excel 文件后重新运行此脚本")
+            print("2. 或者脚本会创建一个备份文件: 社团报销_updated.xlsx")
+
+            # 尝试保存为新文件
+            try:
+                backup_file = str(Path(excel_file).with_name(Path(excel_file).stem + '_updated.xlsx'))
+                write_sheet_cells(excel_file, row_updates, required_columns, output_file=backup_file)
+                print(f"\n✅ 已保存为新文件: {backup_file}")
+            except Exception as e:
+                print(f"\n❌ 保存备份文件也失败: {e}")
         except Exception as e:
-            pass  # 忽略错误
+            print(f"\n保存 Excel 文件失败: {e}")
+        return 0
 
-if empty_folders_deleted:
-    print(f"\n🧹 清理空的付款人文件夹:")
-    for folder_name in empty_folders_deleted:
-        print(f"   ✅ 已删除: {folder_name}")
 
-# 保存元数据
-save_metadata(metadata)
-
-# 保存更新后的 Excel 文件
-try:
-    df.to_excel(excel_file, index=False)
-    print(f"\nExcel 文件已更新: {excel_file}")
-except PermissionError:
-    print(f"\n⚠️  无法保存 Excel 文件: {excel_file}")
-    print("可能的原因:")
-    print("1. Excel 文件正在被 Microsoft Excel 或其他程序打开")
-    print("2. 文件被设置为只读")
-    print("\n解决方法:")
-    print("1. 关闭 Excel 文件后重新运行此脚本")
-    print("2. 或者脚本会创建一个备份文件: 社团报销_updated.xlsx")
-    
-    # 尝试保存为新文件
-    try:
-        backup_file = '社团报销_updated.xlsx'
-        df.to_excel(backup_file, index=False)
-        print(f"\n✅ 已保存为新文件: {backup_file}")
-    except Exception as e:
-        print(f"\n❌ 保存备份文件也失败: {e}")
-except Exception as e:
-    print(f"\n保存 Excel 文件失败: {e}")
+def setup_logging(level='INFO'):
+    """把同步过程的日志输出到标准输出(只输出消息本身,与print的输出格式一致)"""
+    logging.basicConfig(level=getattr(logging, str(level).upper(), logging.INFO),
+                        format='%(message)s', stream=sys.stdout)
+
+
+def sync(excel_file=EXCEL_FILE, metadata_file=METADATA_FILE, base_dir='.', incremental=False,
+         check_duplicates=False, max_workers=8, dry_run=False, metrics_file=None, profile=None,
+         check_amounts=False):
+    """执行一次同步(一次性使用,需要常驻内存请直接使用SyncEngine)"""
+    return SyncEngine(excel_file, metadata_file, base_dir, incremental=incremental,
+                      check_duplicates=check_duplicates, max_workers=max_workers, dry_run=dry_run,
+                      metrics_file=metrics_file, profile=profile, check_amounts=check_amounts).sync()
+
+
+def main():
+    import argparse
+
+    # 设置标准输出编码为UTF-8,解决Windows命令行emoji显示问题
+    if sys.platform == 'win32':
+        import io
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+    parser = argparse.ArgumentParser(description='根据Excel内容同步报销文件夹')
+    parser.add_argument('--incremental', action='store_true',
+                        help='增量模式: 只处理与上次同步相比发生变化的行')
+    parser.add_argument('--check-duplicates', action='store_true',
+                        help='检查不同行/付款人之间内容相同的票据文件')
+    parser.add_argument('--check-amounts', action='store_true',
+                        help='从票据文件名和PDF发票中提取金额,写入"票据金额"列并与台账金额列核对')
+    parser.add_argument('--amount-column',
+                        help=f'与票据金额核对的台账金额列(默认使用配置文件中的amount_column,没有配置时为"{AMOUNT_COLUMN}")')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='只打印将要执行的文件夹操作和单元格修改,不做任何修改')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='并行执行文件夹操作的线程数(默认8,1表示逐个执行)')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='日志级别: DEBUG显示每一行的处理过程,INFO只显示变化(默认)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='等同于 --log-level DEBUG')
+    parser.add_argument('--metrics-file', help='把本次同步的阶段耗时和计数器追加到这个JSON Lines文件')
+    parser.add_argument('--profile', help='用cProfile分析同步过程,结果保存到这个文件(可用snakeviz等工具查看)')
+    parser.add_argument('--sheets', nargs='+',
+                        help="同步的工作表名称('*'为全部),每个工作表使用独立的子目录;默认只同步第一个工作表")
+    parser.add_argument('--config', help='多台账配置文件(默认: 当前目录下有ledgers.json时使用它,否则只同步当前目录)')
+    parser.add_argument('--ledger', action='append',
+                        help='只同步配置文件中指定名称的台账(可以多次指定)')
+    parser.add_argument('--retention-days', type=float,
+                        help='删除的行在元数据中保留的天数,超过后归档到冷存储(默认使用配置文件中的retention_days,没有配置时一直保留)')
+    parser.add_argument('--rollback', action='store_true',
+                        help='回滚上一次中断的同步(把已移动的文件夹移回原位置),不执行新的同步')
+    args = parser.parse_args()
+
+    setup_logging('DEBUG' if args.verbose else args.log_level)
+
+    from ledger_config import load_ledgers
+    ledgers = load_ledgers(args.config)
+    if args.ledger:
+        ledgers = [ledger for ledger in ledgers if ledger.name in args.ledger]
+        if not ledgers:
+            print(f"❌ 配置文件中没有名为 {', '.join(args.ledger)} 的台账")
+            sys.exit(1)
+
+    for ledger in ledgers:
+        if len(ledgers) > 1:
+            print(f"\n{'='*60}\n📒 {ledger.name}: {ledger.excel_file}\n{'='*60}")
+        engine = ledger.create_engine(
+            sheets=args.sheets or ledger.sheets, incremental=args.incremental, check_duplicates=args.check_duplicates,
+            check_amounts=args.check_amounts or ledger.check_amounts,
+            amount_column=args.amount_column or ledger.amount_column,
+            retention_days=args.retention_days if args.retention_days is not None else ledger.retention_days,
+            max_workers=args.workers, dry_run=args.dry_run,
+            metrics_file=args.metrics_file, profile=args.profile,
+        )
+        try:
+            if args.rollback:
+                engine.rollback_interrupted()
+            else:
+                engine.sync()
+        finally:
+            engine.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+目录快照 - 用os.scandir一次性扫描受管理的文件夹树,供同步的各个阶段查询
+
+每个目录最多只扫描一次(完整同步时预先扫描状态文件夹,其他目录按需扫描),
+同步过程中自己执行的创建/移动/删除操作通过 record_* 方法增量更新快照,
+不需要重新遍历目录。在网络共享盘上每次遍历目录都要花费数秒,这一点尤为重要
+"""
+
+import os
+from pathlib import Path
+
+
+class _Node:
+    """快照中的一个目录: 直接包含的文件名和子目录"""
+
+    __slots__ = ('files', 'children', 'scanned')
+
+    def __init__(self, scanned=False):
+        self.files = set()
+        self.children = {}
+        self.scanned = scanned
+
+
+class DirectorySnapshot:
+    """受管理文件夹树的内存快照"""
+
+    def __init__(self, root='.'):
+        self.root = Path(root)
+        self._root_node = _Node()
+        self.scans = 0  # 实际执行的scandir次数
+
+    # ---------- 扫描 ----------
+
+    def _scan(self, path, node, recursive=False):
+        """用scandir扫描一个目录,填充节点"""
+        node.files = set()
+        node.children = {}
+        node.scanned = True
+        self.scans += 1
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            node.children[entry.name] = _Node()
+                        elif entry.is_file():
+                            node.files.add(entry.name)
+                    except OSError:
+                        pass
+        except OSError:
+            return False
+        if recursive:
+            for name, child in node.children.items():
+                self._scan(os.path.join(path, name), child, recursive=True)
+        return True
+
+    def build(self, *folders):
+        """重新开始快照: 扫描根目录,并递归扫描给定的文件夹(通常是状态文件夹)"""
+        self._root_node = _Node()
+        self._scan(self.root, self._root_node)
+        for folder in folders:
+            node = self._node(folder)
+            if node is not None:
+                self._scan(folder, node, recursive=True)
+        return self
+
+    def _parts(self, path):
+        """把路径转换为相对根目录的各级名称,不在根目录下时返回None"""
+        path = Path(path)
+        try:
+            return path.relative_to(self.root).parts
+        except ValueError:
+            rel = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+            if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+                return None
+            return Path(rel).parts if rel != os.curdir else ()
+
+    def _node(self, path):
+        """获取路径对应的节点(必要时按需扫描),目录不存在时返回None"""
+        parts = self._parts(path)
+        if parts is None:
+            # 不在快照范围内的路径: 临时扫描,不缓存
+            node = _Node()
+            return node if self._scan(path, node) else None
+        node = self._root_node
+        current = self.root
+        if not node.scanned:
+            self._scan(current, node)
+        for name in parts:
+            node = node.children.get(name)
+            current = current / name
+            if node is None:
+                return None
+            if not node.scanned and not self._scan(current, node):
+                return None
+        return node
+
+    # ---------- 查询 ----------
+
+    def exists(self, path):
+        """目录是否存在"""
+        return self._node(path) is not None
+
+    def file_count(self, path):
+        """目录中直接包含的文件数(不包括子文件夹),目录不存在时返回0"""
+        node = self._node(path)
+        return len(node.files) if node is not None else 0
+
+    def files(self, path):
+        """目录中直接包含的文件路径列表(按名称排序)"""
+        node = self._node(path)
+        if node is None:
+            return []
+        return [Path(path) / name for name in sorted(node.files)]
+
+    def total_file_count(self, path):
+        """目录及所有子目录中的文件总数"""
+        node = self._node(path)
+        if node is None:
+            return 0
+        total = len(node.files)
+        for name in node.children:
+            total += self.total_file_count(Path(path) / name)
+        return total
+
+    def walk_files(self, path):
+        """递归列出目录及所有子目录中的文件路径"""
+        node = self._node(path)
+        if node is None:
+            return
+        for name in sorted(node.files):
+            yield Path(path) / name
+        for name in sorted(node.children):
+            yield from self.walk_files(Path(path) / name)
+
+    def is_empty(self, path):
+        """目录是否为空(既没有文件也没有子目录)"""
+        node = self._node(path)
+        return node is not None and not node.files and not node.children
+
+    def subdirs(self, path):
+        """目录下的子目录路径列表(按名称排序)"""
+        node = self._node(path)
+        if node is None:
+            return []
+        return [Path(path) / name for name in sorted(node.children)]
+
+    # ---------- 同步自身操作的增量更新 ----------
+
+    def _parent_node(self, path):
+        """获取路径的父节点(不触发扫描),不在快照中时返回None"""
+        parts = self._parts(path)
+        if not parts:
+            return None, None
+        node = self._root_node
+        for name in parts[:-1]:
+            node = node.children.get(name)
+            if node is None:
+                return None, None
+        return node, parts[-1]
+
+    def record_mkdir(self, path):
+        """记录创建目录(相当于mkdir(parents=True, exist_ok=True))"""
+        parts = self._parts(path)
+        if parts is None:
+            return
+        node = self._root_node
+        current = self.root
+        for name in parts:
+            # 沿途的已有目录必须先扫描,否则会把已有目录误当作新建的空目录
+            if not node.scanned:
+                self._scan(current, node)
+            child = node.children.get(name)
+            if child is None:
+                # 新建的目录一定是空的,不需要再扫描
+                child = _Node(scanned=True)
+                node.children[name] = child
+            node = child
+            current = current / name
+
+    def record_move(self, src, dst):
+        """记录把目录从src移动到dst,整个子树跟随移动"""
+        parent, name = self._parent_node(src)
+        node = parent.children.pop(name, None) if parent is not None else None
+        if node is None:
+            self.invalidate(dst)
+            return
+        self.record_mkdir(Path(dst).parent)
+        new_parent, new_name = self._parent_node(dst)
+        if new_parent is not None:
+            new_parent.children[new_name] = node
+
+    def record_remove(self, path):
+        """记录删除目录(rmdir或rmtree)"""
+        parent, name = self._parent_node(path)
+        if parent is not None:
+            parent.children.pop(name, None)
+
+    def invalidate(self, path):
+        """使某个目录的快照失效,下次查询时重新扫描"""
+        if self._parts(path) == ():
+            self._root_node = _Node()
+            return
+        parent, name = self._parent_node(path)
+        if parent is not None and name in parent.children:
+            parent.children[name] = _Node()
+        elif parent is not None and parent.scanned:
+            # 父目录已扫描但不知道这个子目录: 让父目录重新扫描
+            parent.scanned = False
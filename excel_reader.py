@@ -0,0 +1,183 @@
+"""
+Excel台账流式读取 - 只读取同步需要的列
+
+用openpyxl的只读模式逐行解析工作表,只取 付款人/开票内容/唯一ID/材料准备/文件数量(核对金额时还有金额列)所在的列范围,
+每一行生成一个使用__slots__的紧凑记录,不构建DataFrame,也不为每一行创建Series。
+台账增长到几万行、带有很宽的附件列时,内存和解析时间都保持平稳
+
+工作簿有多个工作表(例如每学期一个)时,SheetParser 在多个进程中同时解析各个工作表(进程池在多次同步之间复用)
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import openpyxl
+
+
+# 同步需要读取的列(顺序与LedgerRow的构造参数一致,最后是金额列)
+SYNC_READ_COLUMNS = ('付款人', '开票内容', '唯一ID', '材料准备', '文件数量')
+AMOUNT_COLUMN = '金额'  # 默认的台账金额列,各台账可以在配置中用amount_column指定
+
+
+class LedgerRow:
+    """
+    台账中的一行
+
+    同步过程中可以修改 unique_id / status / file_count,
+    changes() 返回与读取时相比发生变化的单元格,用于只写回这些单元格;
+    amount是台账中的报销金额(只读,用于与票据金额核对,没有金额列时为None)
+    """
+
+    __slots__ = ('excel_row', 'payer', 'content', 'unique_id', 'status', 'file_count', 'amount', '_original')
+
+    def __init__(self, excel_row, payer, content, unique_id, status, file_count, amount=None):
+        self.excel_row = excel_row
+        self.payer = payer
+        self.content = content
+        self.unique_id = unique_id
+        self.status = status
+        self.file_count = file_count
+        self.amount = amount
+        self._original = (unique_id, file_count, status)
+
+    def changes(self):
+        """返回 {列名: 新值},只包含发生变化的列"""
+        result = {}
+        for column, old, new in zip(('唯一ID', '文件数量', '材料准备'), self._original,
+                                    (self.unique_id, self.file_count, self.status)):
+            if old != new:
+                result[column] = new
+        return result
+
+
+class LedgerReader:
+    """
+    台账读取器
+
+    用法:
+        reader = LedgerReader('社团报销.xlsx')
+        for row in reader:
+            ...
+        reader.columns  # 表头中的列名 -> 列号
+    """
+
+    def __init__(self, excel_file, sheet_name=None, amount_column=AMOUNT_COLUMN):
+        self.excel_file = str(excel_file)
+        self.sheet_name = sheet_name  # None表示第一个工作表
+        self.amount_column = amount_column  # 读取为LedgerRow.amount的列,None表示不读取金额
+        self.columns = {}  # 表头中的列名 -> 列号(从1开始)
+        self.rows_read = 0
+        self.read_seconds = 0.0  # 解析工作表花费的时间(不包括调用方处理每一行的时间)
+
+    def __iter__(self):
+        start = time.perf_counter()
+        wb = openpyxl.load_workbook(self.excel_file, read_only=True, data_only=True)
+        try:
+            ws = wb[self.sheet_name] if self.sheet_name else wb.worksheets[0]
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, ())
+            self.columns = {str(v).strip(): i + 1 for i, v in enumerate(header) if v is not None}
+
+            positions = [self.columns.get(name) for name in SYNC_READ_COLUMNS]
+            positions.append(self.columns.get(self.amount_column) if self.amount_column else None)
+            present = [p for p in positions if p is not None]
+            if not present:
+                return
+            # 只解析需要的列所在的范围,右侧的宽附件列直接跳过
+            min_col, max_col = min(present), max(present)
+            offsets = [p - min_col if p is not None else None for p in positions]
+
+            excel_row = 1
+            for values in ws.iter_rows(min_row=2, min_col=min_col, max_col=max_col, values_only=True):
+                excel_row += 1
+                fields = [values[o] if o is not None and o < len(values) else None for o in offsets]
+                # 完全空白的行(例如表格末尾带格式的空行)直接跳过
+                if all(v is None for v in fields):
+                    continue
+                self.rows_read += 1
+                self.read_seconds += time.perf_counter() - start
+                yield LedgerRow(excel_row, *fields)
+                start = time.perf_counter()
+        finally:
+            wb.close()
+            self.read_seconds += time.perf_counter() - start
+
+
+class ParsedSheet:
+    """已经解析完成的工作表(多工作表并行解析的结果),接口与LedgerReader相同"""
+
+    def __init__(self, sheet_name, columns, rows, parse_seconds):
+        self.sheet_name = sheet_name
+        self.columns = columns
+        self.rows = rows
+        self.rows_read = len(rows)
+        self.parse_seconds = parse_seconds
+        self.read_seconds = 0.0  # 解析已经完成,遍历不再花费读取时间
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+def sheet_names(excel_file):
+    """工作簿中所有工作表的名称(按顺序)"""
+    wb = openpyxl.load_workbook(str(excel_file), read_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+
+def _parse_sheet(excel_file, sheet_name, amount_column=AMOUNT_COLUMN):
+    """在工作进程中解析一个工作表"""
+    reader = LedgerReader(excel_file, sheet_name, amount_column)
+    rows = list(reader)
+    return ParsedSheet(sheet_name, reader.columns, rows, reader.read_seconds)
+
+
+class SheetParser:
+    """
+    同时解析多个工作表的进程池,在多次同步之间复用
+
+    openpyxl的解析是纯Python代码,多线程无法并行,所以使用多进程;Windows上的进程以spawn方式启动,
+    每个工作进程都要重新启动解释器并导入openpyxl,每次保存都新建进程池的开销往往超过解析几个小工作表本身。
+    进程池在第一次解析多个工作表时创建,之后一直保留到close();进程池无法使用时(例如受限的运行环境)
+    关闭它并改为逐个解析,之后不再尝试
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self._pool = None
+        self._disabled = False
+
+    def read(self, excel_file, names, amount_column=AMOUNT_COLUMN):
+        """解析工作表,返回ParsedSheet列表(顺序与names相同)"""
+        names = list(names)
+        if len(names) > 1 and not self._disabled:
+            try:
+                if self._pool is None:
+                    workers = min(len(names), self.max_workers or os.cpu_count() or 1)
+                    self._pool = ProcessPoolExecutor(max_workers=workers)
+                return list(self._pool.map(_parse_sheet, [str(excel_file)] * len(names), names,
+                                           [amount_column] * len(names)))
+            except Exception as e:
+                logging.getLogger('create_folders').warning("⚠️  无法并行解析工作表,改为逐个解析: %s", e)
+                self.close()
+                self._disabled = True
+        return [_parse_sheet(str(excel_file), name, amount_column) for name in names]
+
+    def close(self):
+        """关闭进程池(之后再解析时会重新创建)"""
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+def read_sheets(excel_file, names, max_workers=None, amount_column=AMOUNT_COLUMN):
+    """同时解析多个工作表,返回ParsedSheet列表(一次性使用;多次同步请使用SheetParser复用进程池)"""
+    parser = SheetParser(max_workers)
+    try:
+        return parser.read(excel_file, names, amount_column)
+    finally:
+        parser.close()
@@ -0,0 +1,149 @@
+"""
+Excel单元格写回 - 只修改发生变化的单元格,不重新生成整个工作簿
+
+用openpyxl打开工作簿,只修改需要更新的单元格,其他单元格的格式、公式以及其他工作表保持不变;
+没有任何单元格变化时不保存文件(保存会再次触发auto_watch.py的监控,大表保存也很慢)
+"""
+
+import math
+
+import openpyxl
+
+
+def header_columns(ws):
+    """读取表头(第一行),返回 列名 -> 列号(从1开始)"""
+    columns = {}
+    for cell in next(ws.iter_rows(min_row=1, max_row=1), ()):
+        if cell.value is not None:
+            columns[str(cell.value).strip()] = cell.column
+    return columns
+
+
+def _coerce(value):
+    """规范化要写入的值: 整数值的浮点数写为整数,NaN写为空单元格"""
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if value.is_integer():
+            return int(value)
+    return value
+
+
+def _same(old, new):
+    """比较单元格旧值和新值(Excel中的数字可能读成int或float)"""
+    if old == new:
+        return True
+    if old is None or new is None:
+        return False
+    return str(old).strip() == str(new).strip()
+
+
+def _ensure_columns(ws, columns, names):
+    """在表头末尾添加缺少的列,返回新增的列数"""
+    added = 0
+    for name in names:
+        if name not in columns:
+            column = ws.max_column + 1 if columns else 1
+            ws.cell(row=1, column=column, value=name)
+            columns[name] = column
+            added += 1
+    return added
+
+
+def _apply(ws, columns, row, values):
+    """修改一行中值发生变化的单元格,返回修改数"""
+    changed = 0
+    for column_name, value in values.items():
+        if column_name not in columns:
+            continue
+        value = _coerce(value)
+        cell = ws.cell(row=row, column=columns[column_name])
+        if not _same(cell.value, value):
+            cell.value = value
+            changed += 1
+    return changed
+
+
+def _worksheet(wb, sheet_name):
+    """按名称获取工作表,None表示第一个工作表"""
+    return wb[sheet_name] if sheet_name else wb.worksheets[0]
+
+
+def write_sheet_cells(excel_file, sheet_updates, required_columns=None, output_file=None):
+    """
+    按工作表和Excel行号写回单元格,所有工作表只打开和保存一次
+
+    sheet_updates: {工作表名: {Excel行号: {列名: 新值}}},工作表名为None表示第一个工作表
+    required_columns: {工作表名: 必须存在的列},表头中没有时追加到末尾
+    没有修改的工作表不会被改动(openpyxl保存时保留它们的值、格式和公式)
+    返回实际修改的单元格数(包括新增的表头);只有修改数大于0时才保存文件
+    """
+    required_columns = {sheet: list(names) for sheet, names in (required_columns or {}).items() if names}
+    if not any(sheet_updates.values()) and not required_columns:
+        return 0
+
+    wb = openpyxl.load_workbook(excel_file)
+    changed = 0
+    for sheet_name in list(sheet_updates) + [s for s in required_columns if s not in sheet_updates]:
+        ws = _worksheet(wb, sheet_name)
+        columns = header_columns(ws)
+        changed += _ensure_columns(ws, columns, required_columns.get(sheet_name, ()))
+        for row, values in sheet_updates.get(sheet_name, {}).items():
+            changed += _apply(ws, columns, row, values)
+
+    if changed:
+        wb.save(output_file or excel_file)
+    return changed
+
+
+def update_cells(excel_file, updates, row_hints=None, id_column='唯一ID', sheet_of=None):
+    """
+    按唯一ID更新单元格
+
+    updates: {唯一ID: {列名: 新值}}
+    row_hints: {唯一ID: Excel行号},用于直接定位行,定位不对时再按唯一ID列查找
+    sheet_of: {唯一ID: 工作表名},没有记录的ID在第一个工作表中查找
+    返回实际修改的单元格数;只有修改数大于0时才保存文件
+    """
+    if not updates:
+        return 0
+    row_hints = row_hints or {}
+    sheet_of = sheet_of or {}
+
+    by_sheet = {}
+    for uid in updates:
+        by_sheet.setdefault(sheet_of.get(uid), []).append(uid)
+
+    wb = openpyxl.load_workbook(excel_file)
+    changed = 0
+    for sheet_name, uids in by_sheet.items():
+        ws = _worksheet(wb, sheet_name)
+        columns = header_columns(ws)
+        if id_column not in columns:
+            raise KeyError(f"Excel中没有'{id_column}'列")
+        id_col = columns[id_column]
+
+        # 先用行号提示定位,提示失效的ID再扫描一次唯一ID列
+        rows = {}
+        missing = []
+        for uid in uids:
+            hint = row_hints.get(uid)
+            if hint and str(ws.cell(row=hint, column=id_col).value).strip() == uid:
+                rows[uid] = hint
+            else:
+                missing.append(uid)
+        if missing:
+            wanted = set(missing)
+            for (cell,) in ws.iter_rows(min_row=2, min_col=id_col, max_col=id_col):
+                value = cell.value
+                if value is not None and str(value).strip() in wanted:
+                    rows[str(value).strip()] = cell.row
+
+        for uid in uids:
+            row = rows.get(uid)
+            if row is not None:
+                changed += _apply(ws, columns, row, updates[uid])
+
+    if changed:
+        wb.save(excel_file)
+    return changed
@@ -0,0 +1,359 @@
+"""
+报销包导出 - 把已完成的行的票据打包为每个付款人一个zip(或合并的PDF)
+
+每个包按工作表和Excel行号排序,开头是生成的目录(序号、行号、付款人、开票内容、文件数、票据金额、文件列表):
+- zip: 目录为 00_目录.csv,每行的票据放在 付款人/行号.开票内容/ 下(多工作表时前面还有工作表名);
+  文件按块流式写入,不会整个读入内存,
+  jpg/png/pdf等已经压缩过的文件直接存储,不再重复压缩
+- pdf: 每行的PDF和图片依次合并(图片需要安装Pillow,合并需要安装pypdf),每行一个书签作为目录,
+  同时在PDF旁边写一份同名的目录csv
+
+export_manifest.json 记录每个包的输入(文件路径、大小、修改时间和目录内容),
+输入没有变化的包不会重新生成;各个包在线程池中同时生成
+
+用法:
+    python export_packages.py                       # ✅已完成的行,每个付款人一个zip
+    python export_packages.py --format pdf --batch-size 50
+    python export_packages.py --status check --group all
+"""
+
+import argparse
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import sys
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from create_folders import setup_logging, sheet_folder_name
+from dir_snapshot import DirectorySnapshot
+from metadata_store import atomic_write_json
+
+
+# 默认配置
+EXPORT_DIR = '📦报销包'
+MANIFEST_FILE = 'export_manifest.json'
+INDEX_NAME = '00_目录.csv'
+INDEX_HEADER = ['序号', 'Excel行号', '工作表', '付款人', '开票内容', '文件数', '票据金额', '文件']
+# 已经压缩过的格式直接存储,再用deflate压缩只会浪费时间
+STORED_SUFFIXES = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.pdf', '.zip', '.rar', '.7z', '.mp4'}
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp', '.tif', '.tiff'}
+
+log = logging.getLogger('create_folders')
+
+
+class ExportRow:
+    """要导出的一行: 元数据中的信息和行文件夹中的票据文件"""
+
+    __slots__ = ('unique_id', 'sheet', 'excel_row', 'payer', 'content', 'folder', 'files', 'receipt_total')
+
+    def __init__(self, unique_id, sheet, excel_row, payer, content, folder, files, receipt_total=None):
+        self.unique_id = unique_id
+        self.sheet = sheet
+        self.excel_row = excel_row
+        self.payer = payer
+        self.content = content
+        self.folder = folder
+        self.files = files
+        self.receipt_total = receipt_total
+
+    def sort_key(self):
+        return (self.sheet or '', self.excel_row or 0)
+
+
+def collect_rows(engine, status='yes'):
+    """
+    从元数据和目录快照中收集要导出的行
+
+    status: 'yes'/'check'/'no' 只导出该状态的行,'all'导出所有行;已删除的记录和没有文件的行不导出
+    """
+    metadata = engine.load_metadata()
+    snapshot = DirectorySnapshot(engine.base_dir)
+    rows = []
+    for uid, meta in metadata.items():
+        if meta.get('deleted') or not meta.get('folder_path'):
+            continue
+        folder = engine.folder_of(meta)
+        row_status = meta.get('status')
+        if row_status is None:
+            # 旧版本同步产生的元数据没有记录状态: 按文件夹所在的状态文件夹判断
+            row_status = 'yes' if engine.completed_dir in folder.parents else 'no'
+        if status != 'all' and row_status != status:
+            continue
+        files = snapshot.files(folder)
+        if not files:
+            continue
+        rows.append(ExportRow(uid, meta.get('sheet'), meta.get('excel_row'),
+                              meta.get('current_payer') or meta.get('original_payer'),
+                              meta.get('current_content') or meta.get('original_content'),
+                              folder, files, meta.get('receipt_total')))
+    rows.sort(key=ExportRow.sort_key)
+    return rows
+
+
+def group_rows(rows, group='payer', batch_size=None):
+    """
+    把行分成若干个包,返回 {包名: [行]}
+
+    group: 'payer' 每个付款人(多工作表时每个工作表的每个付款人)一个包,'all' 所有行一个包;
+    batch_size: 每个包最多包含的行数,超过时按行号顺序拆分为 第1批、第2批...
+    包名用作文件名,付款人和工作表名中Windows文件名不允许的字符替换为_(替换后重名时加序号)
+    """
+    keyed = {}
+    for row in rows:
+        key = None if group == 'all' else (row.sheet, row.payer)
+        keyed.setdefault(key, []).append(row)
+    groups = {}
+    for key, members in keyed.items():
+        if key is None:
+            name = '报销包'
+        else:
+            sheet, payer = key
+            name = sheet_folder_name(payer) if sheet is None else sheet_folder_name(f"{sheet}_{payer}")
+        unique, n = name, 2
+        while unique in groups:
+            unique = f"{name} ({n})"
+            n += 1
+        groups[unique] = members
+    if not batch_size:
+        return groups
+    batches = {}
+    for name, members in groups.items():
+        if len(members) <= batch_size:
+            batches[name] = members
+            continue
+        for n, start in enumerate(range(0, len(members), batch_size), 1):
+            batches[f"{name}_第{n}批"] = members[start:start + batch_size]
+    return batches
+
+
+def index_rows(rows):
+    """包的目录内容(不包括表头)"""
+    return [[n, row.excel_row, row.sheet or '', row.payer, row.content, len(row.files),
+             row.receipt_total or '', ' | '.join(path.name for path in row.files)]
+            for n, row in enumerate(rows, 1)]
+
+
+def index_csv(rows):
+    """目录的csv文本(带BOM,Excel可以直接打开)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(INDEX_HEADER)
+    writer.writerows(index_rows(rows))
+    return '\ufeff' + buffer.getvalue()
+
+
+def package_fingerprint(rows, fmt):
+    """包的输入指纹: 格式、目录内容以及每个文件的路径、大小和修改时间"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([fmt, index_rows(rows)], ensure_ascii=False, default=str).encode('utf-8'))
+    for row in rows:
+        for path in row.files:
+            member = f"{member_folder(row)}/{path.name}"
+            try:
+                st = os.stat(path)
+                digest.update(f"{member}\0{path}\0{st.st_size}\0{st.st_mtime_ns}\n".encode('utf-8'))
+            except OSError:
+                digest.update(f"{member}\0{path}\0missing\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def member_folder(row):
+    """
+    行的票据在zip中所在的文件夹: 付款人/行号.开票内容(与行文件夹在状态文件夹下的路径相同)
+
+    多工作表时前面加工作表文件夹名,不同工作表中行号相同的行(--group all)不会写入同名的成员
+    """
+    folder = f"{row.folder.parent.name}/{row.folder.name}"
+    return folder if row.sheet is None else f"{sheet_folder_name(row.sheet)}/{folder}"
+
+
+def write_zip(path, rows):
+    """写入zip: 先写目录,再按行号顺序逐个写入票据文件(ZipFile.write按块复制,不会整个读入内存)"""
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(INDEX_NAME, index_csv(rows))
+        for row in rows:
+            folder = member_folder(row)
+            for file_path in row.files:
+                compress = zipfile.ZIP_STORED if file_path.suffix.lower() in STORED_SUFFIXES else zipfile.ZIP_DEFLATED
+                zf.write(file_path, f"{folder}/{file_path.name}", compress_type=compress)
+
+
+def _image_pdf(path):
+    """把一张图片转换为单页PDF(需要Pillow),返回内存中的PDF,不支持时返回None"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    with Image.open(path) as image:
+        buffer = io.BytesIO()
+        image.convert('RGB').save(buffer, format='PDF')
+    buffer.seek(0)
+    return buffer
+
+
+def write_pdf(path, rows):
+    """
+    合并为一个PDF: 每行一个书签,依次加入该行的PDF和图片;其他格式的文件跳过并提示
+
+    需要pypdf;图片需要Pillow。返回没有合并的文件列表
+    """
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    skipped = []
+    for row in rows:
+        bookmark = None
+        for file_path in row.files:
+            suffix = file_path.suffix.lower()
+            start = len(writer.pages)
+            try:
+                if suffix == '.pdf':
+                    writer.append(str(file_path))
+                elif suffix in IMAGE_SUFFIXES:
+                    image = _image_pdf(file_path)
+                    if image is None:
+                        skipped.append(file_path)
+                        continue
+                    writer.append(image)
+                else:
+                    skipped.append(file_path)
+                    continue
+            except Exception as e:
+                log.warning("⚠️  无法合并 %s: %s", file_path, e)
+                skipped.append(file_path)
+                continue
+            if bookmark is None and len(writer.pages) > start:
+                bookmark = writer.add_outline_item(f"{row.excel_row}.{row.content}", start)
+    with open(path, 'wb') as f:
+        writer.write(f)
+    writer.close()
+    return skipped
+
+
+class PackageExporter:
+    """生成报销包,跳过输入没有变化的包"""
+
+    def __init__(self, engine, output_dir=None, fmt='zip', group='payer', batch_size=None, status='yes',
+                 max_workers=4, force=False):
+        self.engine = engine
+        self.output_dir = Path(output_dir) if output_dir else engine.base_dir / EXPORT_DIR
+        self.fmt = fmt
+        self.group = group
+        self.batch_size = batch_size
+        self.status = status
+        self.max_workers = max_workers
+        self.force = force
+        self.manifest_file = self.output_dir / MANIFEST_FILE
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                return json.load(f).get('packages', {})
+        except (OSError, ValueError):
+            return {}
+
+    def _build(self, item):
+        """在工作线程中生成一个包(先写临时文件再替换,中断时不会留下不完整的包)"""
+        file_name, rows = item
+        target = self.output_dir / file_name
+        tmp = target.with_name(target.name + '.tmp')
+        # PDF中没有可以放表格的地方,目录写在旁边的同名csv中(同样先写临时文件,在PDF之后替换)
+        index_target = target.with_suffix('.csv') if self.fmt == 'pdf' else None
+        index_tmp = None if index_target is None else index_target.with_name(index_target.name + '.tmp')
+        try:
+            if self.fmt == 'pdf':
+                skipped = write_pdf(tmp, rows)
+                index_tmp.write_text(index_csv(rows), encoding='utf-8')
+            else:
+                write_zip(tmp, rows)
+                skipped = []
+            os.replace(tmp, target)
+            if index_tmp is not None:
+                os.replace(index_tmp, index_target)
+            return file_name, skipped, None
+        except Exception as e:
+            for path in (tmp, index_tmp):
+                if path is not None and path.exists():
+                    path.unlink()
+            return file_name, [], e
+
+    def run(self):
+        """生成所有包,返回统计信息 {'built', 'skipped', 'failed', 'rows'}"""
+        rows = collect_rows(self.engine, self.status)
+        packages = group_rows(rows, self.group, self.batch_size)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        manifest = self._load_manifest()
+
+        todo = []
+        fingerprints = {}
+        unchanged = 0
+        for name, members in packages.items():
+            file_name = f"{name}.{self.fmt}"
+            fingerprints[file_name] = package_fingerprint(members, self.fmt)
+            if not self.force and manifest.get(file_name) == fingerprints[file_name] \
+                    and (self.output_dir / file_name).exists():
+                unchanged += 1
+                continue
+            todo.append((file_name, members))
+
+        failed = 0
+        if todo:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(todo)))) as pool:
+                for file_name, skipped, error in pool.map(self._build, todo):
+                    if error is not None:
+                        failed += 1
+                        fingerprints.pop(file_name, None)
+                        manifest.pop(file_name, None)
+                        log.error("❌ 生成 %s 失败: %s", file_name, error)
+                        continue
+                    log.info("📦 已生成: %s", self.output_dir / file_name)
+                    for path in skipped:
+                        log.warning("   ⚠️  未合并: %s", path)
+
+        manifest.update(fingerprints)
+        atomic_write_json(self.manifest_file, {'version': 1, 'packages': manifest}, indent=2)
+        return {'built': len(todo) - failed, 'skipped': unchanged, 'failed': failed, 'rows': len(rows)}
+
+
+def main():
+    # 设置标准输出编码为UTF-8,解决Windows命令行emoji显示问题
+    if sys.platform == 'win32':
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+    parser = argparse.ArgumentParser(description='把已完成的行的票据导出为报销包(zip或合并的PDF)')
+    parser.add_argument('--format', choices=['zip', 'pdf'], default='zip', help='包的格式(默认zip)')
+    parser.add_argument('--group', choices=['payer', 'all'], default='payer',
+                        help='payer: 每个付款人一个包(默认); all: 所有行一个包')
+    parser.add_argument('--batch-size', type=int, help='每个包最多包含的行数,超过时拆分为多批')
+    parser.add_argument('--status', choices=['yes', 'check', 'no', 'all'], default='yes',
+                        help='导出的材料准备状态(默认yes,即✅已完成)')
+    parser.add_argument('--output', help=f'输出目录(默认为台账目录下的{EXPORT_DIR})')
+    parser.add_argument('--workers', type=int, default=4, help='同时生成的包数(默认4)')
+    parser.add_argument('--force', action='store_true', help='输入没有变化的包也重新生成')
+    parser.add_argument('--config', help='多台账配置文件(默认: 当前目录下有ledgers.json时使用它)')
+    parser.add_argument('--ledger', action='append', help='只导出配置文件中指定名称的台账(可以多次指定)')
+    args = parser.parse_args()
+
+    setup_logging('INFO')
+
+    from ledger_config import load_ledgers
+    ledgers = load_ledgers(args.config)
+    if args.ledger:
+        ledgers = [ledger for ledger in ledgers if ledger.name in args.ledger]
+    for ledger in ledgers:
+        output_dir = Path(args.output) / ledger.name if args.output and len(ledgers) > 1 else args.output
+        exporter = PackageExporter(ledger.create_engine(), output_dir, fmt=args.format, group=args.group,
+                                   batch_size=args.batch_size, status=args.status,
+                                   max_workers=args.workers, force=args.force)
+        result = exporter.run()
+        print(f"✅ {ledger.name}: {result['rows']} 行, 生成 {result['built']} 个包, "
+              f"未变化跳过 {result['skipped']} 个, 失败 {result['failed']} 个 → {exporter.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
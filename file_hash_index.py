@@ -0,0 +1,181 @@
+"""
+票据文件内容哈希索引 - 发现重复提交的发票/行程单
+
+索引按 (路径, 文件大小, 修改时间) 缓存每个文件的SHA-256,
+文件没有变化时不会重新计算哈希;需要计算的文件在线程池中并行处理。
+索引保存在 file_hash_index.json 中,下次同步时继续复用
+"""
+
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+# 默认配置
+HASH_INDEX_FILE = 'file_hash_index.json'
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """流式计算文件的SHA-256,不会把整个文件读入内存"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileHashIndex:
+    """持久化的文件内容哈希索引"""
+
+    def __init__(self, index_file=HASH_INDEX_FILE, max_workers=8):
+        self.index_file = str(index_file)
+        self.max_workers = max_workers
+        self.entries = {}  # 路径 -> {'size', 'mtime', 'sha256'}
+        self._dirty = False
+
+    def load(self):
+        """加载索引文件,文件不存在或损坏时从空索引开始"""
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f).get('files', {})
+            except Exception as e:
+                print(f"⚠️  加载哈希索引失败,将重新计算: {e}")
+                self.entries = {}
+        return self
+
+    def save(self):
+        """保存索引(先写临时文件再替换,避免写到一半留下损坏的文件)"""
+        if not self._dirty:
+            return
+        tmp_file = self.index_file + '.tmp'
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'version': 1, 'files': self.entries}, f, ensure_ascii=False)
+            os.replace(tmp_file, self.index_file)
+            self._dirty = False
+        except Exception as e:
+            print(f"❌ 保存哈希索引失败: {e}")
+
+    def update(self, paths):
+        """
+        更新索引,使其恰好包含给定的文件
+
+        返回新计算哈希的文件数;大小和修改时间都没有变化的文件直接复用旧哈希,
+        随文件夹一起移动过的文件(文件名、大小、修改时间都相同)也不会重新计算
+        """
+        keep, hashed = self._resolve(paths)
+        if hashed or len(keep) != len(self.entries):
+            self._dirty = True
+        self.entries = keep
+        return hashed
+
+    def hashes(self, paths):
+        """
+        返回给定文件的 {路径: SHA-256},需要时计算并加入索引
+
+        与update()不同,不会从索引中删除其他文件,适合只处理部分文件夹的调用方
+        """
+        found, hashed = self._resolve(paths)
+        for key, entry in found.items():
+            if self.entries.get(key) is not entry:
+                self.entries[key] = entry
+                self._dirty = True
+        return {key: entry['sha256'] for key, entry in found.items()}
+
+    def _resolve(self, paths):
+        """查找或计算给定文件的索引条目,返回 ({路径: 条目}, 新计算哈希的文件数)"""
+        moved_lookup = None
+        keep = {}
+        to_hash = []
+        for path in paths:
+            key = str(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entry = self.entries.get(key)
+            if entry and entry.get('size') == st.st_size and entry.get('mtime') == st.st_mtime_ns:
+                keep[key] = entry
+                continue
+            if entry is None:
+                if moved_lookup is None:
+                    moved_lookup = {(Path(k).name, e.get('size'), e.get('mtime')): e for k, e in self.entries.items()}
+                moved = moved_lookup.get((Path(key).name, st.st_size, st.st_mtime_ns))
+                if moved is not None:
+                    keep[key] = moved
+                    self._dirty = True
+                    continue
+            to_hash.append((key, st.st_size, st.st_mtime_ns))
+
+        if to_hash:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                results = pool.map(self._hash_one, to_hash)
+                for key, entry in results:
+                    if entry is not None:
+                        keep[key] = entry
+        return keep, len(to_hash)
+
+    @staticmethod
+    def _hash_one(item):
+        key, size, mtime = item
+        try:
+            return key, {'size': size, 'mtime': mtime, 'sha256': hash_file(key)}
+        except OSError as e:
+            print(f"⚠️  无法读取文件 {key}: {e}")
+            return key, None
+
+    def duplicates(self):
+        """返回内容相同的文件分组(每组至少两个路径)"""
+        by_hash = {}
+        for key, entry in self.entries.items():
+            by_hash.setdefault(entry['sha256'], []).append(key)
+        return [sorted(group) for group in by_hash.values() if len(group) > 1]
+
+    def cross_folder_duplicates(self):
+        """返回分布在不同文件夹(不同行或不同付款人)中的重复文件分组"""
+        return [group for group in self.duplicates()
+                if len({str(Path(p).parent) for p in group}) > 1]
+
+
+def report_duplicates(groups, folder_owners=None):
+    """打印重复票据,folder_owners可以把文件夹路径映射为 (付款人, 行号) 便于定位"""
+    if not groups:
+        return
+    folder_owners = folder_owners or {}
+    print(f"\n🔁 发现 {len(groups)} 组重复的票据文件(内容完全相同):")
+    for group in groups:
+        print()
+        for path in group:
+            owner = folder_owners.get(str(Path(path).parent))
+            if owner:
+                print(f"   - [{owner[0]} 第{owner[1]}行] {path}")
+            else:
+                print(f"   - {path}")
+
+
+def main():
+    # 设置标准输出编码为UTF-8,解决Windows命令行emoji显示问题
+    if sys.platform == 'win32':
+        import io
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+    from dir_snapshot import DirectorySnapshot
+
+    status_dirs = [Path('✅已完成'), Path('📋待处理')]
+    snapshot = DirectorySnapshot('.').build(*status_dirs)
+    paths = [p for folder in status_dirs for p in snapshot.walk_files(folder)]
+
+    index = FileHashIndex().load()
+    hashed = index.update(paths)
+    index.save()
+    print(f"🔍 共 {len(paths)} 个文件,本次计算哈希 {hashed} 个")
+    report_duplicates(index.cross_folder_duplicates())
+
+
+if __name__ == "__main__":
+    main()
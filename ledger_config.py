@@ -0,0 +1,120 @@
+"""
+多台账配置 - 一个进程管理多个社团的报销台账
+
+配置文件 ledgers.json 列出每个社团的台账、元数据文件和文件夹根目录:
+
+    {
+        "ledgers": [
+            {"name": "摄影社", "base_dir": "摄影社"},
+            {"name": "动漫社", "excel_file": "D:/共享/动漫社/报销.xlsx", "base_dir": "D:/共享/动漫社",
+             "sheets": ["2024秋", "2025春"]}
+        ]
+    }
+
+- base_dir: 该社团的✅已完成/📋待处理所在的目录(必填,不同台账不能相同)
+- excel_file: 默认为 base_dir/社团报销.xlsx
+- metadata_file: 默认为 base_dir/folder_metadata.json(不同台账不能相同)
+- name: 显示名称,默认为base_dir的文件夹名
+- sheets: 同步的工作表(["*"]为全部),默认只同步第一个工作表
+- check_amounts: 为true时核对票据金额与台账金额列(见receipt_amounts.py),默认不核对
+- amount_column: 台账中报销金额所在的列名,默认为"金额";工作表中没有这一列时只写入票据金额,不做核对
+- retention_days: 删除的行在元数据中保留的天数,超过后归档到冷存储(见retention.py),默认一直保留
+相对路径以配置文件所在的目录为基准。没有配置文件时使用当前目录下的单个台账(与以前相同)
+"""
+
+import json
+from pathlib import Path
+
+from create_folders import EXCEL_FILE, SyncEngine
+from excel_reader import AMOUNT_COLUMN
+from metadata_store import METADATA_FILE
+
+
+# 默认配置
+CONFIG_FILE = 'ledgers.json'
+
+
+class LedgerConfig:
+    """一个社团台账的配置"""
+
+    def __init__(self, name, excel_file, metadata_file, base_dir, sheets=None, check_amounts=False,
+                 retention_days=None, amount_column=AMOUNT_COLUMN):
+        self.name = name
+        self.excel_file = Path(excel_file)
+        self.metadata_file = Path(metadata_file)
+        self.base_dir = Path(base_dir)
+        self.sheets = sheets
+        self.check_amounts = check_amounts
+        self.retention_days = retention_days
+        self.amount_column = amount_column
+
+    @property
+    def key(self):
+        """用于判断两个配置是否为同一个台账(同一个台账的同步必须串行)"""
+        return str(self.excel_file.resolve()).lower()
+
+    def create_engine(self, **options):
+        """为这个台账创建同步引擎"""
+        options.setdefault('sheets', self.sheets)
+        options.setdefault('check_amounts', self.check_amounts)
+        options.setdefault('retention_days', self.retention_days)
+        options.setdefault('amount_column', self.amount_column)
+        return SyncEngine(excel_file=self.excel_file, metadata_file=self.metadata_file,
+                          base_dir=self.base_dir, **options)
+
+
+def default_ledger():
+    """没有配置文件时的默认台账: 当前目录下的社团报销.xlsx"""
+    return LedgerConfig(Path.cwd().name or '社团报销', EXCEL_FILE, METADATA_FILE, '.')
+
+
+def load_config(config_file=CONFIG_FILE):
+    """读取配置文件,返回LedgerConfig列表;配置有误时抛出ValueError"""
+    config_path = Path(config_file)
+    with open(config_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    root = config_path.resolve().parent
+    ledgers = []
+    seen = {}
+    seen_dirs = {}  # 两个台账共用同一个base_dir时,各自的同步会把对方的行文件夹当作未追踪的文件夹
+    seen_metadata = {}  # 两个台账共用同一个元数据文件时,会互相覆盖快照和预写日志
+    for i, entry in enumerate(data.get('ledgers', [])):
+        if 'base_dir' not in entry:
+            raise ValueError(f"配置文件第 {i + 1} 个台账缺少 base_dir")
+        base_dir = root / entry['base_dir']
+        ledger = LedgerConfig(
+            name=entry.get('name') or base_dir.name,
+            excel_file=root / entry.get('excel_file', base_dir / EXCEL_FILE),
+            metadata_file=root / entry.get('metadata_file', base_dir / METADATA_FILE),
+            base_dir=base_dir,
+            sheets=entry.get('sheets'),
+            check_amounts=bool(entry.get('check_amounts', False)),
+            retention_days=entry.get('retention_days'),
+            amount_column=entry.get('amount_column') or AMOUNT_COLUMN,
+        )
+        if ledger.key in seen:
+            raise ValueError(f"台账 {ledger.excel_file} 在配置文件中出现了两次({seen[ledger.key]} 和 {ledger.name})")
+        seen[ledger.key] = ledger.name
+        dir_key = str(ledger.base_dir.resolve()).lower()
+        if dir_key in seen_dirs:
+            raise ValueError(f"目录 {ledger.base_dir} 被两个台账同时用作base_dir({seen_dirs[dir_key]} 和 {ledger.name})")
+        seen_dirs[dir_key] = ledger.name
+        metadata_key = str(ledger.metadata_file.resolve()).lower()
+        if metadata_key in seen_metadata:
+            raise ValueError(f"元数据文件 {ledger.metadata_file} 被两个台账同时使用({seen_metadata[metadata_key]} 和 {ledger.name})")
+        seen_metadata[metadata_key] = ledger.name
+        ledgers.append(ledger)
+
+    if not ledgers:
+        raise ValueError(f"配置文件 {config_file} 中没有任何台账")
+    return ledgers
+
+
+def load_ledgers(config_file=None):
+    """指定了配置文件或当前目录下有ledgers.json时读取配置,否则返回默认的单个台账"""
+    if config_file is None and Path(CONFIG_FILE).exists():
+        config_file = CONFIG_FILE
+    if config_file is None:
+        return [default_ledger()]
+    return load_config(config_file)
@@ -0,0 +1,146 @@
+"""
+元数据存储 - folder_metadata.json + 追加写入的变更日志
+
+folder_metadata.json 仍然是完整的元数据快照(格式与以前相同,已有文件无需迁移),
+每次保存时只把发生变化的记录追加到 folder_metadata.journal.jsonl,不再重写整个JSON。
+变更日志积累到一定数量后自动压缩: 先把合并后的快照写入临时文件再原子替换,最后清空日志。
+
+进程在任何时刻被中断都不会留下写了一半的JSON:
+- 快照总是通过临时文件 + os.replace 原子替换
+- 日志最后一行如果没有写完整,加载时会被忽略
+"""
+
+import json
+import os
+
+
+# 默认配置
+METADATA_FILE = 'folder_metadata.json'
+JOURNAL_SUFFIX = '.journal.jsonl'
+COMPACT_THRESHOLD = 500  # 日志记录数超过该值(且超过元数据条目数)时压缩
+
+
+def journal_path(metadata_file):
+    """元数据文件对应的变更日志路径"""
+    root, _ = os.path.splitext(str(metadata_file))
+    return root + JOURNAL_SUFFIX
+
+
+def _serialize(record):
+    """记录的规范化序列化结果,用于判断记录是否变化"""
+    return json.dumps(record, ensure_ascii=False, sort_keys=True)
+
+
+def atomic_write_json(path, data, indent=None):
+    """先写临时文件再替换,保证目标文件要么是旧内容要么是完整的新内容"""
+    tmp_file = f"{path}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+
+class MetadataStore:
+    """folder_metadata.json 的存储后端: 快照 + 追加写入的变更日志"""
+
+    def __init__(self, metadata_file=METADATA_FILE, compact_threshold=COMPACT_THRESHOLD):
+        self.metadata_file = str(metadata_file)
+        self.journal_file = journal_path(metadata_file)
+        self.compact_threshold = compact_threshold
+        self._saved = {}  # 唯一ID -> 最近一次写入磁盘的序列化结果
+        self._journal_records = 0
+        self._needs_compact = False  # 日志中有损坏的行,下次保存时重写快照
+        # 最近一次保存中 (写入的唯一ID列表, 删除的唯一ID列表),供二级索引增量更新;None表示未知(需要重建)
+        self.last_changes = None
+
+    def signature(self):
+        """快照和日志的(大小, 修改时间),用于判断是否被其他进程修改过"""
+        result = []
+        for path in (self.metadata_file, self.journal_file):
+            try:
+                st = os.stat(path)
+                result.append((st.st_size, st.st_mtime_ns))
+            except OSError:
+                result.append(None)
+        return tuple(result)
+
+    def load(self):
+        """读取快照并重放变更日志,返回元数据字典"""
+        metadata = {}
+        if os.path.exists(self.metadata_file):
+            try:
+                with open(self.metadata_file, 'r', encoding='utf-8') as f:
+                    metadata = json.load(f)
+            except Exception as e:
+                print(f"⚠️  加载元数据失败: {e}")
+                metadata = {}
+
+        self._journal_records = 0
+        self._needs_compact = False
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 最后一行可能因为进程中断没有写完整,忽略并在下次保存时压缩掉
+                        self._needs_compact = True
+                        continue
+                    if entry.get('op') == 'put':
+                        metadata[entry['id']] = entry['data']
+                    elif entry.get('op') == 'del':
+                        metadata.pop(entry['id'], None)
+                    self._journal_records += 1
+
+        self._saved = {uid: _serialize(record) for uid, record in metadata.items()}
+        return metadata
+
+    def save(self, metadata):
+        """只把变化的记录追加到日志,必要时压缩,返回写入的记录数"""
+        lines = []
+        current = {}
+        put_ids = []
+        for uid, record in metadata.items():
+            serialized = _serialize(record)
+            current[uid] = serialized
+            if self._saved.get(uid) != serialized:
+                lines.append(json.dumps({'op': 'put', 'id': uid, 'data': record}, ensure_ascii=False))
+                put_ids.append(uid)
+        deleted_ids = list(self._saved.keys() - current.keys())
+        for uid in deleted_ids:
+            lines.append(json.dumps({'op': 'del', 'id': uid}, ensure_ascii=False))
+
+        if self._needs_compact or not os.path.exists(self.metadata_file):
+            # 第一次保存,或者日志中有损坏的行(不能继续在后面追加): 直接写快照
+            self.compact(metadata)
+            self.last_changes = (put_ids, deleted_ids)
+            return len(lines)
+
+        self.last_changes = (put_ids, deleted_ids)
+
+        if not lines:
+            return 0
+
+        with open(self.journal_file, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._saved = current
+        self._journal_records += len(lines)
+
+        if self._journal_records > max(self.compact_threshold, len(metadata)):
+            self.compact(metadata)
+            self.last_changes = (put_ids, deleted_ids)
+        return len(lines)
+
+    def compact(self, metadata):
+        """把完整元数据原子地写回快照并清空日志"""
+        atomic_write_json(self.metadata_file, metadata, indent=2)
+        self.last_changes = None
+        # 快照已包含全部记录,此时中断也只是重复重放一次日志,结果相同
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self._saved = {uid: _serialize(record) for uid, record in metadata.items()}
+        self._journal_records = 0
+        self._needs_compact = False
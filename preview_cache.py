@@ -0,0 +1,303 @@
+"""
+票据预览缓存 - 按需生成缩略图和PDF首页预览,并为每个状态文件夹生成静态HTML联系表
+
+审核"材料准备"时不再需要逐个打开几MB的手机照片:
+- 缩略图按文件内容的SHA-256保存在受管理的文件夹树之外(默认 .preview_cache/),
+  文件移动、重命名或出现在多个行中都只生成一次;内容哈希复用 file_hash_index.json
+- JPEG用Pillow的draft模式直接按缩小后的尺寸解码,不需要解码整张大图
+- PDF首页用PyMuPDF渲染(需要安装pymupdf),没有安装时联系表中只显示文件名
+- 缓存超过容量上限时按最近使用时间(LRU)淘汰,每次使用都会更新缓存文件的修改时间
+- ✅已完成.html / 📋待处理.html 按付款人和行号列出每个行文件夹的缩略图,点击打开原文件
+
+用法:
+    python preview_cache.py                 # 生成两个状态文件夹的联系表
+    python preview_cache.py --max-mb 200 --size 320
+    python preview_cache.py --ledger 摄影社      # 多台账时只处理指定的台账(见ledger_config.py)
+"""
+
+import argparse
+import html
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from dir_snapshot import DirectorySnapshot
+from file_hash_index import FileHashIndex, HASH_INDEX_FILE
+
+
+# 默认配置
+CACHE_DIR = '.preview_cache'
+THUMBNAIL_SIZE = 256       # 缩略图最长边(像素)
+MAX_CACHE_BYTES = 500 * 1024 * 1024
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp', '.tif', '.tiff'}
+
+log = logging.getLogger('create_folders')
+
+
+def _image_thumbnail(source, target, size):
+    """生成图片缩略图(需要Pillow),JPEG在解码时就缩小到接近目标尺寸"""
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        image.convert('RGB').save(target, format='JPEG', quality=80)
+
+
+def _pdf_thumbnail(source, target, size):
+    """渲染PDF第一页的缩略图(需要PyMuPDF)"""
+    try:
+        import pymupdf
+    except ImportError:
+        import fitz as pymupdf  # 旧版本PyMuPDF的模块名
+
+    with pymupdf.open(source) as doc:
+        page = doc[0]
+        zoom = size / max(page.rect.width, page.rect.height)
+        pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+        pixmap.save(target, output='jpeg')
+
+
+def natural_key(path):
+    """按行号排序的键: 文件夹名开头的数字按数值比较(2.xxx 排在 10.xxx 前面)"""
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part)
+            for name in Path(path).parts for part in re.split(r'(\d+)', name) if part]
+
+
+class PreviewCache:
+    """按内容哈希保存缩略图的缓存目录,超过容量上限时按LRU淘汰"""
+
+    def __init__(self, cache_dir=CACHE_DIR, hash_index=None, size=THUMBNAIL_SIZE,
+                 max_bytes=MAX_CACHE_BYTES, max_workers=8):
+        self.cache_dir = Path(cache_dir)
+        self.hash_index = hash_index if hash_index is not None else FileHashIndex().load()
+        self.size = size
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.generated = 0
+        self._entries = None  # 缩略图文件名 -> (大小, 最近使用时间)
+        self._warned = set()
+
+    def _load_entries(self):
+        """扫描缓存目录一次,之后在内存中维护每个缩略图的大小和使用时间"""
+        if self._entries is None:
+            self._entries = {}
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.endswith('.jpg'):
+                        st = entry.stat()
+                        self._entries[entry.name] = (st.st_size, st.st_mtime)
+        return self._entries
+
+    def _thumbnail_name(self, digest):
+        return f"{digest}_{self.size}.jpg"
+
+    def _render(self, source, target):
+        """生成一个缩略图,不支持的格式或缺少依赖时返回False"""
+        suffix = source.suffix.lower()
+        try:
+            if suffix in IMAGE_SUFFIXES:
+                _image_thumbnail(source, target, self.size)
+            elif suffix == '.pdf':
+                _pdf_thumbnail(source, target, self.size)
+            else:
+                return False
+            return True
+        except ImportError as e:
+            if e.name not in self._warned:
+                self._warned.add(e.name)
+                package = {'fitz': 'pymupdf', 'PIL': 'pillow'}.get(e.name, e.name)
+                log.warning("⚠️  没有安装%s,无法生成%s的预览(pip install %s)",
+                            package, 'PDF' if suffix == '.pdf' else '图片', package)
+        except Exception as e:
+            log.warning("⚠️  无法生成预览 %s: %s", source, e)
+        return False
+
+    def _generate(self, item):
+        """在工作线程中生成一个缩略图(先写临时文件再替换,避免读到写了一半的图片)"""
+        source, name = item
+        target = self.cache_dir / name
+        tmp = target.with_name(f"{name}.{os.getpid()}.tmp")
+        if not self._render(source, tmp):
+            if tmp.exists():
+                tmp.unlink()
+            return name, None
+        os.replace(tmp, target)
+        return name, target.stat().st_size
+
+    def thumbnails(self, paths):
+        """
+        返回 {文件路径: 缩略图路径},没有的缩略图按需并行生成;无法生成预览的文件不在结果中
+
+        使用过的缩略图会更新使用时间,生成后检查容量上限并淘汰最久没有使用的缩略图
+        """
+        entries = self._load_entries()
+        digests = self.hash_index.hashes(paths)
+        self.hash_index.save()
+
+        names = {}
+        todo = {}
+        for path in paths:
+            digest = digests.get(str(path))
+            if digest is None:
+                continue
+            name = self._thumbnail_name(digest)
+            names[str(path)] = name
+            if name not in entries and name not in todo:
+                todo[name] = Path(path)
+
+        if todo:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(todo)))) as pool:
+                for name, size in pool.map(self._generate, [(source, name) for name, source in todo.items()]):
+                    if size is not None:
+                        entries[name] = (size, 0)
+                        self.generated += 1
+
+        result = {}
+        used = set()
+        for path, name in names.items():
+            if name in entries:
+                result[path] = self.cache_dir / name
+                used.add(name)
+        self._touch(used)
+        self.evict(keep=used)
+        return result
+
+    def thumbnail(self, path):
+        """单个文件的缩略图路径,无法生成时返回None"""
+        return self.thumbnails([path]).get(str(path))
+
+    def _touch(self, names):
+        """更新缩略图的使用时间(LRU依据)"""
+        entries = self._entries
+        for name in names:
+            try:
+                os.utime(self.cache_dir / name)
+                entries[name] = (entries[name][0], os.stat(self.cache_dir / name).st_mtime)
+            except OSError:
+                entries.pop(name, None)
+
+    def total_bytes(self):
+        return sum(size for size, _ in self._load_entries().values())
+
+    def evict(self, keep=()):
+        """缓存超过容量上限时,按使用时间从旧到新删除缩略图(keep中的缩略图正在使用,不删除),返回删除的数量"""
+        entries = self._load_entries()
+        total = self.total_bytes()
+        removed = 0
+        for name, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            if name in keep:
+                continue
+            try:
+                (self.cache_dir / name).unlink()
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            del entries[name]
+            total -= size
+            removed += 1
+        return removed
+
+
+def contact_sheet(status_dir, cache, snapshot=None, output=None):
+    """
+    为一个状态文件夹生成静态HTML联系表,返回HTML文件路径
+
+    每个行文件夹一节(按付款人和行号排序),显示其中每个文件的缩略图;联系表保存在缓存目录中
+    """
+    status_dir = Path(status_dir)
+    snapshot = snapshot or DirectorySnapshot(status_dir.parent).build(status_dir)
+    folders = {}
+    for path in snapshot.walk_files(status_dir):
+        folders.setdefault(path.parent, []).append(path)
+    thumbnails = cache.thumbnails([path for files in folders.values() for path in files])
+
+    output = Path(output) if output else cache.cache_dir / f"{status_dir.name}.html"
+    parts = [
+        '<!DOCTYPE html><html><head><meta charset="utf-8">',
+        f'<title>{html.escape(status_dir.name)}</title>',
+        '<style>body{font-family:sans-serif;margin:1em}section{margin-bottom:1.5em}'
+        'h2{font-size:1.05em;margin:.4em 0}figure{display:inline-block;margin:4px;width:'
+        f'{cache.size}px;vertical-align:top}}img{{max-width:100%;border:1px solid #ccc}}'
+        'figcaption{font-size:.75em;word-break:break-all}.missing{height:4em;background:#eee;'
+        'display:flex;align-items:center;justify-content:center;font-size:.8em}</style></head><body>',
+        f'<h1>{html.escape(status_dir.name)} ({len(folders)} 个文件夹)</h1>',
+    ]
+    for folder in sorted(folders, key=lambda p: natural_key(p.relative_to(status_dir))):
+        files = folders[folder]
+        title = html.escape(str(folder.relative_to(status_dir)))
+        parts.append(f'<section><h2>{title} ({len(files)} 个文件)</h2>')
+        for path in files:
+            link = html.escape(path.resolve().as_uri())
+            thumb = thumbnails.get(str(path))
+            if thumb is not None:
+                image = f'<img loading="lazy" src="{html.escape(os.path.relpath(thumb, output.parent))}">'
+            else:
+                image = f'<div class="missing">{html.escape(path.suffix.lower() or "?")}</div>'
+            parts.append(f'<figure><a href="{link}">{image}</a>'
+                         f'<figcaption>{html.escape(path.name)}</figcaption></figure>')
+        parts.append('</section>')
+    parts.append('</body></html>')
+
+    tmp = output.with_name(output.name + '.tmp')
+    tmp.write_text('\n'.join(parts), encoding='utf-8')
+    os.replace(tmp, output)
+    return output
+
+
+def main():
+    # 设置标准输出编码为UTF-8,解决Windows命令行emoji显示问题
+    if sys.platform == 'win32':
+        import io
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+    parser = argparse.ArgumentParser(description='生成票据缩略图和每个状态文件夹的HTML联系表')
+    parser.add_argument('--base-dir', help='✅已完成/📋待处理所在的目录(指定时不读取配置文件;默认使用配置中的各台账或当前目录)')
+    parser.add_argument('--cache-dir', help=f'缩略图缓存目录(默认为 base-dir 下的 {CACHE_DIR})')
+    parser.add_argument('--size', type=int, default=THUMBNAIL_SIZE, help=f'缩略图最长边(默认{THUMBNAIL_SIZE}像素)')
+    parser.add_argument('--max-mb', type=int, default=MAX_CACHE_BYTES // (1024 * 1024),
+                        help='缓存容量上限(MB),超过时淘汰最久没有使用的缩略图')
+    parser.add_argument('--workers', type=int, default=8, help='同时生成缩略图的线程数(默认8)')
+    parser.add_argument('--config', help='多台账配置文件(默认: 当前目录下有ledgers.json时使用它)')
+    parser.add_argument('--ledger', action='append', help='只处理配置文件中指定名称的台账(可以多次指定)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stdout)
+
+    if args.base_dir is not None:
+        targets = [(None, Path(args.base_dir))]
+    else:
+        from ledger_config import load_ledgers
+        ledgers = load_ledgers(args.config)
+        if args.ledger:
+            ledgers = [ledger for ledger in ledgers if ledger.name in args.ledger]
+            if not ledgers:
+                print(f"❌ 配置文件中没有名为 {', '.join(args.ledger)} 的台账")
+                sys.exit(1)
+        targets = [(ledger.name if len(ledgers) > 1 else None, ledger.base_dir) for ledger in ledgers]
+
+    for name, base_dir in targets:
+        if name is not None:
+            print(f"📒 {name}")
+        status_dirs = [base_dir / '✅已完成', base_dir / '📋待处理']
+        cache = PreviewCache(args.cache_dir or base_dir / CACHE_DIR,
+                             hash_index=FileHashIndex(base_dir / HASH_INDEX_FILE).load(),
+                             size=args.size, max_bytes=args.max_mb * 1024 * 1024, max_workers=args.workers)
+        snapshot = DirectorySnapshot(base_dir).build(*status_dirs)
+        for status_dir in status_dirs:
+            if snapshot.exists(status_dir):
+                output = contact_sheet(status_dir, cache, snapshot)
+                print(f"🖼️  {status_dir.name}: {output}")
+        print(f"✅ 本次生成 {cache.generated} 个缩略图,缓存共 {cache.total_bytes() / (1024 * 1024):.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+票据金额提取与核对 - 从文件名和PDF发票的文字中提取金额,与台账金额比对
+
+金额来源:
+- 文件名,例如 【5U出行-51.67元-1个行程】高德打车电子发票.pdf 中的 51.67
+- PDF的文字层: 发票取"价税合计(小写)"后的金额,行程单取"合计xx元"(只在本地解析,需要安装pypdf)
+PDF的解析结果按文件内容的SHA-256缓存在 receipt_amounts.json 中,同一个文件只解析一次,
+移动文件夹或重命名文件都不需要重新解析;需要解析的PDF在多个进程中批量处理。
+
+一行的票据合计: 有发票时只累加发票(同一笔打车的发票和行程单金额相同,不能重复计算),
+没有发票时累加行程单,都没有时累加其他能识别出金额的文件。
+合计写入台账的"票据金额"列,与台账金额列(默认"金额",可以按台账配置amount_column)不一致时在"金额核对"列中说明;
+工作表中没有金额列时(例如目前的社团报销.xlsx)只写入票据金额,核对不会生效
+"""
+
+import json
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+
+# 默认配置
+AMOUNT_CACHE_FILE = 'receipt_amounts.json'
+RECEIPT_TOTAL_COLUMN = '票据金额'   # 写回: 票据合计
+AMOUNT_CHECK_COLUMN = '金额核对'    # 写回: 金额不一致时的说明,一致时为空
+MAX_PDF_PAGES = 3                   # 发票的金额都在前几页,更长的PDF不再往后解析
+
+# 票据类型: 决定一行的合计累加哪些文件
+INVOICE = 'invoice'
+ITINERARY = 'itinerary'
+OTHER = 'other'
+
+_NUMBER = r'(\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?|\d+(?:\.\d{1,2})?)'
+_NAME_AMOUNT = re.compile(r'(?:[¥￥]\s*' + _NUMBER + r'|' + _NUMBER + r'\s*元)')
+_PDF_TOTAL = re.compile(r'[（(]\s*小\s*写\s*[）)][^¥￥\d]{0,40}[¥￥]\s*' + _NUMBER)
+_PDF_YUAN_SIGN = re.compile(r'[¥￥]\s*' + _NUMBER)
+_PDF_ITINERARY_TOTAL = re.compile(r'合\s*计\s*' + _NUMBER + r'\s*元')
+
+log = logging.getLogger('create_folders')
+
+
+def to_amount(value):
+    """把单元格的值(数字或 '12.50元' 这样的文字)转换为保留两位小数的Decimal,无法识别时返回None"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        try:
+            return Decimal(str(value)).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            return None
+    match = re.search(_NUMBER, str(value))
+    if not match:
+        return None
+    return Decimal(match.group(1).replace(',', '')).quantize(Decimal('0.01'))
+
+
+def amount_key(value):
+    """金额的字符串形式(例如 '51.67'),用于保存到元数据和比较,无法识别时为None"""
+    amount = to_amount(value)
+    return None if amount is None else str(amount)
+
+
+def kind_from_name(name):
+    """根据文件名判断票据类型"""
+    if '发票' in name:
+        return INVOICE
+    if '行程单' in name:
+        return ITINERARY
+    return OTHER
+
+
+def amount_from_name(name):
+    """从文件名中提取金额(例如 -51.67元- 或 ¥51.67),没有时返回None"""
+    match = _NAME_AMOUNT.search(Path(name).stem)
+    if not match:
+        return None
+    return to_amount(match.group(1) or match.group(2))
+
+
+def amount_from_text(text):
+    """
+    从PDF的文字中提取 (金额, 票据类型)
+
+    发票: "(小写)¥xx.xx";文字顺序错乱找不到时取所有¥金额中最大的一个(价税合计不小于任何一行的金额)
+    行程单: "合计xx元"
+    """
+    compact = text.replace('\n', ' ')
+    if '发票' in compact:
+        match = _PDF_TOTAL.search(compact)
+        if match:
+            return to_amount(match.group(1)), INVOICE
+        amounts = [to_amount(m.group(1)) for m in _PDF_YUAN_SIGN.finditer(compact)]
+        amounts = [a for a in amounts if a is not None]
+        return (max(amounts) if amounts else None), INVOICE
+    if '行程单' in compact or 'ITINERARY' in compact.upper():
+        match = _PDF_ITINERARY_TOTAL.search(compact)
+        return (to_amount(match.group(1)) if match else None), ITINERARY
+    return None, OTHER
+
+
+def parse_pdf(path):
+    """
+    在工作进程中解析一个PDF,返回 (路径, {'amount', 'kind'}),无法解析时条目为None
+
+    没有安装pypdf时返回 (路径, None),结果不会被缓存,安装后下次同步会重新解析
+    """
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return path, None
+    try:
+        reader = PdfReader(path)
+        text = '\n'.join(page.extract_text() or '' for page in reader.pages[:MAX_PDF_PAGES])
+    except Exception:
+        # 加密或损坏的PDF: 记录为无法识别,不再重复解析
+        return path, {'amount': None, 'kind': OTHER}
+    amount, kind = amount_from_text(text)
+    return path, {'amount': None if amount is None else str(amount), 'kind': kind}
+
+
+class AmountCache:
+    """按文件内容哈希缓存PDF的解析结果"""
+
+    def __init__(self, cache_file=AMOUNT_CACHE_FILE, max_workers=None):
+        self.cache_file = str(cache_file)
+        self.max_workers = max_workers
+        self.entries = {}  # SHA-256 -> {'amount': 字符串或None, 'kind'}
+        self.parsed = 0    # 本次实际解析的PDF数
+        self._dirty = False
+        self._warned = False
+
+    def load(self):
+        """加载缓存文件,文件不存在或损坏时从空缓存开始"""
+        if os.path.exists(self.cache_file):
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f).get('files', {})
+            except Exception as e:
+                print(f"⚠️  加载票据金额缓存失败,将重新解析: {e}")
+                self.entries = {}
+        return self
+
+    def save(self):
+        """保存缓存(先写临时文件再替换)"""
+        if not self._dirty:
+            return
+        tmp_file = self.cache_file + '.tmp'
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'version': 1, 'files': self.entries}, f, ensure_ascii=False)
+            os.replace(tmp_file, self.cache_file)
+            self._dirty = False
+        except Exception as e:
+            print(f"❌ 保存票据金额缓存失败: {e}")
+
+    def parse_missing(self, pdf_hashes):
+        """
+        批量解析缓存中没有的PDF,返回本次解析的数量
+
+        pdf_hashes: {路径: SHA-256},内容相同的多个文件只解析其中一个。
+        pypdf是纯Python代码,多线程无法并行,所以使用多进程;进程池无法使用时逐个解析
+        """
+        todo = {}
+        pending = set()
+        for path, digest in pdf_hashes.items():
+            if digest not in self.entries and digest not in pending:
+                todo[path] = digest
+                pending.add(digest)
+        if not todo:
+            return 0
+
+        paths = list(todo)
+        results = None
+        if len(paths) > 1:
+            workers = min(len(paths), self.max_workers or os.cpu_count() or 1)
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    results = list(pool.map(parse_pdf, paths, chunksize=max(1, len(paths) // (workers * 4))))
+            except Exception as e:
+                log.warning("⚠️  无法并行解析PDF,改为逐个解析: %s", e)
+        if results is None:
+            results = [parse_pdf(path) for path in paths]
+
+        parsed = 0
+        for path, entry in results:
+            if entry is None:
+                if not self._warned:
+                    self._warned = True
+                    log.warning("⚠️  没有安装pypdf,无法读取PDF中的金额(pip install pypdf),只使用文件名中的金额")
+                continue
+            self.entries[todo[path]] = entry
+            parsed += 1
+            self._dirty = True
+        self.parsed += parsed
+        return parsed
+
+    def get(self, digest):
+        return self.entries.get(digest)
+
+
+def receipt_info(path, digest, cache):
+    """一个票据文件的 (金额, 类型): 文件名中有金额时直接使用,否则使用PDF的解析结果"""
+    name = Path(path).name
+    kind = kind_from_name(name)
+    amount = amount_from_name(name)
+    if amount is None and digest is not None:
+        entry = cache.get(digest)
+        if entry is not None:
+            amount = to_amount(entry.get('amount'))
+            if kind == OTHER:
+                kind = entry.get('kind', OTHER)
+    return amount, kind
+
+
+def receipt_total(infos):
+    """
+    一行的票据合计,没有任何可识别的金额时返回None
+
+    infos: [(金额, 类型)];有发票时只累加发票,否则累加行程单,再否则累加其他文件
+    """
+    for kind in (INVOICE, ITINERARY, OTHER):
+        amounts = [amount for amount, k in infos if k == kind and amount is not None]
+        if amounts:
+            return sum(amounts, Decimal('0.00'))
+    return None
+
+
+def check_text(ledger_amount, total):
+    """金额核对列的内容: 一致或无法比较时为空,不一致时说明两边的金额"""
+    if ledger_amount is None or total is None or ledger_amount == total:
+        return None
+    return f"台账{ledger_amount} ≠ 票据{total}"
+
+
+def reconcile_folders(folders, hash_index, cache):
+    """
+    计算多个行文件夹的票据合计
+
+    folders: {键: [文件路径]};只有文件名中没有金额的PDF才需要哈希和解析。
+    返回 {键: 票据合计(Decimal或None)}
+    """
+    pdfs = [path for paths in folders.values() for path in paths
+            if Path(path).suffix.lower() == '.pdf' and amount_from_name(Path(path).name) is None]
+    pdf_hashes = hash_index.hashes(pdfs) if pdfs else {}
+    cache.parse_missing(pdf_hashes)
+    return {key: receipt_total([receipt_info(path, pdf_hashes.get(str(path)), cache) for path in paths])
+            for key, paths in folders.items()}
+
+
+def main():
+    # 设置标准输出编码为UTF-8,解决Windows命令行emoji显示问题
+    if sys.platform == 'win32':
+        import io
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+    from dir_snapshot import DirectorySnapshot
+    from file_hash_index import FileHashIndex
+
+    status_dirs = [Path('✅已完成'), Path('📋待处理')]
+    snapshot = DirectorySnapshot('.').build(*status_dirs)
+    folders = {}
+    for status_dir in status_dirs:
+        for path in snapshot.walk_files(status_dir):
+            folders.setdefault(path.parent, []).append(path)
+
+    hash_index = FileHashIndex().load()
+    cache = AmountCache().load()
+    totals = reconcile_folders(folders, hash_index, cache)
+    hash_index.save()
+    cache.save()
+    for folder in sorted(totals, key=str):
+        total = totals[folder]
+        print(f"   {folder}: {'-' if total is None else total}")
+    print(f"🧾 共 {len(folders)} 个文件夹,本次解析PDF {cache.parsed} 个")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+文件夹搬移 - 材料准备变化时把行文件夹在 📋待处理 和 ✅已完成 之间移动
+
+shutil.move在改名失败时会退回到逐个复制再删除,中途失败会留下两边各一半的文件;
+目标文件夹已经存在时还会把源文件夹移动到目标文件夹里面。这里按情况处理:
+- 源和目标在同一个文件系统上(按目录缓存st_dev判断,绝大多数情况): 直接os.rename,只修改目录项,
+  几百个行文件夹的状态变化也只需要几秒;PlanExecutor把同一批改名放在线程池中并行执行
+- 文件被其他程序占用(例如图片查看器打开了票据,Windows上改名会失败): 按指数退避重试几次,
+  仍然失败时报告错误,行继续使用原来的文件夹,下次同步再试,不会创建空的新文件夹
+- 跨文件系统(例如状态文件夹在不同的挂载点上): 先复制到目标旁边的临时文件夹,
+  逐个文件校验大小和SHA-256,全部一致后才改名为目标文件夹,最后删除源文件夹;复制大文件夹时输出进度
+- 目标文件夹已存在: 为空时先删除再移动,不为空时报错(不会嵌套到目标文件夹里面)
+"""
+
+import errno
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from file_hash_index import hash_file
+
+
+# 默认配置
+RETRIES = 5
+BACKOFF = 0.1                   # 第一次重试前等待的秒数,之后每次加倍(最长共约3秒)
+PROGRESS_INTERVAL = 1.0         # 复制时输出进度的最短间隔(秒)
+PARTIAL_PREFIX = '.relocating-'  # 复制中的临时文件夹,校验通过后才改名为目标文件夹
+REMOVED_PREFIX = '.relocated-'   # 复制完成后等待删除的源文件夹
+
+# 文件被其他程序占用时Windows返回的错误: 共享冲突、锁定冲突,以及文件夹中有文件被打开时改名返回的拒绝访问
+_LOCKED_WINERRORS = {5, 32, 33}
+
+log = logging.getLogger('create_folders')
+
+
+def is_locked_error(e):
+    """
+    错误是否可能是文件暂时被占用(重试可能成功)
+
+    只有Windows的共享/锁定冲突和EBUSY/ETXTBSY会重试;其他权限错误(例如POSIX上的EACCES)是持久的,立即失败
+    """
+    winerror = getattr(e, 'winerror', None)
+    if winerror is not None:
+        return winerror in _LOCKED_WINERRORS
+    return e.errno in (errno.EBUSY, errno.ETXTBSY)
+
+
+def retry(func, *args, retries=RETRIES, backoff=BACKOFF):
+    """执行文件操作,文件被占用时按指数退避重试"""
+    delay = backoff
+    for attempt in range(retries + 1):
+        try:
+            return func(*args)
+        except OSError as e:
+            if attempt == retries or not is_locked_error(e):
+                raise
+            time.sleep(delay)
+            delay *= 2
+
+
+def prepare_target(dst):
+    """目标文件夹已存在时: 为空则删除,否则报错"""
+    if not os.path.lexists(dst):
+        return
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        with os.scandir(dst) as it:
+            empty = next(it, None) is None
+        if empty:
+            os.rmdir(dst)
+            return
+    raise FileExistsError(errno.EEXIST, '目标文件夹已存在且不为空', str(dst))
+
+
+class Relocator:
+    """移动行文件夹: 同一文件系统内改名,跨文件系统时校验复制后再删除源文件夹"""
+
+    def __init__(self, retries=RETRIES, backoff=BACKOFF):
+        self.retries = retries
+        self.backoff = backoff
+        self._devices = {}  # 已存在的目录 -> st_dev
+        self._lock = threading.Lock()
+        self.renamed = 0
+        self.copied = 0
+        self.bytes_copied = 0
+
+    def device(self, path):
+        """路径所在的文件系统;路径不存在时使用最近的已存在的上级目录(结果按目录缓存)"""
+        path = Path(os.path.abspath(path))
+        while True:
+            dev = self._devices.get(path)
+            if dev is not None:
+                break
+            try:
+                dev = os.stat(path).st_dev
+                break
+            except FileNotFoundError:
+                if path.parent == path:
+                    return None
+                path = path.parent
+        self._devices[path] = dev
+        return dev
+
+    def same_filesystem(self, src, dst):
+        """目标的上级目录与源文件夹是否在同一个文件系统上(可以直接改名)"""
+        return self.device(src) == self.device(Path(dst).parent)
+
+    def _retry(self, func, *args):
+        return retry(func, *args, retries=self.retries, backoff=self.backoff)
+
+    def move(self, src, dst):
+        """移动文件夹,返回 'rename' 或 'copy';失败时抛出OSError,源文件夹保持不变"""
+        src, dst = Path(src), Path(dst)
+        prepare_target(dst)
+        if self.same_filesystem(src, dst):
+            try:
+                self._retry(os.rename, src, dst)
+                with self._lock:
+                    self.renamed += 1
+                return 'rename'
+            except OSError as e:
+                # 同一个设备号也可能跨越挂载点(例如绑定挂载),这时退回到复制
+                if e.errno != errno.EXDEV:
+                    raise
+        self.copy_move(src, dst)
+        return 'copy'
+
+    def copy_move(self, src, dst):
+        """跨文件系统移动: 复制到临时文件夹并校验,改名为目标文件夹,再删除源文件夹"""
+        src, dst = Path(src), Path(dst)
+        files = []
+        for root, _, names in os.walk(src):
+            for name in names:
+                path = Path(root) / name
+                files.append((path, path.stat().st_size))
+        total = sum(size for _, size in files)
+
+        partial = dst.parent / f"{PARTIAL_PREFIX}{dst.name}"
+        if partial.exists():
+            # 上一次中断的复制留下的临时文件夹
+            shutil.rmtree(partial)
+        try:
+            partial.mkdir(parents=True)
+            for root, dirs, _ in os.walk(src):
+                for name in dirs:
+                    (partial / Path(root).relative_to(src) / name).mkdir(exist_ok=True)
+            done = 0
+            last_report = time.monotonic()
+            for path, size in files:
+                target = partial / path.relative_to(src)
+                self._retry(shutil.copy2, path, target)
+                if target.stat().st_size != size or hash_file(target) != hash_file(path):
+                    raise OSError(errno.EIO, '复制后校验失败', str(path))
+                done += size
+                if total and time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    log.info("   📤 复制 %s: %d%% (%.1f/%.1f MB)", src.name, done * 100 // total,
+                             done / (1024 * 1024), total / (1024 * 1024))
+            # 校验全部通过后才出现目标文件夹,中断时源文件夹保持完整
+            os.rename(partial, dst)
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        with self._lock:
+            self.copied += 1
+            self.bytes_copied += total
+
+        # 源文件夹先在原位置改名,再删除;删除失败时只留下改名后的文件夹,不会被当作仍然存在的行文件夹
+        removed = src.parent / f"{REMOVED_PREFIX}{src.name}"
+        try:
+            self._retry(os.rename, src, removed)
+            self._retry(shutil.rmtree, removed)
+        except OSError as e:
+            log.warning("⚠️  已复制到 %s,但删除原文件夹失败(请稍后手动删除): %s", dst, e)
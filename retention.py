@@ -0,0 +1,257 @@
+"""
+元数据保留策略和压缩 - 热元数据和扫描的文件夹树只与活跃的行成正比
+
+Excel中删除的行在元数据中标记为deleted后一直保留(以便撤销删除时恢复),未追踪但有文件的文件夹
+每次完整同步都会被重新统计并报告一次。随着时间推移,这些都会让每次同步越来越慢:
+- 删除超过保留期(默认90天)的记录归档到冷存储 folder_metadata.archive.jsonl(追加写入,每行一条记录),
+  并从 folder_metadata.json 中移除;之后如果这一行(带着唯一ID)重新出现在Excel中,同步时会从冷存储恢复
+- 归档的记录对应的文件夹中还有文件时,文件夹移动到 🗄️归档/已删除/ 下(保持原来的相对路径)
+- 状态文件夹中没有任何记录对应、但仍有文件的文件夹移动到 🗄️归档/未追踪/ 下,同步不再扫描和报告它们
+- 旧格式(数字键)的记录一并归档,然后把元数据快照重写为一个紧凑的文件
+
+同步引擎设置了 retention_days 时,每次同步会自动归档超过保留期、文件夹已经不存在的删除记录;
+文件夹中还有文件的记录和未追踪的文件夹需要移动用户的文件,只由本命令处理
+
+用法:
+    python retention.py                      # 按默认保留期(90天)压缩
+    python retention.py --retention-days 30 --dry-run
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from dir_snapshot import DirectorySnapshot
+from sync_plan import SyncPlan
+
+
+# 默认配置
+ARCHIVE_SUFFIX = '.archive.jsonl'
+ARCHIVE_DIR = '🗄️归档'
+DELETED_AREA = '已删除'
+UNTRACKED_AREA = '未追踪'
+RETENTION_DAYS = 90
+
+
+def archive_path(metadata_file):
+    """元数据文件对应的冷存储路径"""
+    root, _ = os.path.splitext(str(metadata_file))
+    return root + ARCHIVE_SUFFIX
+
+
+class ColdStore:
+    """归档的元数据记录(追加写入的JSON Lines,同一个唯一ID出现多次时以最后一次为准)"""
+
+    def __init__(self, metadata_file):
+        self.archive_file = archive_path(metadata_file)
+        self._records = None
+        self._signature = None
+
+    def _current_signature(self):
+        try:
+            st = os.stat(self.archive_file)
+            return (st.st_size, st.st_mtime_ns)
+        except OSError:
+            return None
+
+    def load(self):
+        """读取所有归档记录: {唯一ID: 记录};文件没有变化时复用上次读取的结果"""
+        signature = self._current_signature()
+        if self._records is not None and signature == self._signature:
+            return self._records
+        records = {}
+        if signature is not None:
+            with open(self.archive_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 最后一行可能因为进程中断没有写完整
+                        continue
+                    records[entry['id']] = entry['data']
+        self._records = records
+        self._signature = signature
+        return records
+
+    def find(self, uid):
+        """归档的记录,没有时返回None(冷存储只在遇到元数据中没有的唯一ID时才读取)"""
+        if self._current_signature() is None:
+            return None
+        return self.load().get(uid)
+
+    def append(self, records):
+        """追加归档记录 [(唯一ID, 记录)],写入并fsync后才能从热元数据中移除"""
+        if not records:
+            return
+        archived_at = datetime.now().isoformat()
+        lines = [json.dumps({'id': uid, 'archived_at': archived_at, 'data': record}, ensure_ascii=False)
+                 for uid, record in records]
+        with open(self.archive_file, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if self._records is not None:
+            self._records.update(records)
+            self._signature = self._current_signature()
+
+
+def expired_ids(metadata, retention_days, now=None):
+    """标记为deleted且删除时间早于保留期的唯一ID(没有删除时间的旧记录按最后更新时间判断)"""
+    cutoff = ((now or datetime.now()) - timedelta(days=retention_days)).isoformat()
+    return [uid for uid, meta in metadata.items()
+            if meta.get('deleted') and (meta.get('deleted_at') or meta.get('last_updated') or '') < cutoff]
+
+
+def archive_target(base_dir, area, folder, taken=()):
+    """文件夹在归档区中的位置: 🗄️归档/区域/相对于base_dir的原路径,已存在时在名称后加序号"""
+    base_dir = Path(base_dir)
+    try:
+        relative = Path(folder).relative_to(base_dir)
+    except ValueError:
+        relative = Path(Path(folder).name)
+    target = base_dir / ARCHIVE_DIR / area / relative
+    candidate = target
+    n = 2
+    while candidate in taken or candidate.exists():
+        candidate = target.with_name(f"{target.name} ({n})")
+        n += 1
+    return candidate
+
+
+class Compactor:
+    """按保留策略压缩一个台账的元数据,并把有文件的已删除/未追踪文件夹移到归档区"""
+
+    def __init__(self, engine, retention_days=RETENTION_DAYS, dry_run=False):
+        self.engine = engine
+        self.retention_days = retention_days
+        self.dry_run = dry_run
+        self.cold_store = engine.cold_store
+
+    def run(self):
+        """执行压缩,返回统计信息"""
+        engine = self.engine
+        metadata = engine.load_metadata()
+        snapshot = DirectorySnapshot(engine.base_dir).build(engine.completed_dir, engine.pending_dir)
+        engine.snapshot = snapshot
+
+        expired = expired_ids(metadata, self.retention_days)
+        old_format = [uid for uid in metadata if uid.isdigit()]
+
+        # 归档的记录: 文件夹中还有文件时移动到归档区,空文件夹直接删除
+        plan = SyncPlan()
+        taken = set()
+        parents = set()  # 移走或删除之后可能变为空的付款人文件夹
+        moves = {}       # 唯一ID -> 移动操作
+        untracked = []   # (文件夹, 移动操作)
+        for uid in expired + old_format:
+            meta = metadata[uid]
+            if not meta.get('folder_path'):
+                continue
+            folder = engine.folder_of(meta)
+            if not snapshot.exists(folder):
+                continue
+            if snapshot.total_file_count(folder):
+                target = archive_target(engine.base_dir, DELETED_AREA, folder, taken)
+                taken.add(target)
+                moves[uid] = plan.move(folder, target)
+                parents.add(folder.parent)
+            elif snapshot.is_empty(folder):
+                plan.rmdir(folder, only_if_empty=True)
+                parents.add(folder.parent)
+
+        # 没有任何记录(包括保留期内的删除记录)对应、但仍有文件的文件夹(归档的记录的文件夹上面已经处理)
+        tracked = {engine.folder_of(meta) for meta in metadata.values() if meta.get('folder_path')}
+        for payer_root in engine.payer_roots():
+            for payer_folder in snapshot.subdirs(payer_root):
+                for content_folder in snapshot.subdirs(payer_folder):
+                    if content_folder in tracked or not snapshot.total_file_count(content_folder):
+                        continue
+                    target = archive_target(engine.base_dir, UNTRACKED_AREA, content_folder, taken)
+                    taken.add(target)
+                    untracked.append((content_folder, plan.move(content_folder, target)))
+                    parents.add(payer_folder)
+
+        for parent in parents - {engine.completed_dir, engine.pending_dir}:
+            plan.rmdir(parent, only_if_empty=True)
+
+        stats = {'expired': len(expired), 'old_format': len(old_format),
+                 'folders_archived': len(moves), 'untracked_archived': len(untracked), 'failed': 0}
+        if self.dry_run:
+            previous, engine.dry_run = engine.dry_run, True
+            try:
+                engine._apply_plan(plan, '归档')
+            finally:
+                engine.dry_run = previous
+            return stats
+
+        engine.journal.begin(excel_file=engine.excel_file, compaction=True)
+        engine._apply_plan(plan, '归档')
+        for folder, op in untracked:
+            if op.done:
+                print(f"🗄️  未追踪的文件夹已归档: {folder} → {op.target}")
+            else:
+                stats['failed'] += 1
+                print(f"❌ 归档文件夹失败 {folder}: {op.error}")
+
+        # 先写入冷存储,再从热元数据中移除;移动失败的记录保留到下次压缩
+        records = []
+        for uid in expired + old_format:
+            op = moves.get(uid)
+            if op is not None and not op.done:
+                stats['failed'] += 1
+                print(f"❌ 归档文件夹失败 {op.path}: {op.error}")
+                continue
+            record = dict(metadata[uid])
+            if op is not None:
+                record['folder_path'] = engine.stored_path(op.target)
+                record['archived_folder'] = True
+            records.append((uid, record))
+        self.cold_store.append(records)
+        for uid, _ in records:
+            del metadata[uid]
+        stats['archived'] = len(records)
+
+        engine.compact_metadata()
+        engine.journal.finish()
+        return stats
+
+
+def main():
+    # 设置标准输出编码为UTF-8,解决Windows命令行emoji显示问题
+    if sys.platform == 'win32':
+        import io
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+    parser = argparse.ArgumentParser(description='归档超过保留期的删除记录和未追踪的文件夹,压缩元数据')
+    parser.add_argument('--retention-days', type=float,
+                        help=f'删除记录的保留天数(默认使用配置文件中的retention_days,没有配置时为{RETENTION_DAYS}天)')
+    parser.add_argument('--dry-run', action='store_true', help='只打印将要归档的内容,不做任何修改')
+    parser.add_argument('--config', help='多台账配置文件(默认: 当前目录下有ledgers.json时使用它)')
+    parser.add_argument('--ledger', action='append', help='只压缩配置文件中指定名称的台账(可以多次指定)')
+    args = parser.parse_args()
+
+    from create_folders import setup_logging
+    from ledger_config import load_ledgers
+    setup_logging('INFO')
+
+    ledgers = load_ledgers(args.config)
+    if args.ledger:
+        ledgers = [ledger for ledger in ledgers if ledger.name in args.ledger]
+    for ledger in ledgers:
+        retention_days = args.retention_days
+        if retention_days is None:
+            retention_days = ledger.retention_days if ledger.retention_days is not None else RETENTION_DAYS
+        compactor = Compactor(ledger.create_engine(), retention_days=retention_days, dry_run=args.dry_run)
+        stats = compactor.run()
+        prefix = '🔍 dry-run ' if args.dry_run else '✅ '
+        print(f"{prefix}{ledger.name}: 超过{retention_days:g}天的删除记录 {stats['expired']} 条, "
+              f"旧格式记录 {stats['old_format']} 条, 移到归档区的文件夹 {stats['folders_archived']} 个, "
+              f"未追踪的文件夹 {stats['untracked_archived']} 个"
+              + (f", 失败 {stats['failed']} 个" if stats['failed'] else ''))
+
+
+if __name__ == "__main__":
+    main()
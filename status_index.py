@@ -0,0 +1,352 @@
+"""
+报销状态的二级索引和查询命令 - 不打开Excel、不浏览文件夹就能回答"付款人X还缺什么"
+
+索引保存在元数据文件旁边的 folder_metadata.index.json 中,包含每个未删除行的付款人、开票内容、
+材料准备状态、进入当前状态的时间、最后更新时间、文件数量和文件夹,并按付款人、状态、进入当前状态的时间
+和文件数量建立索引(每次完整同步都会更新last_updated,所以"停在某个状态多久"按status_since判断)。
+索引文件记录了它对应的元数据文件签名(快照和变更日志的大小、修改时间):
+- 每次同步保存元数据后,只把本次写入/删除的记录更新到索引中(MetadataStore.last_changes),不重建
+- 签名不一致(例如元数据被旧版本脚本或手工修改过)时,从元数据完整重建一次
+查询命令只读取索引文件;--recount 时再用目录快照统计实际的文件数量,与记录的数量不一致时标出
+
+用法:
+    python status_index.py --payer 张三 --status no check        # 张三还没有完成的行
+    python status_index.py --status check --older-than 7         # 停在check超过一周的行
+    python status_index.py --max-files 0                         # 还没有放入任何票据的行
+    python status_index.py --group-by payer                      # 按付款人统计行数和文件数
+    python status_index.py --status no --count
+"""
+
+import argparse
+import bisect
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from metadata_store import atomic_write_json
+
+
+# 默认配置
+INDEX_SUFFIX = '.index.json'
+INDEX_VERSION = 2
+UNKNOWN = '-'  # 没有记录状态的旧元数据
+
+# 索引中每一行保存的字段(按顺序保存为列表,索引文件比保存字典小得多)
+FIELDS = ('payer', 'content', 'status', 'status_since', 'last_updated', 'file_count', 'sheet', 'excel_row',
+          'folder_path')
+GROUP_FIELDS = ('payer', 'status', 'sheet')
+
+
+def status_index_path(metadata_file):
+    """元数据文件对应的索引文件路径"""
+    root, _ = os.path.splitext(str(metadata_file))
+    return root + INDEX_SUFFIX
+
+
+def index_entry(meta):
+    """元数据记录在索引中的字段,已删除或没有文件夹的记录返回None"""
+    if meta.get('deleted') or not meta.get('folder_path'):
+        return None
+    return {
+        'payer': meta.get('current_payer') or meta.get('original_payer') or meta.get('payer'),
+        'content': meta.get('current_content') or meta.get('original_content'),
+        'status': meta.get('status') or UNKNOWN,
+        # 旧元数据没有记录进入当前状态的时间,按创建时间计算
+        'status_since': meta.get('status_since') or meta.get('created_at') or '',
+        'last_updated': meta.get('last_updated') or meta.get('created_at') or '',
+        'file_count': meta.get('file_count'),
+        'sheet': meta.get('sheet'),
+        'excel_row': meta.get('excel_row'),
+        'folder_path': meta.get('folder_path'),
+    }
+
+
+class StatusIndex:
+    """按付款人、状态、进入当前状态的时间和文件数量索引的行"""
+
+    def __init__(self):
+        self.rows = {}          # 唯一ID -> 行(index_entry)
+        self.by_payer = {}      # 付款人 -> {唯一ID}
+        self.by_status = {}     # 状态 -> {唯一ID}
+        self.by_status_since = []  # [(进入当前状态的时间, 唯一ID)],有序
+        self.by_file_count = []  # [(文件数量, 唯一ID)],有序;没有记录文件数量的行按-1保存
+        self.signature = None   # 索引对应的元数据文件签名
+
+    # ---------- 维护 ----------
+
+    def _add(self, uid, row):
+        self.rows[uid] = row
+        self.by_payer.setdefault(row['payer'], set()).add(uid)
+        self.by_status.setdefault(row['status'], set()).add(uid)
+        bisect.insort(self.by_status_since, (row['status_since'], uid))
+        bisect.insort(self.by_file_count, (_count_key(row), uid))
+
+    def _remove(self, uid):
+        row = self.rows.pop(uid, None)
+        if row is None:
+            return
+        for mapping, key in ((self.by_payer, row['payer']), (self.by_status, row['status'])):
+            members = mapping.get(key)
+            if members is not None:
+                members.discard(uid)
+                if not members:
+                    del mapping[key]
+        _sorted_remove(self.by_status_since, (row['status_since'], uid))
+        _sorted_remove(self.by_file_count, (_count_key(row), uid))
+
+    def build(self, metadata):
+        """从完整的元数据建立索引"""
+        self.__init__()
+        for uid, meta in metadata.items():
+            row = index_entry(meta)
+            if row is not None:
+                self.rows[uid] = row
+                self.by_payer.setdefault(row['payer'], set()).add(uid)
+                self.by_status.setdefault(row['status'], set()).add(uid)
+        self.by_status_since = sorted((row['status_since'], uid) for uid, row in self.rows.items())
+        self.by_file_count = sorted((_count_key(row), uid) for uid, row in self.rows.items())
+        return self
+
+    def update(self, metadata, uids):
+        """只更新指定的行(写入或删除过的唯一ID),返回实际变化的行数"""
+        changed = 0
+        for uid in uids:
+            meta = metadata.get(uid)
+            row = None if meta is None else index_entry(meta)
+            if row == self.rows.get(uid):
+                continue
+            self._remove(uid)
+            if row is not None:
+                self._add(uid, row)
+            changed += 1
+        return changed
+
+    # ---------- 查询 ----------
+
+    def query(self, payers=None, statuses=None, since_before=None, since_after=None,
+              min_files=None, max_files=None):
+        """
+        返回满足所有条件的唯一ID集合
+
+        since_before/since_after 是ISO格式的时间字符串,与进入当前状态的时间比较;各条件先分别从索引中取出候选集合,
+        再从最小的集合开始求交集
+        """
+        candidates = []
+        if payers:
+            candidates.append(set().union(*(self.by_payer.get(p, ()) for p in payers)))
+        if statuses:
+            candidates.append(set().union(*(self.by_status.get(s, ()) for s in statuses)))
+        if since_before is not None or since_after is not None:
+            lo = 0 if since_after is None else bisect.bisect_left(self.by_status_since, (since_after,))
+            hi = (len(self.by_status_since) if since_before is None
+                  else bisect.bisect_left(self.by_status_since, (since_before,)))
+            candidates.append({uid for _, uid in self.by_status_since[lo:hi]})
+        if min_files is not None or max_files is not None:
+            lo = 0 if min_files is None else bisect.bisect_left(self.by_file_count, (min_files,))
+            hi = len(self.by_file_count) if max_files is None else bisect.bisect_left(self.by_file_count, (max_files + 1,))
+            candidates.append({uid for _, uid in self.by_file_count[lo:hi]})
+        if not candidates:
+            return set(self.rows)
+        candidates.sort(key=len)
+        result = set(candidates[0])
+        for other in candidates[1:]:
+            result &= other
+        return result
+
+    def aggregate(self, uids, group_by):
+        """按字段分组统计行数和文件数: {分组: {'rows', 'files'}}"""
+        groups = {}
+        for uid in uids:
+            row = self.rows[uid]
+            group = groups.setdefault(row[group_by], {'rows': 0, 'files': 0})
+            group['rows'] += 1
+            group['files'] += row['file_count'] or 0
+        return groups
+
+    def sorted_rows(self, uids):
+        """按付款人、工作表和行号排序的 [(唯一ID, 行)]"""
+        return sorted(((uid, self.rows[uid]) for uid in uids),
+                      key=lambda item: (str(item[1]['payer']), item[1]['sheet'] or '', item[1]['excel_row'] or 0))
+
+    # ---------- 保存和读取 ----------
+
+    def save(self, index_file):
+        atomic_write_json(index_file, {
+            'version': INDEX_VERSION,
+            'signature': self.signature,
+            'rows': {uid: [row[field] for field in FIELDS] for uid, row in self.rows.items()},
+        })
+
+    @classmethod
+    def load(cls, index_file, signature=None):
+        """读取索引文件;文件不存在、格式不对或与signature不一致时返回None"""
+        try:
+            with open(index_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != INDEX_VERSION:
+            return None
+        stored = _signature_key(data.get('signature'))
+        if signature is not None and stored != _signature_key(signature):
+            return None
+        index = cls()
+        index.rows = {uid: dict(zip(FIELDS, values)) for uid, values in data.get('rows', {}).items()}
+        for uid, row in index.rows.items():
+            index.by_payer.setdefault(row['payer'], set()).add(uid)
+            index.by_status.setdefault(row['status'], set()).add(uid)
+        index.by_status_since = sorted((row['status_since'], uid) for uid, row in index.rows.items())
+        index.by_file_count = sorted((_count_key(row), uid) for uid, row in index.rows.items())
+        index.signature = stored
+        return index
+
+
+def _count_key(row):
+    return -1 if row['file_count'] is None else row['file_count']
+
+
+def _sorted_remove(items, item):
+    i = bisect.bisect_left(items, item)
+    if i < len(items) and items[i] == item:
+        del items[i]
+
+
+def _signature_key(signature):
+    """签名在JSON中保存为列表,比较前统一转换为元组"""
+    if signature is None:
+        return None
+    return tuple(None if part is None else tuple(part) for part in signature)
+
+
+def update_index(metadata_file, metadata, changes, previous_signature, signature, index=None):
+    """
+    元数据保存后更新索引文件
+
+    changes是MetadataStore.last_changes;索引对应的是保存前的元数据(previous_signature)时只更新变化的行,
+    否则(索引不存在、过期或changes未知)从完整的元数据重建。返回更新后的索引
+    """
+    index_file = status_index_path(metadata_file)
+    if index is None or index.signature != _signature_key(previous_signature):
+        index = StatusIndex.load(index_file, previous_signature)
+    if index is None or changes is None:
+        index = StatusIndex().build(metadata)
+    else:
+        put_ids, deleted_ids = changes
+        if not put_ids and not deleted_ids and index.signature == _signature_key(signature):
+            return index
+        index.update(metadata, list(put_ids) + list(deleted_ids))
+    index.signature = _signature_key(signature)
+    index.save(index_file)
+    return index
+
+
+def open_index(metadata_file):
+    """查询用的索引: 与元数据一致时直接读取索引文件,否则从元数据重建并保存"""
+    from metadata_store import MetadataStore
+
+    store = MetadataStore(metadata_file)
+    signature = store.signature()
+    index = StatusIndex.load(status_index_path(metadata_file), signature)
+    if index is None:
+        index = StatusIndex().build(store.load())
+        index.signature = _signature_key(signature)
+        if os.path.exists(metadata_file):
+            index.save(status_index_path(metadata_file))
+    return index
+
+
+def recount(index, uids, base_dir):
+    """用目录快照统计行文件夹中实际的文件数量,返回 {唯一ID: 文件数量(文件夹不存在时为None)}"""
+    from dir_snapshot import DirectorySnapshot
+
+    base_dir = Path(base_dir)
+    snapshot = DirectorySnapshot(base_dir).build(base_dir / '✅已完成', base_dir / '📋待处理')
+    counts = {}
+    for uid in uids:
+        folder = base_dir / index.rows[uid]['folder_path']
+        counts[uid] = snapshot.file_count(folder) if snapshot.exists(folder) else None
+    return counts
+
+
+def main():
+    # 设置标准输出编码为UTF-8,解决Windows命令行emoji显示问题
+    if sys.platform == 'win32':
+        import io
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+
+    parser = argparse.ArgumentParser(description='查询报销行的状态(使用元数据的二级索引,不打开Excel)')
+    parser.add_argument('--payer', nargs='+', help='付款人(可以指定多个)')
+    parser.add_argument('--status', nargs='+', choices=['yes', 'check', 'no', UNKNOWN], help='材料准备状态')
+    parser.add_argument('--older-than', type=float, metavar='DAYS', help='进入当前状态在这么多天以前')
+    parser.add_argument('--newer-than', type=float, metavar='DAYS', help='进入当前状态在这么多天以内')
+    parser.add_argument('--min-files', type=int, help='文件数量下限')
+    parser.add_argument('--max-files', type=int, help='文件数量上限')
+    parser.add_argument('--group-by', choices=GROUP_FIELDS, help='按字段分组统计行数和文件数,不列出每一行')
+    parser.add_argument('--count', action='store_true', help='只输出满足条件的行数')
+    parser.add_argument('--recount', action='store_true', help='用目录快照统计实际的文件数量,与记录不一致时标出')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出')
+    parser.add_argument('--config', help='多台账配置文件(默认: 当前目录下有ledgers.json时使用它)')
+    parser.add_argument('--ledger', action='append', help='只查询配置文件中指定名称的台账(可以多次指定)')
+    args = parser.parse_args()
+
+    from ledger_config import load_ledgers
+    ledgers = load_ledgers(args.config)
+    if args.ledger:
+        ledgers = [ledger for ledger in ledgers if ledger.name in args.ledger]
+        if not ledgers:
+            print(f"❌ 配置文件中没有名为 {', '.join(args.ledger)} 的台账")
+            sys.exit(1)
+
+    now = datetime.now()
+    since_before = None if args.older_than is None else (now - timedelta(days=args.older_than)).isoformat()
+    since_after = None if args.newer_than is None else (now - timedelta(days=args.newer_than)).isoformat()
+
+    output = {}
+    for ledger in ledgers:
+        index = open_index(ledger.metadata_file)
+        uids = index.query(payers=args.payer, statuses=args.status,
+                           since_before=since_before, since_after=since_after,
+                           min_files=args.min_files, max_files=args.max_files)
+        if args.count:
+            output[ledger.name] = len(uids)
+        elif args.group_by:
+            output[ledger.name] = dict(sorted(index.aggregate(uids, args.group_by).items(), key=lambda item: str(item[0])))
+        else:
+            counts = recount(index, uids, ledger.base_dir) if args.recount else {}
+            rows = []
+            for uid, row in index.sorted_rows(uids):
+                row = {'unique_id': uid, **row}
+                if uid in counts:
+                    row['actual_file_count'] = counts[uid]
+                rows.append(row)
+            output[ledger.name] = rows
+
+    if args.json:
+        print(json.dumps(output if len(ledgers) > 1 else next(iter(output.values()), None),
+                         ensure_ascii=False, indent=2))
+        return
+
+    for name, result in output.items():
+        if len(ledgers) > 1:
+            print(f"📒 {name}")
+        if args.count:
+            print(f"   {result} 行")
+        elif args.group_by:
+            for key, group in result.items():
+                print(f"   {key}: {group['rows']} 行, {group['files']} 个文件")
+            print(f"   合计: {sum(g['rows'] for g in result.values())} 行")
+        else:
+            for row in result:
+                files = row['file_count']
+                if 'actual_file_count' in row and row['actual_file_count'] != files:
+                    files = f"{files} (实际 {row['actual_file_count']})"
+                since = row['status_since'][:16].replace('T', ' ')
+                print(f"   [{row['status']}] {row['payer']} / {row['content']}  文件 {files}  状态自 {since}"
+                      f"  ({row['folder_path']})")
+            print(f"   共 {len(result)} 行")
+
+
+if __name__ == "__main__":
+    main()
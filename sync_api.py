@@ -0,0 +1,249 @@
+"""
+同步守护进程的本地HTTP/JSON接口 - 由 auto_watch.py --daemon 启动
+
+所有查询都从常驻内存的状态回答,不读取Excel也不扫描文件夹: 每次同步或文件数量刷新完成后,
+在调度线程中根据引擎的元数据生成一份只读的状态视图,HTTP线程只读取当前的视图
+
+接口(只监听127.0.0.1;多个台账时用 ?ledger=名称 指定,只有一个台账时可以省略):
+    GET  /status                     各台账的同步次数、最近一次同步的延迟和行数
+    GET  /rows/<唯一ID>              一行的材料准备状态、文件数量、文件夹等
+    GET  /pending[?payer=付款人]      材料准备不为yes的行,按付款人分组
+    POST /sync[?full=1]              请求同步一次(Excel没有变化也会同步),立即返回
+    GET  /events                     同步事件流(text/event-stream,每个事件一行JSON)
+"""
+
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+# 默认配置
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+KEEPALIVE_SECONDS = 15  # 事件流没有事件时发送注释行的间隔,避免连接被中间代理关闭
+
+
+def row_view(engine, uid, meta):
+    """元数据记录对外公开的字段"""
+    return {
+        'unique_id': uid,
+        'payer': meta.get('current_payer') or meta.get('original_payer'),
+        'content': meta.get('current_content') or meta.get('original_content'),
+        'status': meta.get('status'),
+        'status_since': meta.get('status_since'),
+        'file_count': meta.get('file_count'),
+        'excel_row': meta.get('excel_row'),
+        'sheet': meta.get('sheet'),
+        'folder': str(engine.folder_of(meta)) if meta.get('folder_path') else None,
+        'last_updated': meta.get('last_updated'),
+        'receipt_total': meta.get('receipt_total'),
+        'amount_check': meta.get('amount_check'),
+    }
+
+
+class LedgerView:
+    """一个台账在某次同步之后的只读状态,生成后不再修改,可以在任意线程中读取"""
+
+    def __init__(self, engine):
+        self.built_at = datetime.now().isoformat()
+        self.rows = {}
+        self.pending = {}  # 付款人 -> [行],按工作表和行号排序
+        for uid, meta in list(engine.metadata.items()):
+            if meta.get('deleted') or not meta.get('folder_path'):
+                continue
+            row = row_view(engine, uid, meta)
+            self.rows[uid] = row
+            if row['status'] != 'yes':
+                self.pending.setdefault(row['payer'], []).append(row)
+        for rows in self.pending.values():
+            rows.sort(key=lambda r: (r['sheet'] or '', r['excel_row'] or 0))
+
+
+class EventBus:
+    """把同步事件分发给所有连接中的事件流"""
+
+    def __init__(self, backlog=100):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self.backlog = backlog
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.backlog)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # 客户端读取太慢: 丢弃事件,不阻塞同步
+                pass
+
+
+class SyncDaemon:
+    """持有所有台账的调度器和状态视图,提供HTTP接口"""
+
+    def __init__(self, schedulers, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.schedulers = {s.name: s for s in schedulers}
+        self.host = host
+        self.port = port
+        self.events = EventBus()
+        self.views = {}
+        self._server = None
+        self._thread = None
+        for scheduler in schedulers:
+            scheduler.on_event = self.handle_event
+            # 启动时只读取元数据文件(不读取Excel),第一次同步完成后会被替换
+            scheduler.engine.load_metadata()
+            self.views[scheduler.name] = LedgerView(scheduler.engine)
+
+    def handle_event(self, scheduler, kind, data):
+        """调度线程中的回调: 同步完成后更新视图,然后推送事件"""
+        if kind in ('sync_finished', 'folders_refreshed') and scheduler.engine.metadata is not None:
+            self.views[scheduler.name] = LedgerView(scheduler.engine)
+        self.events.publish({'time': datetime.now().isoformat(), 'ledger': scheduler.name, 'event': kind, **data})
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), _make_handler(self))
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='SyncDaemonHTTP', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+
+    # ---------- 查询 ----------
+
+    def _ledger_names(self, query):
+        """查询参数中指定的台账,没有指定时为全部台账"""
+        names = query.get('ledger')
+        if not names:
+            return list(self.views)
+        missing = [name for name in names if name not in self.views]
+        if missing:
+            raise LookupError(f"没有名为 {', '.join(missing)} 的台账")
+        return names
+
+    def status(self, query):
+        result = {}
+        for name in self._ledger_names(query):
+            scheduler = self.schedulers[name]
+            view = self.views[name]
+            result[name] = {
+                'excel_file': str(scheduler.excel_file),
+                'sync_count': scheduler.sync_count,
+                'last_latency': scheduler.last_latency,
+                'rows': len(view.rows),
+                'pending': sum(len(rows) for rows in view.pending.values()),
+                'view_built_at': view.built_at,
+            }
+        return result
+
+    def row(self, uid, query):
+        for name in self._ledger_names(query):
+            row = self.views[name].rows.get(uid)
+            if row is not None:
+                return {'ledger': name, **row}
+        return None
+
+    def pending(self, query):
+        payers = query.get('payer')
+        result = {}
+        for name in self._ledger_names(query):
+            view = self.views[name]
+            if payers:
+                result[name] = {payer: view.pending.get(payer, []) for payer in payers}
+            else:
+                result[name] = view.pending
+        return result
+
+    def request_sync(self, query):
+        full = query.get('full', ['0'])[0] in ('1', 'true', 'yes')
+        names = self._ledger_names(query)
+        for name in names:
+            self.schedulers[name].request_sync(full=full)
+        return {'requested': names, 'full': full}
+
+
+def _make_handler(daemon):
+    class Handler(BaseHTTPRequestHandler):
+        server_version = 'SyncDaemon/1.0'
+
+        def log_message(self, format, *args):
+            # 默认会把每个请求打印到stderr,守护进程的输出只保留同步信息
+            pass
+
+        def _send_json(self, status, data):
+            body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _route(self, method):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            parts = [unquote(p) for p in url.path.split('/') if p]
+            try:
+                if method == 'GET' and parts == ['status']:
+                    return self._send_json(200, daemon.status(query))
+                if method == 'GET' and len(parts) == 2 and parts[0] == 'rows':
+                    row = daemon.row(parts[1], query)
+                    if row is None:
+                        return self._send_json(404, {'error': f"没有唯一ID为 {parts[1]} 的行"})
+                    return self._send_json(200, row)
+                if method == 'GET' and parts == ['pending']:
+                    return self._send_json(200, daemon.pending(query))
+                if method == 'POST' and parts == ['sync']:
+                    return self._send_json(202, daemon.request_sync(query))
+                if method == 'GET' and parts == ['events']:
+                    return self._stream_events()
+                return self._send_json(404, {'error': f"未知的接口: {method} {url.path}"})
+            except LookupError as e:
+                return self._send_json(404, {'error': str(e)})
+
+        def _stream_events(self):
+            events = daemon.events.subscribe()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            try:
+                while True:
+                    try:
+                        event = events.get(timeout=KEEPALIVE_SECONDS)
+                        chunk = f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+                    except queue.Empty:
+                        chunk = f": keepalive {int(time.time())}\n\n"
+                    self.wfile.write(chunk.encode('utf-8'))
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                daemon.events.unsubscribe(events)
+
+        def do_GET(self):
+            self._route('GET')
+
+        def do_POST(self):
+            self._route('POST')
+
+    return Handler
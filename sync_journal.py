@@ -0,0 +1,217 @@
+"""
+同步预写日志 - 同步中断后可以继续或回滚
+
+同步开始时创建 folder_metadata.sync.jsonl,每个同步计划在执行前先把所有操作写入日志并fsync,
+每批操作执行完成后追加完成记录,元数据保存后记录一次,Excel写回完成后删除日志。
+进程在任何时刻被中断(例如shutil.move进行到一半,或者还没来得及保存元数据),下次启动时日志仍然存在:
+
+- 继续(默认): 已经完成的移动还没有写入元数据时,把元数据中的文件夹路径改为移动后的位置,
+  然后照常同步,不会把已移动的文件夹当作"旧文件夹不存在"而创建空的重复文件夹
+- 回滚: 把已完成的移动移回原位置,删除本次新建且仍为空的文件夹,文件夹树恢复到同步开始前的状态
+  (元数据和Excel在同步结束前不会被修改,本来就是同步前的状态)
+元数据已经保存之后中断的同步只差写回Excel,直接重新同步即可,不需要继续或回滚
+
+完成记录按批写入: 有完成记录的操作一定已经完成,中断时正在执行的那一批以文件系统的实际状态为准,
+移动的源和目标同时存在时无法判断,只提示不处理
+"""
+
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+from relocate import Relocator
+from sync_plan import MKDIR_PARENT, MOVE, MKDIR
+
+
+# 默认配置
+JOURNAL_SUFFIX = '.sync.jsonl'
+
+
+def sync_journal_path(metadata_file):
+    """元数据文件对应的同步日志路径"""
+    root, _ = os.path.splitext(str(metadata_file))
+    return root + JOURNAL_SUFFIX
+
+
+class InterruptedSync:
+    """日志中记录的一次未完成的同步"""
+
+    def __init__(self, started_at=None):
+        self.started_at = started_at
+        self.operations = []         # 按写入顺序: {'seq', 'kind', 'path', 'target'}
+        self.done = []               # 已记录完成的操作序号(按执行顺序)
+        self._done_seqs = set()
+        self.metadata_saved = False
+
+    def move_completed(self, op):
+        """
+        移动是否已经完成: 有完成记录的直接认为已完成,否则根据文件系统判断
+
+        返回 True(目标存在、源不存在)、False(源存在、目标不存在,或两者都不存在)、None(两者都存在,无法判断)
+        """
+        if op['seq'] in self._done_seqs:
+            return True
+        source_exists = os.path.exists(op['path'])
+        target_exists = op['target'] is not None and os.path.exists(op['target'])
+        if target_exists and not source_exists:
+            return True
+        if source_exists and target_exists:
+            return None
+        return False
+
+    def moves(self):
+        return [op for op in self.operations if op['kind'] == MOVE]
+
+    def mkdirs(self):
+        return [op for op in self.operations if op['kind'] in (MKDIR_PARENT, MKDIR)]
+
+
+class SyncJournal:
+    """一个元数据文件对应的同步预写日志"""
+
+    def __init__(self, metadata_file):
+        self.journal_file = sync_journal_path(metadata_file)
+        self._seq = 0
+        self._ids = {}  # id(Operation) -> 序号
+        self._file = None
+        self._context = None  # begin()的信息,第一个计划写入时才创建日志文件
+
+    def exists(self):
+        return os.path.exists(self.journal_file)
+
+    def _append(self, records):
+        if self._file is None:
+            if self._context is None:
+                return
+            # 没有任何文件夹操作的同步(例如没有变化的增量同步)不会创建日志文件
+            self._file = open(self.journal_file, 'w', encoding='utf-8')
+            records = [{'op': 'begin', **self._context}] + records
+        self._file.write(''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def begin(self, **context):
+        """开始一次同步(第一次写入计划时覆盖上一次已经处理过的日志)"""
+        self.close()
+        self._seq = 0
+        self._ids = {}
+        self._context = {'started_at': datetime.now().isoformat(), **context}
+
+    def record_plan(self, operations):
+        """在执行之前写入计划中的所有操作"""
+        records = []
+        for op in operations:
+            self._seq += 1
+            self._ids[id(op)] = self._seq
+            records.append({'op': 'plan', 'seq': self._seq, 'kind': op.kind, 'path': str(op.path),
+                            'target': None if op.target is None else str(op.target)})
+        self._append(records)
+
+    def record_done(self, operations):
+        """记录一批已经执行完成的操作"""
+        records = [{'op': 'done', 'seq': self._ids[id(op)]} for op in operations
+                   if op.done and id(op) in self._ids]
+        if records:
+            self._append(records)
+
+    def record_metadata_saved(self):
+        if self._file is not None:
+            self._append([{'op': 'metadata_saved'}])
+
+    def finish(self):
+        """同步完成: 关闭并删除日志"""
+        self.close()
+        try:
+            os.remove(self.journal_file)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        """关闭日志文件(同步出错时保留日志,下次启动时处理)"""
+        self._context = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def load(self):
+        """读取上一次未完成的同步,没有日志时返回None(最后一行没有写完整时忽略)"""
+        if not self.exists():
+            return None
+        state = InterruptedSync()
+        with open(self.journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                op = record.get('op')
+                if op == 'begin':
+                    state.started_at = record.get('started_at')
+                elif op == 'plan':
+                    state.operations.append(record)
+                elif op == 'done':
+                    state.done.append(record['seq'])
+                    state._done_seqs.add(record['seq'])
+                elif op == 'metadata_saved':
+                    state.metadata_saved = True
+        return state
+
+
+def resume_moves(state, folder_index):
+    """
+    继续: 找出已经完成但还没有写入元数据的移动
+
+    folder_index: {规范化的绝对路径: 唯一ID};返回 ([(唯一ID, 新路径)], 无法判断的移动列表)
+    """
+    relocated = []
+    unclear = []
+    for op in state.moves():
+        completed = state.move_completed(op)
+        if completed is None:
+            unclear.append(op)
+        elif completed:
+            uid = folder_index.get(os.path.normcase(os.path.abspath(op['path'])))
+            if uid is not None:
+                relocated.append((uid, Path(op['target'])))
+    return relocated, unclear
+
+
+def rollback(state):
+    """
+    回滚: 把已完成的移动移回原位置,删除本次新建且仍为空的文件夹
+
+    移动按执行的相反顺序撤销(一个移动的目标可能是另一个移动的源): 先撤销中断时正在执行、
+    没有完成记录的移动,再按完成记录倒序撤销。返回 (移回的数量, 删除的文件夹数量, 无法处理的操作及原因列表)
+    """
+    moved_back = 0
+    removed = 0
+    problems = []
+    relocator = Relocator()
+    by_seq = {op['seq']: op for op in state.moves()}
+    done = [seq for seq in state.done if seq in by_seq]
+    unrecorded = [op for op in state.moves() if op['seq'] not in state._done_seqs]
+    for op in unrecorded + [by_seq[seq] for seq in reversed(done)]:
+        completed = state.move_completed(op)
+        if completed is None:
+            problems.append((op, '源文件夹和目标文件夹同时存在'))
+            continue
+        if not completed:
+            continue
+        try:
+            Path(op['path']).parent.mkdir(parents=True, exist_ok=True)
+            relocator.move(op['target'], op['path'])
+            moved_back += 1
+        except OSError as e:
+            problems.append((op, str(e)))
+
+    # 先删深层的文件夹;只删除仍然为空的,用户已经放入文件的文件夹保留
+    for op in sorted(state.mkdirs(), key=lambda op: -len(Path(op['path']).parts)):
+        path = Path(op['path'])
+        try:
+            if path.is_dir() and not any(path.iterdir()):
+                path.rmdir()
+                removed += 1
+        except OSError as e:
+            problems.append((op, str(e)))
+    return moved_back, removed, problems
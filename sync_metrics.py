@@ -0,0 +1,69 @@
+"""
+同步运行指标 - 每个阶段的耗时和计数器
+
+每次同步生成一个SyncMetrics,记录:
+- 各阶段的耗时(秒): 读取Excel、ID匹配、处理行、清理、保存元数据、写回Excel等
+- 计数器: scandir/mkdir/move/rmdir/rmtree 等文件系统调用次数、读取/处理/跳过的行数、扫描的元数据条目数等
+结果可以追加到JSON Lines文件(每次同步一行),便于用脚本统计或对比
+"""
+
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class SyncMetrics:
+    """一次同步(或一次文件夹刷新)的耗时和计数器"""
+
+    def __init__(self, mode='full', **context):
+        self.mode = mode
+        self.context = context  # 附加信息,例如Excel文件名、是否dry-run
+        self.started_at = datetime.now().isoformat()
+        self.phases = {}    # 阶段名 -> 累计耗时(秒)
+        self.counters = {}  # 计数器名 -> 数量
+        self.total_seconds = None
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        """统计一个阶段的耗时,同名阶段多次进入时累加"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def incr(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def finish(self):
+        """记录总耗时"""
+        self.total_seconds = time.perf_counter() - self._start
+        return self
+
+    def to_dict(self):
+        return {
+            'started_at': self.started_at,
+            'mode': self.mode,
+            **self.context,
+            'total_seconds': round(self.total_seconds, 6) if self.total_seconds is not None else None,
+            'phases': {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            'counters': dict(self.counters),
+        }
+
+    def write_jsonl(self, path):
+        """把本次的指标作为一行追加到JSON Lines文件"""
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.to_dict(), ensure_ascii=False) + '\n')
+
+    def summary(self):
+        """一行文字摘要,用于在同步结束时打印"""
+        phases = ', '.join(f"{name} {seconds:.3f}s" for name, seconds in
+                           sorted(self.phases.items(), key=lambda item: -item[1]) if seconds >= 0.0005)
+        counters = ', '.join(f"{name}={count}" for name, count in sorted(self.counters.items()) if count)
+        total = f"{self.total_seconds:.3f}s" if self.total_seconds is not None else '-'
+        return f"⏱️  总耗时 {total} | {phases or '-'} | {counters or '-'}"
@@ -0,0 +1,233 @@
+"""
+同步计划 - 先决定要做什么,再统一执行
+
+同步的每个阶段先生成一个操作列表(创建文件夹、移动文件夹、删除空文件夹、删除未追踪的空文件夹),
+然后由PlanExecutor在线程池中执行。只在必须的地方保证顺序:
+- 先创建目标父文件夹,再移动,再创建新行的文件夹,最后清理
+- 目标路径是另一个移动的源路径时,等那个移动完成后再执行
+- 删除空文件夹时先删子文件夹再删父文件夹
+在SMB共享盘上,几百个互不相关的mkdir/move逐个执行是主要的瓶颈,并行执行可以大幅缩短时间。
+移动由relocate.Relocator执行: 同一批中可以直接改名的移动在线程池中并行执行,
+需要跨文件系统复制的移动随后以较少的线程执行(复制受磁盘和网络带宽限制,并行太多反而更慢)
+
+dry_run=True 时不访问磁盘,只把操作的结果应用到目录快照上,
+这样后续阶段看到的就是执行后的目录状态,打印出的计划与真实执行完全一致
+"""
+
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from relocate import Relocator
+
+
+# 操作类型及执行顺序
+MKDIR_PARENT = 'mkdir_parent'  # 移动目标的父文件夹
+MOVE = 'move'
+MKDIR = 'mkdir'                # 新行的文件夹
+RMDIR = 'rmdir'                # 删除文件夹(必须为空)
+RMDIR_IF_EMPTY = 'rmdir_if_empty'
+RMTREE = 'rmtree'
+
+COPY_WORKERS = 2  # 同时进行的跨文件系统复制数
+
+STAGES = [[MKDIR_PARENT], [MOVE], [MKDIR], [RMDIR, RMDIR_IF_EMPTY, RMTREE]]
+
+LABELS = {
+    MKDIR_PARENT: '📁 创建',
+    MOVE: '📦 移动',
+    MKDIR: '✨ 创建',
+    RMDIR: '🧹 删除',
+    RMDIR_IF_EMPTY: '🧹 删除(如果为空)',
+    RMTREE: '🧹 删除未追踪的空文件夹',
+}
+
+
+class Operation:
+    """计划中的一个文件系统操作,执行后记录结果"""
+
+    __slots__ = ('kind', 'path', 'target', 'done', 'skipped', 'error')
+
+    def __init__(self, kind, path, target=None):
+        self.kind = kind
+        self.path = Path(path)
+        self.target = Path(target) if target is not None else None
+        self.done = False     # 是否成功执行
+        self.skipped = False  # 条件不满足而跳过(例如文件夹不为空)
+        self.error = None
+
+    def describe(self):
+        if self.kind == MOVE:
+            return f"{LABELS[self.kind]}: {self.path} → {self.target}"
+        return f"{LABELS[self.kind]}: {self.path}"
+
+
+class SyncPlan:
+    """一组待执行的操作"""
+
+    def __init__(self):
+        self.operations = []
+        self._mkdir_parents = set()
+        self._removals = {}  # 路径 -> 删除操作,同一个文件夹只删除一次
+
+    def __len__(self):
+        return len(self.operations)
+
+    def _add(self, kind, path, target=None):
+        op = Operation(kind, path, target)
+        self.operations.append(op)
+        return op
+
+    def move(self, src, dst):
+        """移动文件夹(自动先创建目标的父文件夹)"""
+        parent = Path(dst).parent
+        if parent not in self._mkdir_parents:
+            self._mkdir_parents.add(parent)
+            self._add(MKDIR_PARENT, parent)
+        return self._add(MOVE, src, dst)
+
+    def mkdir(self, path):
+        """创建文件夹(包括所有父文件夹)"""
+        return self._add(MKDIR, path)
+
+    def rmdir(self, path, only_if_empty=False):
+        """删除文件夹;only_if_empty时执行前再检查一次是否为空,不为空则跳过"""
+        return self._remove(RMDIR_IF_EMPTY if only_if_empty else RMDIR, path)
+
+    def rmtree(self, path):
+        """删除整个文件夹树"""
+        return self._remove(RMTREE, path)
+
+    def _remove(self, kind, path):
+        # 多行共用的付款人文件夹可能被多次请求删除,只保留第一次的操作
+        path = Path(path)
+        if path not in self._removals:
+            self._removals[path] = self._add(kind, path)
+        return self._removals[path]
+
+    def removal(self, path):
+        """文件夹对应的删除操作,没有计划删除时返回None"""
+        return self._removals.get(Path(path))
+
+    def print_plan(self):
+        """打印计划(dry-run时使用)"""
+        for op in self.operations:
+            print(f"   {op.describe()}")
+
+
+def _run_operation(op, relocator=None):
+    """在工作线程中执行一个操作(不访问目录快照,快照由主线程更新)"""
+    try:
+        if op.kind in (MKDIR_PARENT, MKDIR):
+            op.path.mkdir(parents=True, exist_ok=True)
+        elif op.kind == MOVE:
+            (relocator or Relocator()).move(op.path, op.target)
+        elif op.kind in (RMDIR, RMDIR_IF_EMPTY):
+            op.path.rmdir()
+        elif op.kind == RMTREE:
+            shutil.rmtree(op.path)
+        op.done = True
+    except Exception as e:
+        op.error = e
+    return op
+
+
+class PlanExecutor:
+    """按阶段并行执行同步计划,并把结果应用到目录快照"""
+
+    def __init__(self, snapshot, max_workers=8, dry_run=False, journal=None, relocator=None):
+        self.snapshot = snapshot
+        self.max_workers = max_workers
+        self.dry_run = dry_run
+        self.journal = journal  # sync_journal.SyncJournal,每批操作完成后记录,同步中断时用于继续或回滚
+        self.relocator = relocator or Relocator()
+
+    def run(self, plan):
+        """执行计划中的所有操作,返回执行失败的操作列表"""
+        failed = []
+        for kinds in STAGES:
+            ops = [op for op in plan.operations if op.kind in kinds]
+            if not ops:
+                continue
+            for wave in self._waves(ops):
+                self._run_wave(wave)
+                if self.journal is not None:
+                    self.journal.record_done(wave)
+                failed.extend(op for op in wave if op.error is not None)
+        return failed
+
+    def _waves(self, ops):
+        """把同一阶段的操作分成可以并行执行的批次"""
+        if ops[0].kind == MOVE:
+            return self._move_waves(ops)
+        if ops[0].kind in (RMDIR, RMDIR_IF_EMPTY, RMTREE):
+            # 删除时先删深层的文件夹,父文件夹在子文件夹之后删除
+            by_depth = {}
+            for op in ops:
+                by_depth.setdefault(len(op.path.parts), []).append(op)
+            return [by_depth[depth] for depth in sorted(by_depth, reverse=True)]
+        return [ops]
+
+    @staticmethod
+    def _move_waves(ops):
+        """目标路径是其他待执行移动的源路径时,必须等那个移动完成"""
+        pending = list(ops)
+        waves = []
+        while pending:
+            sources = {op.path for op in pending}
+            ready = [op for op in pending if op.target not in sources or op.target == op.path]
+            if not ready:
+                # 循环依赖(例如两行互换了内容),按原顺序逐个执行
+                waves.extend([op] for op in pending)
+                break
+            waves.append(ready)
+            ready_ids = {id(op) for op in ready}
+            pending = [op for op in pending if id(op) not in ready_ids]
+        return waves
+
+    def _run_wave(self, wave):
+        """并行执行一批互不依赖的操作,然后在主线程中更新快照"""
+        snapshot = self.snapshot
+        todo = []
+        for op in wave:
+            # 条件删除在执行前用快照检查(快照只在主线程访问)
+            if op.kind == RMDIR_IF_EMPTY and not snapshot.is_empty(op.path):
+                op.skipped = True
+            else:
+                todo.append(op)
+
+        if self.dry_run:
+            for op in todo:
+                op.done = True
+        elif todo and todo[0].kind == MOVE:
+            # 先并行执行可以直接改名的移动,再执行需要复制的移动
+            renames = [op for op in todo if self.relocator.same_filesystem(op.path, op.target)]
+            rename_ids = {id(op) for op in renames}
+            self._execute(renames, self.max_workers)
+            self._execute([op for op in todo if id(op) not in rename_ids], min(self.max_workers, COPY_WORKERS))
+        else:
+            self._execute(todo, self.max_workers)
+
+        for op in todo:
+            if op.done:
+                if op.kind in (MKDIR_PARENT, MKDIR):
+                    snapshot.record_mkdir(op.path)
+                elif op.kind == MOVE:
+                    snapshot.record_move(op.path, op.target)
+                else:
+                    snapshot.record_remove(op.path)
+            elif op.kind == MOVE:
+                # 移动失败后两边的状态都不确定,下次查询时重新扫描
+                snapshot.invalidate(op.path)
+                snapshot.invalidate(op.target)
+            else:
+                snapshot.invalidate(op.path)
+
+    def _execute(self, ops, max_workers):
+        """执行一组互不依赖的操作,max_workers大于1时在线程池中并行执行"""
+        if len(ops) == 1 or max_workers <= 1:
+            for op in ops:
+                _run_operation(op, self.relocator)
+        elif ops:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(ops))) as pool:
+                list(pool.map(lambda op: _run_operation(op, self.relocator), ops))